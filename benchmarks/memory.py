@@ -0,0 +1,83 @@
+"""
+NAFT frame memory benchmark.
+
+Measures how many bytes each active :class:`naft.state.FunctionState` takes, and how many frames a steady stream of
+calls allocates.
+
+.. code::
+
+    python benchmarks/memory.py
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from naft.engine import NAFTEngine  # noqa
+from naft.state import FunctionState  # noqa
+from naft.wrapper import with_engine  # noqa
+
+
+def sample(a, b, c):
+    d = a + b
+    e = d * c
+    return e
+
+
+@with_engine
+def calls(n):
+    total = 0
+    for i in range(n):
+        total += sample(i, 1, 2)
+    return total
+
+
+def measure_active_frames(count: int) -> float:
+    """
+    :return: The number of bytes taken by each active frame.
+    """
+    code = sample.__code__
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    frames = [FunctionState(sample, code.co_consts, code.co_names, code.co_varnames, sample.__globals__)
+              for x in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del frames
+    return (after - before) / count
+
+
+def measure_calls(count: int) -> float:
+    """
+    :return: The number of frames allocated per call, by a loop of interpreted calls.
+    """
+    engine = NAFTEngine()
+    # Warm up, so that decoding isn't counted.
+    engine.run_function(calls(10))
+
+    created = [0]
+    original_init = FunctionState.__init__
+
+    def counting_init(self, *args, **kwargs):
+        created[0] += 1
+        original_init(self, *args, **kwargs)
+
+    FunctionState.__init__ = counting_init
+    try:
+        engine.run_function(calls(count))
+    finally:
+        FunctionState.__init__ = original_init
+
+    return created[0] / count
+
+
+def main():
+    print("bytes per active frame: {:>10.1f}".format(measure_active_frames(1000)))
+    print("frames allocated per call: {:>6.3f}".format(measure_calls(1000)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+NAFT return benchmark.
+
+Measures the cost of a call to a small interpreted function, with handlers returning a signal to the engine, and with
+``RETURN_VALUE`` overridden to raise :class:`naft.exceptions.signals.ReturnValue` like it used to.
+
+.. code::
+
+    python benchmarks/returns.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from naft.engine import NAFTEngine  # noqa
+from naft.exceptions import signals  # noqa
+from naft.wrapper import with_engine  # noqa
+
+
+def small(a):
+    return a
+
+
+@with_engine
+def calls(n):
+    for i in range(n):
+        small(i)
+    return n
+
+
+def raise_return_value(state, instruction):
+    raise signals.ReturnValue(state.pop())
+
+
+def measure(engine: NAFTEngine, count: int) -> float:
+    """
+    :return: The time taken per call, in microseconds.
+    """
+    # Warm up, so that decoding isn't counted.
+    engine.run_function(calls(10))
+    total = min(timeit.repeat(lambda: engine.run_function(calls(count)), number=1, repeat=5))
+    return total / count * 1000000
+
+
+def main():
+    count = 2000
+    signalled = measure(NAFTEngine(), count)
+    raised = measure(NAFTEngine(handlers={"RETURN_VALUE": raise_return_value}), count)
+
+    print("per call, returning a signal: {:>8.3f} us".format(signalled))
+    print("per call, raising ReturnValue: {:>7.3f} us".format(raised))
+    print("saved per call: {:>22.3f} us".format(raised - signalled))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+NAFT benchmarks.
+
+Runs a set of small interpreted workloads, and prints how long each one takes per run.
+Engine options can be passed on the command line to compare configurations:
+
+.. code::
+
+    python benchmarks/run.py
+    python benchmarks/run.py fuse=True
+    python benchmarks/run.py backend=register
+    python benchmarks/run.py jit=True
+    python benchmarks/run.py inline=True
+"""
+import argparse
+import ast
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from naft.engine import NAFTEngine  # noqa
+from naft.wrapper import with_engine  # noqa
+
+
+# Plain functions called from interpreted code are interpreted too.
+def identity(a):
+    return a
+
+
+@with_engine
+def calls(n):
+    total = 0
+    for i in range(n):
+        total += identity(i)
+    return total
+
+
+@with_engine
+def loop(n):
+    total = 0
+    i = 0
+    while i < n:
+        total += i * 2
+        i += 1
+    return total
+
+
+@with_engine
+def branches(n):
+    evens = 0
+    odds = 0
+    for i in range(n):
+        if i % 2 == 0:
+            evens += 1
+        else:
+            odds += 1
+    return evens, odds
+
+
+BENCHMARKS = [
+    ("calls", calls, (200,)),
+    ("loop", loop, (1000,)),
+    ("branches", branches, (1000,)),
+]
+
+
+def parse_options(items: list) -> dict:
+    options = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        try:
+            options[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            # Anything that isn't a literal is a string, such as a backend name.
+            options[name] = value
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the NAFT benchmarks.")
+    parser.add_argument("options", nargs="*", help="Engine options, as name=value.")
+    parser.add_argument("-n", "--number", type=int, default=20, help="The number of runs per benchmark.")
+    args = parser.parse_args()
+
+    options = parse_options(args.options)
+    engine = NAFTEngine(**options)
+
+    print("Engine options: {}".format(options or "default"))
+    for name, func, func_args in BENCHMARKS:
+        # Warm up, so that decoding isn't counted.
+        expected = func._callable(*func_args)
+        assert engine.run_function(func(*func_args)) == expected, name
+
+        total = min(timeit.repeat(lambda: engine.run_function(func(*func_args)), number=args.number, repeat=3))
+        print("{:<12} {:>10.3f} ms".format(name, total / args.number * 1000))
+
+
+if __name__ == "__main__":
+    main()
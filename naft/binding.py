@@ -0,0 +1,158 @@
+"""
+Argument binding.
+
+Binding the arguments of a call to the locals of a function is done with a :class:`BindingPlan`, which is worked out
+once per code object when it is decoded. The plan is then applied straight into the varnames of the new state, for
+every call, without going through :mod:`inspect`.
+"""
+import inspect
+import types
+
+from naft.state import NAFT_NULL
+
+
+def _format_names(names: list) -> str:
+    """
+    Formats a list of argument names like CPython does in its error messages.
+    """
+    names = ["'{}'".format(name) for name in names]
+    if len(names) == 1:
+        return names[0]
+    if len(names) == 2:
+        return "{} and {}".format(*names)
+    return "{}, and {}".format(", ".join(names[:-1]), names[-1])
+
+
+class BindingPlan:
+    """
+    The plan for binding the arguments of a call to the varnames of a function.
+
+    The varnames of a function start with the positional arguments, then the keyword-only arguments, then the name of
+    the ``*args`` argument, then the name of the ``**kwargs`` argument.
+
+    :param code: The code object to create the plan for.
+
+    :ivar name: The name of the code object, used in error messages.
+    :ivar argcount: The number of positional arguments.
+    :ivar kwonlyargcount: The number of keyword-only arguments.
+    :ivar names: The names of the positional and keyword-only arguments, in order.
+    :ivar indexes: A dict of argument name -> varname index, for binding keyword arguments.
+    :ivar varargs: The varname index of the ``*args`` argument, or -1 if there isn't one.
+    :ivar varkw: The varname index of the ``**kwargs`` argument, or -1 if there isn't one.
+    :ivar cells: A tuple of ``(cell index, varname index)`` for each argument that is also a cell variable.
+        NAFT doesn't implement cell variables yet, so these aren't filled in.
+    :ivar simple: If the function only has positional arguments, so that a call with exactly the right number of
+        positional arguments can be bound with one slice assignment.
+    """
+    __slots__ = ("name", "argcount", "kwonlyargcount", "names", "indexes", "varargs", "varkw", "cells", "simple")
+
+    def __init__(self, code: types.CodeType):
+        self.name = code.co_name
+        self.argcount = code.co_argcount
+        self.kwonlyargcount = code.co_kwonlyargcount
+
+        total = self.argcount + self.kwonlyargcount
+        self.names = code.co_varnames[:total]
+        self.indexes = {name: index for index, name in enumerate(self.names)}
+
+        index = total
+        if code.co_flags & inspect.CO_VARARGS:
+            self.varargs = index
+            index += 1
+        else:
+            self.varargs = -1
+        if code.co_flags & inspect.CO_VARKEYWORDS:
+            self.varkw = index
+        else:
+            self.varkw = -1
+
+        self.cells = tuple((cell, self.indexes[name]) for cell, name in enumerate(code.co_cellvars)
+                           if name in self.indexes)
+
+        self.simple = not self.kwonlyargcount and self.varargs == -1 and self.varkw == -1
+
+    def bind(self, func, args, kwargs: dict, varnames_stored: list):
+        """
+        Binds the arguments of a call into the varnames of a state.
+
+        :param func: The function being called. This provides the defaults.
+        :param args: The positional arguments.
+        :param kwargs: The keyword arguments.
+        :param varnames_stored: The storage for the varnames, which must be empty (filled with NAFT_NULL).
+        """
+        argcount = self.argcount
+        nargs = len(args)
+        if self.simple and nargs == argcount and not kwargs:
+            # The fast path; every argument is positional.
+            varnames_stored[:nargs] = args
+            return
+
+        # Positional arguments.
+        if nargs > argcount:
+            if self.varargs == -1:
+                self._too_many_positional(func, nargs)
+            varnames_stored[:argcount] = args[:argcount]
+            varnames_stored[self.varargs] = tuple(args[argcount:])
+        else:
+            varnames_stored[:nargs] = args
+            if self.varargs != -1:
+                varnames_stored[self.varargs] = ()
+
+        # Keyword arguments.
+        if self.varkw != -1:
+            extra = varnames_stored[self.varkw] = {}
+        if kwargs:
+            indexes = self.indexes
+            for name, value in kwargs.items():
+                index = indexes.get(name)
+                if index is None:
+                    if self.varkw == -1:
+                        raise TypeError("{}() got an unexpected keyword argument '{}'".format(self.name, name))
+                    extra[name] = value
+                    continue
+                if varnames_stored[index] is not NAFT_NULL:
+                    raise TypeError("{}() got multiple values for argument '{}'".format(self.name, name))
+                varnames_stored[index] = value
+
+        # Defaults for the positional arguments that weren't given.
+        if nargs < argcount:
+            defaults = func.__defaults__ or ()
+            first_default = argcount - len(defaults)
+            missing = []
+            for index in range(nargs, argcount):
+                if varnames_stored[index] is NAFT_NULL:
+                    if index >= first_default:
+                        varnames_stored[index] = defaults[index - first_default]
+                    else:
+                        missing.append(self.names[index])
+            if missing:
+                raise TypeError("{}() missing {} required positional argument{}: {}".format(
+                    self.name, len(missing), "s" if len(missing) > 1 else "", _format_names(missing)))
+
+        # Defaults for the keyword-only arguments that weren't given.
+        if self.kwonlyargcount:
+            kwdefaults = func.__kwdefaults__ or {}
+            missing = []
+            for index in range(argcount, argcount + self.kwonlyargcount):
+                if varnames_stored[index] is NAFT_NULL:
+                    name = self.names[index]
+                    if name in kwdefaults:
+                        varnames_stored[index] = kwdefaults[name]
+                    else:
+                        missing.append(name)
+            if missing:
+                raise TypeError("{}() missing {} required keyword-only argument{}: {}".format(
+                    self.name, len(missing), "s" if len(missing) > 1 else "", _format_names(missing)))
+
+    def _too_many_positional(self, func, nargs: int):
+        """
+        Raises the error for a call with too many positional arguments.
+        """
+        n_defaults = len(func.__defaults__ or ())
+        if n_defaults:
+            takes = "from {} to {}".format(self.argcount - n_defaults, self.argcount)
+        else:
+            takes = str(self.argcount)
+        raise TypeError("{}() takes {} positional argument{} but {} {} given".format(
+            self.name, takes, "" if self.argcount == 1 and not n_defaults else "s", nargs,
+            "was" if nargs == 1 else "were"))
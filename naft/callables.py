@@ -0,0 +1,122 @@
+"""
+Callable classification.
+
+Every call made by interpreted code needs to know whether the engine should run the callee itself, or just call it
+natively. Working this out is slow, so each callable is classified once, and the result is cached.
+"""
+import inspect
+import types
+import weakref
+
+from naft.wrapper import NFunction
+
+# A builtin function or method, which is always called natively.
+CALLABLE_BUILTIN = 0
+
+# A plain Python function, which is run by the engine.
+CALLABLE_FUNCTION = 1
+
+# A function wrapped with ``with_engine``, which is run by the engine with its own options.
+CALLABLE_NFUNCTION = 2
+
+# A function marked with ``_no_naft_execute``, which is called natively.
+CALLABLE_NO_NAFT = 3
+
+# Anything else, such as a class or a callable object, which is called natively.
+CALLABLE_OTHER = 4
+
+# A bound method, which is unpacked so that the function it wraps can be classified instead.
+CALLABLE_METHOD = 5
+
+# A generator function or a coroutine function, which creates a generator run by the engine; see :mod:`naft.generator`.
+CALLABLE_GENERATOR = 6
+
+# Code flags of functions that return a generator or a coroutine.
+GENERATOR_FLAGS = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE
+
+# The code flag of asynchronous generator functions, which only exist on Python 3.6 and above.
+ASYNC_GENERATOR_FLAG = getattr(inspect, "CO_ASYNC_GENERATOR", 0)
+
+# Maps type -> kind, for types where every instance has the same kind.
+_TYPE_KINDS = {
+    types.BuiltinFunctionType: CALLABLE_BUILTIN,
+    type(object.__init__): CALLABLE_BUILTIN,  # wrapper_descriptor
+    type(object().__str__): CALLABLE_BUILTIN,  # method-wrapper
+    type(str.join): CALLABLE_BUILTIN,  # method_descriptor
+    type: CALLABLE_OTHER,
+    types.MethodType: CALLABLE_METHOD,
+}
+
+# Maps id(callable) -> (weakref to callable, kind).
+# Like the code cache, this is keyed on the id and checked against the weakref, as callables aren't always hashable.
+_kinds = {}
+
+
+def _evict(key: int):
+    """
+    Returns a weakref callback that removes ``key`` from the cache.
+    """
+
+    def _callback(ref):
+        entry = _kinds.get(key)
+        # Make sure this is still the same entry; the id may have been re-used.
+        if entry is not None and entry[0] is ref:
+            del _kinds[key]
+
+    return _callback
+
+
+def _classify(func) -> int:
+    """
+    Works out the kind of a callable, without the cache.
+    """
+    if hasattr(func, "_no_naft_execute"):
+        return CALLABLE_NO_NAFT
+    if isinstance(func, types.FunctionType):
+        flags = func.__code__.co_flags
+        if flags & ASYNC_GENERATOR_FLAG:
+            # Asynchronous generators aren't supported, so they are left to Python.
+            return CALLABLE_OTHER
+        if flags & GENERATOR_FLAGS:
+            return CALLABLE_GENERATOR
+        return CALLABLE_FUNCTION
+    if isinstance(func, NFunction):
+        return CALLABLE_NFUNCTION
+    if isinstance(func, types.BuiltinFunctionType):
+        return CALLABLE_BUILTIN
+    return CALLABLE_OTHER
+
+
+def classify(func) -> int:
+    """
+    Classifies a callable, so the engine knows how to call it.
+
+    :param func: The callable to classify.
+    :return: One of the ``CALLABLE_`` kinds.
+    """
+    kind = _TYPE_KINDS.get(func.__class__)
+    if kind is not None:
+        return kind
+
+    key = id(func)
+    entry = _kinds.get(key)
+    if entry is not None and entry[0]() is func:
+        return entry[1]
+
+    kind = _classify(func)
+    try:
+        _kinds[key] = (weakref.ref(func, _evict(key)), kind)
+    except TypeError:
+        # The callable can't be weakly referenced, so it can't be cached.
+        pass
+    return kind
+
+
+def clear():
+    """
+    Clears the cache.
+
+    A callable is only classified once, so this must be called if ``_no_naft_execute`` is set on a function after it has
+    been called.
+    """
+    _kinds.clear()
@@ -0,0 +1,411 @@
+"""
+Decoded code objects.
+
+Disassembling a function with :func:`dis.get_instructions` is slow, and allocates a full :class:`dis.Instruction` for
+every instruction. Instead, each code object is decoded exactly once into a compact array of :class:`NInstruction`
+objects, which is then cached and re-used for every call to the function.
+"""
+import dis
+import types
+import weakref
+
+from naft.binding import BindingPlan
+from naft.fusion import fuse_instructions
+from naft.inline import InlinedCall, handle_inline_call, handle_inline_return, mark_call_sites
+from naft.instruction import NInstruction
+from naft.jit import anchor_loops
+from naft.ops import DISPATCH_TABLE
+from naft.ops.attr import AttrCache, handle_load_attr_cached, handle_load_method_cached
+from naft.ops.dispatch import handle_bad_opcode
+from naft.ops.load import GlobalCache, handle_load_global_cached
+from naft.optimizer import optimize as optimize_instructions
+from naft.quicken import quicken as quicken_instructions
+from naft.tailcall import mark_tail_calls
+
+LOAD_GLOBAL = dis.opmap["LOAD_GLOBAL"]
+RETURN_VALUE = dis.opmap["RETURN_VALUE"]
+
+# Maps opcode -> cached handler, for the attribute loads that can be cached.
+# LOAD_METHOD only exists on Python 3.7 and above.
+ATTRIBUTE_CACHED_HANDLERS = {dis.opmap[opname]: handler for opname, handler in (
+    ("LOAD_ATTR", handle_load_attr_cached), ("LOAD_METHOD", handle_load_method_cached)) if opname in dis.opmap}
+
+# Opcodes which have a jump target as their argument.
+JUMP_OPCODES = frozenset(dis.hasjrel + dis.hasjabs)
+
+# Opcodes whose argument indexes the locals, the constants or the names, which move when a function is inlined.
+LOCAL_OPCODES = frozenset(dis.haslocal)
+CONST_OPCODES = frozenset(dis.hasconst)
+NAME_OPCODES = frozenset(dis.hasname)
+
+
+class DecodedCode:
+    """
+    The decoded form of a code object.
+
+    This deliberately does not keep a reference to the code object it was created from, so that the cache can evict
+    it when the code object dies.
+
+    :ivar name: The name of the code object.
+    :ivar instructions: The list of :class:`NInstruction` objects for this code object.
+    :ivar consts: The constants for this code object. These are the constants of the code object, plus any values
+        folded by the optimizer, and the constants of inlined functions.
+    :ivar names: The names for this code object, plus the names of inlined functions.
+    :ivar varnames: The locals for this code object, plus the locals of inlined functions.
+    :ivar stacksize: The size of the stack needed to run this code object, and any function inlined into it.
+    :ivar inlines: A dict of call offset -> the function inlined there.
+    :ivar inlined: A list of :class:`naft.inline.InlinedCall` for each function inlined into this code object.
+    :ivar tail_calls: A list of the offsets of each call that elides the frame of this code object; see
+        :mod:`naft.tailcall`.
+    :ivar fusions: A list of ``(offset, name)`` for each superinstruction that was fused into this code object.
+    :ivar optimizations: A list of ``(offset, name)`` for each optimization made by :mod:`naft.optimizer`.
+    :ivar plan: The :class:`naft.binding.BindingPlan` for calls to this code object.
+    :ivar threaded: The :class:`naft.threaded.ThreadedCode` for this code object.
+        This is compiled the first time the function is run with the threaded backend.
+    :ivar register: The :class:`naft.register.RegisterCode` for this code object, or False if it can't be translated.
+        This is compiled the first time the function is run with the register backend.
+    :ivar free_states: A list of released :class:`naft.state.FunctionState` objects for this code object, which are
+        re-used for new calls instead of allocating a new state.
+    """
+    __slots__ = ("name", "instructions", "consts", "names", "varnames", "stacksize", "fusions", "optimizations",
+                 "plan", "inlines", "inlined", "tail_calls", "threaded", "register", "free_states")
+
+    def __init__(self, name: str, instructions: list, fusions: list = None, plan: BindingPlan = None,
+                 consts: tuple = (), optimizations: list = None, names: tuple = (), varnames: tuple = (),
+                 stacksize: int = 0, inlines: dict = None, inlined: list = None, tail_calls: list = None):
+        self.name = name
+        self.instructions = instructions
+        self.consts = consts
+        self.names = names
+        self.varnames = varnames
+        self.stacksize = stacksize
+        self.inlines = inlines if inlines is not None else {}
+        self.inlined = inlined if inlined is not None else []
+        self.tail_calls = tail_calls if tail_calls is not None else []
+        self.fusions = fusions if fusions is not None else []
+        self.optimizations = optimizations if optimizations is not None else []
+        self.plan = plan
+        self.threaded = None
+        self.register = None
+        self.free_states = []
+
+    def __repr__(self):  # pragma: no cover
+        return "<DecodedCode for {} ({} instructions)>".format(self.name, len(self.instructions))
+
+
+def decode(code: types.CodeType, table: list = None, fuse: bool = False, cache_globals: bool = False,
+           quicken: bool = False, cache_attributes: bool = False, optimize: bool = False,
+           jit: bool = False, inline: bool = False, inlines: dict = None, tail_calls: bool = False) -> DecodedCode:
+    """
+    Decodes a code object into a :class:`DecodedCode`.
+
+    :param code: The code object to decode.
+    :param table: The dispatch table used to resolve handlers. Defaults to the global dispatch table.
+    :param fuse: If common pairs of instructions should be fused into superinstructions.
+    :param cache_globals: If ``LOAD_GLOBAL`` instructions should get an inline cache.
+        Cached values are invalidated when NAFT writes to the globals; see :mod:`naft.watch` for writes made by native
+        code.
+    :param quicken: If instructions should be specialised for the operand types they see; see :mod:`naft.quicken`.
+    :param cache_attributes: If attribute loads should get an inline cache keyed on the type of the receiver; see
+        :mod:`naft.ops.attr`.
+    :param optimize: If the instructions should be optimized before anything else; see :mod:`naft.optimizer`.
+    :param jit: If loops should be counted, so that hot loops can be traced; see :mod:`naft.jit`.
+    :param inline: If calls should count the functions they call, so that small functions can be inlined; see
+        :mod:`naft.inline`.
+    :param inlines: A dict of call offset -> the function to inline there.
+    :param tail_calls: If calls immediately followed by a return should elide the frame of the caller; see
+        :mod:`naft.tailcall`.
+    :return: A new :class:`DecodedCode` for this code object.
+    """
+    if table is None:
+        table = DISPATCH_TABLE
+
+    instructions = read_instructions(code, table)
+    consts = code.co_consts
+    names = code.co_names
+    varnames = code.co_varnames
+    stacksize = code.co_stacksize
+    inlined = []
+    if inlines:
+        instructions, consts, names, varnames, stacksize, inlined = inline_calls(code, instructions, inlines, table)
+
+    # Tail calls are marked first, so that they aren't inlined.
+    tail_call_offsets = []
+    if tail_calls:
+        tail_call_offsets = mark_tail_calls(code, instructions)
+
+    if inline:
+        mark_call_sites(instructions, len(code.co_code))
+
+    optimizations = []
+    if optimize:
+        instructions, consts, optimizations = optimize_instructions(instructions, consts)
+
+    if cache_globals:
+        add_global_caches(instructions, names)
+
+    if cache_attributes:
+        add_attribute_caches(instructions, names)
+
+    if jit:
+        anchor_loops(instructions)
+
+    fusions = []
+    if fuse:
+        instructions, fusions = fuse_instructions(instructions)
+
+    if quicken:
+        quicken_instructions(instructions)
+
+    link(instructions)
+    return DecodedCode(code.co_name, instructions, fusions, BindingPlan(code), consts, optimizations, names, varnames,
+                       stacksize, dict(inlines or {}), inlined, tail_call_offsets)
+
+
+def read_instructions(code: types.CodeType, table: list) -> list:
+    """
+    Reads the instructions of a code object into a list of :class:`NInstruction`, with their handlers resolved.
+
+    Jump targets are left as bytecode offsets; see :func:`link`.
+    """
+    instructions = []
+    line_no = code.co_firstlineno
+    for instruction in dis.get_instructions(code):
+        if instruction.starts_line:
+            line_no = instruction.starts_line
+        # Opcodes without an implementation only raise if they are actually reached.
+        handler = table[instruction.opcode] or handle_bad_opcode
+        decoded = NInstruction(instruction.opcode, instruction.arg, handler, line_no, instruction.offset)
+        if instruction.opcode in JUMP_OPCODES:
+            # Until the instructions are linked, the target is a bytecode offset.
+            # argval is the absolute offset for both relative and absolute jumps.
+            decoded.target = instruction.argval
+        instructions.append(decoded)
+    return instructions
+
+
+def inline_calls(code: types.CodeType, instructions: list, inlines: dict, table: list) -> tuple:
+    """
+    Splices the instructions of inlined functions into the instructions of a code object, at their call sites.
+
+    This must run before the instructions are linked. The instructions of each inlined function are given offsets after
+    the end of the code object, so that every offset is still unique.
+
+    :param code: The code object the instructions are from.
+    :param instructions: The instructions of the code object.
+    :param inlines: A dict of call offset -> the function to inline there; see :func:`naft.inline.can_inline`.
+    :param table: The dispatch table used to resolve handlers.
+    :return: A tuple of the new instructions, consts, names, varnames and stack size, and a list of
+        :class:`naft.inline.InlinedCall`.
+    """
+    consts = list(code.co_consts)
+    names = list(code.co_names)
+    varnames = list(code.co_varnames)
+    extra_stack = 0
+    start = len(code.co_code)
+
+    spliced = []
+    inlined = []
+    for index, instruction in enumerate(instructions):
+        func = inlines.get(instruction.offset)
+        if func is None:
+            spliced.append(instruction)
+            continue
+
+        # The call always has something after it, such as the RETURN_VALUE of the caller.
+        resume = instructions[index + 1].offset
+        call = InlinedCall(func, len(varnames), instruction.line_no, instruction.offset, start)
+        callee = call.code
+        const_base = len(consts)
+        name_base = len(names)
+        consts.extend(callee.co_consts)
+        names.extend(callee.co_names)
+        varnames.extend(callee.co_varnames)
+        extra_stack = max(extra_stack, callee.co_stacksize)
+
+        guard = NInstruction(instruction.opcode, instruction.arg, handle_inline_call, instruction.line_no,
+                             instruction.offset, resume)
+        guard.cache = call
+        spliced.append(guard)
+        for callee_instruction in read_instructions(callee, table):
+            opcode = callee_instruction.opcode
+            if opcode in LOCAL_OPCODES:
+                callee_instruction.arg += call.base
+            elif opcode in CONST_OPCODES:
+                callee_instruction.arg += const_base
+            elif opcode in NAME_OPCODES:
+                callee_instruction.arg += name_base
+            callee_instruction.offset += start
+            if callee_instruction.target is not None:
+                callee_instruction.target += start
+            if opcode == RETURN_VALUE:
+                callee_instruction.handler = handle_inline_return
+                callee_instruction.target = resume
+                callee_instruction.cache = call
+            spliced.append(callee_instruction)
+
+        inlined.append(call)
+        start = call.end
+
+    return spliced, tuple(consts), tuple(names), tuple(varnames), code.co_stacksize + extra_stack, inlined
+
+
+def add_global_caches(instructions: list, names: tuple):
+    """
+    Gives every ``LOAD_GLOBAL`` instruction an inline cache.
+
+    Instructions whose handler was overridden are left alone, so that the override still runs.
+    """
+    for instruction in instructions:
+        if instruction.handler is DISPATCH_TABLE[LOAD_GLOBAL]:
+            instruction.handler = handle_load_global_cached
+            instruction.cache = GlobalCache(names[instruction.arg])
+
+
+def add_attribute_caches(instructions: list, names: tuple):
+    """
+    Gives every ``LOAD_ATTR`` and ``LOAD_METHOD`` instruction an inline cache.
+
+    Instructions whose handler was overridden are left alone, so that the override still runs.
+    """
+    for instruction in instructions:
+        opcode = instruction.opcode
+        if opcode in ATTRIBUTE_CACHED_HANDLERS and instruction.handler is DISPATCH_TABLE[opcode]:
+            instruction.handler = ATTRIBUTE_CACHED_HANDLERS[opcode]
+            instruction.cache = AttrCache(names[instruction.arg])
+
+
+def link(instructions: list):
+    """
+    Translates the jump targets of a list of instructions from bytecode offsets into indexes.
+
+    This means jumping is just an assignment to the program counter.
+    """
+    indexes = {instruction.offset: index for index, instruction in enumerate(instructions)}
+    for instruction in instructions:
+        if instruction.target is not None:
+            instruction.target = indexes[instruction.target]
+
+
+class CodeCache:
+    """
+    A cache of :class:`DecodedCode`, keyed on the code object.
+
+    Entries are held with a weak reference to the code object, and are evicted automatically when the code object is
+    garbage collected.
+
+    :param table: The dispatch table used to resolve handlers. Defaults to the global dispatch table.
+    :param options: Options passed to :func:`decode` for every code object, such as ``fuse``.
+
+    :ivar hits: The number of lookups that were served from the cache.
+    :ivar misses: The number of lookups that had to decode the code object.
+    """
+
+    def __init__(self, table: list = None, **options):
+        self.table = table
+        self.options = options
+        # Maps id(code) -> (weakref to code, DecodedCode).
+        # Code objects compare equal by value, so they can't be used as keys directly.
+        self._entries = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self, key: int):
+        """
+        Returns a weakref callback that removes ``key`` from the cache.
+        """
+
+        def _callback(ref):
+            entry = self._entries.get(key)
+            # Make sure this is still the same entry; the id may have been re-used.
+            if entry is not None and entry[0] is ref:
+                del self._entries[key]
+
+        return _callback
+
+    def get(self, code: types.CodeType) -> DecodedCode:
+        """
+        Gets the decoded form of a code object, decoding it if it isn't cached.
+
+        :param code: The code object to look up.
+        :return: The :class:`DecodedCode` for this code object.
+        """
+        key = id(code)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0]() is code:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        decoded = decode(code, self.table, **self.options)
+        self._entries[key] = (weakref.ref(code, self._evict(key)), decoded)
+        return decoded
+
+    def add_inline(self, code: types.CodeType, offset: int, func):
+        """
+        Decodes a code object again, with a function inlined at one of its calls.
+
+        The new decoded code replaces the one in the cache, and keeps everything that was already inlined into it. Only
+        calls made after this use it; functions that are already running keep the code they started with.
+
+        :param code: The code object of the caller.
+        :param offset: The offset of the call.
+        :param func: The function to inline; see :func:`naft.inline.can_inline`.
+        """
+        key = id(code)
+        entry = self._entries.get(key)
+        if entry is None or entry[0]() is not code or offset in entry[1].inlines:
+            return
+        inlines = dict(entry[1].inlines)
+        inlines[offset] = func
+        self._entries[key] = (entry[0], decode(code, self.table, inlines=inlines, **self.options))
+
+    def clear(self):
+        """
+        Clears the cache, and resets the counters.
+        """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        :return: A dict of the hits, misses and current size of the cache.
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, code):
+        entry = self._entries.get(id(code))
+        return entry is not None and entry[0]() is code
+
+
+# The default values of the options to :func:`decode`.
+DEFAULT_OPTIONS = {"fuse": False, "cache_globals": False, "quicken": False, "cache_attributes": False,
+                   "optimize": False, "jit": False, "inline": False, "tail_calls": False}
+
+# Caches shared between engines, keyed by their options.
+_shared_caches = {}
+
+
+def get_shared_cache(**options) -> CodeCache:
+    """
+    Gets the cache shared between all engines that use the default dispatch table, and the same options.
+
+    :param options: Options passed to :func:`decode`, such as ``fuse``.
+    :return: The shared :class:`CodeCache` for these options.
+    """
+    # Options left at their default don't change how code is decoded, so they shouldn't change the cache.
+    key = tuple(sorted((name, value) for name, value in options.items() if DEFAULT_OPTIONS.get(name) != value))
+    try:
+        return _shared_caches[key]
+    except KeyError:
+        cache = _shared_caches[key] = CodeCache(**options)
+        return cache
+
+
+# The cache shared between all engines with the default options.
+default_cache = get_shared_cache()
@@ -4,20 +4,37 @@ Engine class.
 Used to actually run the bytecode.
 """
 import collections
-import dis
 import logging
 import traceback
 import types
 
 import sys
+from naft import code
+from naft.callables import CALLABLE_FUNCTION, CALLABLE_GENERATOR, classify
 from naft.exceptions import signals
-from naft.exceptions.base import NFBaseException
-from naft.exceptions.internal import BadOpcode
+from naft.exceptions.base import NFBaseException, NFRecursionError
 from naft.exceptions.nframe import NFrame
 from naft.exceptions.ntraceback import NTraceback
-from naft.ops import find_operator_implementation
+from naft.generator import COROUTINE_FLAGS, NCoroutine, NGenerator, make_generator
+from naft.hooks import EngineHook
+from naft.jit import JIT_THRESHOLD, LoopAnchor, TRACE_CACHE_SIZE, TraceCache
+from naft.ops import DISPATCH_TABLE, register
+from naft.ops.attr import AttrCache
+from naft.ops.load import GlobalCache
+from naft.profiler import Profiler
+from naft.quicken import Specialization
+from naft.register import compile_register
 from naft.state import FunctionState, NAFT_NULL
-from naft.wrapper import _NRunnableObject
+from naft.threaded import compile_threaded
+from naft.wrapper import BACKENDS, NFunction, _NRunnableObject
+
+
+# The maximum number of released states kept for re-use, per code object.
+# Only recursive functions need more than one, so this doesn't need to be large.
+MAX_FREE_STATES = 8
+
+# The default maximum depth of interpreted calls.
+DEFAULT_RECURSION_LIMIT = 10000
 
 
 class NAFTEngine(object):
@@ -25,18 +42,258 @@ class NAFTEngine(object):
     The engine is responsible for executing bytecode. It does so by looping over each instruction, and modifying the
     function state at the time, then continuing.
 
-    The engine uses several SignallingException subclasses to signal to the loop how to proceed.
-    These should never leak out of the loop. If they do, this is a major bug.
+    Handlers tell the loop how to proceed by returning one of the ``WHY_`` codes in :mod:`naft.exceptions.signals`:
+    the function is returning, yielding, or has pushed a call to another interpreted function. A handler that returns
+    None lets the loop carry on with the next instruction. Handlers that still raise the old ``ReturnValue`` signal are
+    handled too, but these should never leak out of the loop. If they do, this is a major bug.
+
+    :param code_cache: The :class:`naft.code.CodeCache` to use for decoded functions.
+        If this is not provided, the cache shared between all engines is used.
+    :param handlers: A dict of opcode (or opname) to handler, which override the default operators for this engine.
+    :param fuse: If common pairs of instructions should be fused into superinstructions.
+        This is ignored if a ``code_cache`` is passed, as the cache decides how code is decoded.
+    :param cache_globals: If ``LOAD_GLOBAL`` instructions should cache the value they load.
+        Writes made by NAFT invalidate the caches; writes to the globals made by native code must call
+        :func:`naft.watch.changed`, or they aren't seen. This is ignored if a ``code_cache`` is passed.
+    :param quicken: If instructions should be specialised for the operand types they see; see :mod:`naft.quicken`.
+        This is ignored if a ``code_cache`` is passed.
+    :param cache_attributes: If ``LOAD_ATTR`` and ``LOAD_METHOD`` instructions should cache how they find attributes,
+        keyed on the type of the receiver. Changes to classes made by NAFT invalidate the caches; changes made by native
+        code must call :func:`naft.watch.changed_class`, or they aren't seen. This is ignored if a ``code_cache`` is
+        passed.
+    :param optimize: If decoded code should be optimized before it is run; see :mod:`naft.optimizer`.
+        This is ignored if a ``code_cache`` is passed.
+    :param inline: If small functions should be inlined into the functions that call them; see :mod:`naft.inline`.
+        This is ignored if a ``code_cache`` is passed.
+    :param jit: If hot loops should be compiled into Python functions; see :mod:`naft.jit`.
+        Traces only run with the ``stack`` backend. This is ignored if a ``code_cache`` is passed.
+    :param tail_calls: If calls immediately followed by a return should replace the frame of the caller, so that
+        tail-recursive code runs in constant space; see :mod:`naft.tailcall`. Functions wrapped with
+        ``with_engine(tail_calls=...)`` override this. The engine default is ignored if a ``code_cache`` is passed.
+    :param jit_threshold: The number of times a loop goes round before it is traced.
+    :param trace_cache_size: The most compiled traces this engine keeps.
+    :param backend: The backend used to run functions; one of :data:`BACKENDS`.
+        Functions wrapped with ``with_engine(backend=...)`` override this.
+    :param recursion_limit: The maximum depth of interpreted calls.
+        Interpreted calls don't use the Python stack, so this can be set far above :func:`sys.getrecursionlimit`.
     """
 
-    def __init__(self, ):
+    def __init__(self, code_cache: code.CodeCache = None, handlers: dict = None, fuse: bool = False,
+                 backend: str = "stack", cache_globals: bool = False, quicken: bool = False,
+                 cache_attributes: bool = False, optimize: bool = False, inline: bool = False, jit: bool = False,
+                 tail_calls: bool = False, jit_threshold: int = JIT_THRESHOLD, trace_cache_size: int = TRACE_CACHE_SIZE,
+                 recursion_limit: int = DEFAULT_RECURSION_LIMIT):
         # Define our own call stack.
         # This allows us to print a proper call stack, if we can.
         self._call_stack = collections.deque()
 
         self.logger = logging.getLogger("NAFT.engine")
 
-        self._root = None
+        # The cache of decoded code objects.
+        if code_cache is None:
+            code_cache = code.get_shared_cache(fuse=fuse, cache_globals=cache_globals, quicken=quicken,
+                                               cache_attributes=cache_attributes, optimize=optimize, inline=inline,
+                                               jit=jit, tail_calls=tail_calls)
+        self.code_cache = code_cache
+        # The cache used for functions that override ``tail_calls``, which is created when one is first called.
+        self._tail_call_cache = None
+
+        # The compiled traces of hot loops.
+        self.trace_cache = TraceCache(trace_cache_size, jit_threshold)
+
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend '{}'".format(backend))
+        self.backend = backend
+
+        self.recursion_limit = recursion_limit
+
+        # The loops a state can be run with, bound once, so that a call doesn't create a bound method, and so that the
+        # runner of a state can be checked with ``is``.
+        self._loop_runner = self._run_loop
+        self._hooked_runner = self._run_loop_hooked
+        self._threaded_runner = self._run_threaded
+        self._register_runner = self._run_register
+
+        # The hooks installed on this engine.
+        self.hooks = []
+
+        # The dispatch table for this engine.
+        # This is the global table, unless a handler is overridden.
+        self.dispatch_table = self.code_cache.table if self.code_cache.table is not None else DISPATCH_TABLE
+
+        if handlers:
+            for opcode, handler in handlers.items():
+                self.register_handler(opcode, handler)
+
+    def register_handler(self, opcode, handler):
+        """
+        Overrides the handler for an opcode on this engine only.
+
+        The engine is given a private copy of the dispatch table and a new code cache, as handlers are resolved when a
+        code object is decoded.
+
+        :param opcode: The opcode to override, either as a number or as an opname.
+        :param handler: The new handler. This is called with the state and the instruction.
+        """
+        self.dispatch_table = list(self.dispatch_table)
+        register(opcode, self.dispatch_table)(handler)
+        # Any decoded code will have the old handler, so start a new cache.
+        self.code_cache = code.CodeCache(self.dispatch_table, **self.code_cache.options)
+        self._tail_call_cache = None
+
+    def add_hook(self, hook: EngineHook):
+        """
+        Installs a hook on this engine.
+
+        :param hook: The :class:`naft.hooks.EngineHook` to install.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: EngineHook):
+        """
+        Removes a hook from this engine.
+
+        :param hook: The :class:`naft.hooks.EngineHook` to remove.
+        """
+        self.hooks.remove(hook)
+
+    def get_fusions(self, function) -> list:
+        """
+        Gets the superinstructions that were fused into a function by this engine.
+
+        :param function: The function to inspect. This can be a plain function, or an :class:`naft.wrapper.NFunction`.
+        :return: A list of ``(offset, name)`` for each fusion.
+        """
+        if isinstance(function, NFunction):
+            function = function._callable
+        return self.code_cache.get(function.__code__).fusions
+
+    def get_optimizations(self, function) -> list:
+        """
+        Gets the optimizations made to a function by this engine.
+
+        :param function: The function to inspect. This can be a plain function, or an :class:`naft.wrapper.NFunction`.
+        :return: A list of ``(offset, name)`` for each optimization; see :mod:`naft.optimizer`.
+        """
+        if isinstance(function, NFunction):
+            function = function._callable
+        return self.code_cache.get(function.__code__).optimizations
+
+    def _get_decoded(self, function=None) -> list:
+        """
+        Gets the decoded code of a function, or of every function in the code cache.
+        """
+        if function is None:
+            return [entry[1] for entry in self.code_cache._entries.values()]
+        if isinstance(function, NFunction):
+            function = function._callable
+        return [self.code_cache.get(function.__code__)]
+
+    def _get_instructions(self, function=None):
+        """
+        Gets the decoded instructions of a function, or of every function in the code cache.
+
+        Functions run with the ``register`` backend are decoded again for the translation, so that copy of the
+        instructions, with its own caches, is included too.
+
+        :return: An iterator of ``(function name, instructions)``.
+        """
+        for decoded in self._get_decoded(function):
+            yield decoded.name, decoded.instructions
+            if decoded.register:
+                yield decoded.name, decoded.register.instructions
+
+    def get_global_cache_stats(self, function=None) -> list:
+        """
+        Gets the hits and misses of the ``LOAD_GLOBAL`` inline caches.
+
+        :param function: The function to inspect. This can be a plain function, or an :class:`naft.wrapper.NFunction`.
+            If this is not provided, every function in the code cache is included.
+        :return: A list of ``(function name, offset, global name, hits, misses)`` for each cached ``LOAD_GLOBAL``.
+            A function run with the ``register`` backend has a second set of caches, which are listed separately.
+        """
+        stats = []
+        for name, instructions in self._get_instructions(function):
+            for instruction in instructions:
+                if isinstance(instruction.cache, GlobalCache):
+                    cache = instruction.cache
+                    stats.append((name, instruction.offset, cache.name, cache.hits, cache.misses))
+        return stats
+
+    def get_specialization_stats(self, function=None) -> list:
+        """
+        Gets what the quickened instructions have been specialised to.
+
+        :param function: The function to inspect. This can be a plain function, or an :class:`naft.wrapper.NFunction`.
+            If this is not provided, every function in the code cache is included.
+        :return: A list of ``(function name, offset, opname, specialisation, specialisations, deopts)`` for each
+            quickened instruction. The specialisation is the name of the specialised variant currently in use, or None.
+        """
+        stats = []
+        for name, instructions in self._get_instructions(function):
+            for instruction in instructions:
+                if isinstance(instruction.cache, Specialization):
+                    cache = instruction.cache
+                    stats.append((name, instruction.offset, instruction.opname, cache.name, cache.specializations,
+                                  cache.deopts))
+        return stats
+
+    def get_attribute_cache_stats(self, function=None) -> list:
+        """
+        Gets how the attribute caches found their attributes, and their hits and misses.
+
+        :param function: The function to inspect. This can be a plain function, or an :class:`naft.wrapper.NFunction`.
+            If this is not provided, every function in the code cache is included.
+        :return: A list of ``(function name, offset, attribute name, kind, hits, misses)`` for each cached attribute
+            load. The kind is the name of one of the ``ATTR_`` kinds in :mod:`naft.ops.attr`, or None if the
+            instruction hasn't run yet. A function run with the ``register`` backend has a second set of caches, which
+            are listed separately.
+        """
+        stats = []
+        for name, instructions in self._get_instructions(function):
+            for instruction in instructions:
+                if isinstance(instruction.cache, AttrCache):
+                    cache = instruction.cache
+                    kind = cache.kind_name if cache.type is not None else None
+                    stats.append((name, instruction.offset, cache.name, kind, cache.hits, cache.misses))
+        return stats
+
+    def get_trace_stats(self, function=None) -> list:
+        """
+        Gets the loops that have been traced, and how often their traces were entered and left.
+
+        :param function: The function to inspect. This can be a plain function, or an :class:`naft.wrapper.NFunction`.
+            If this is not provided, every function in the code cache is included.
+        :return: A list of ``(function name, header offset, length, entries, exits)`` for each loop with a trace.
+            ``exits`` is a dict of the offset the interpreter carried on from -> the number of times the trace left
+            there.
+        """
+        stats = []
+        for decoded in self._get_decoded(function):
+            for instruction in decoded.instructions:
+                if isinstance(instruction.cache, LoopAnchor) and instruction.cache.trace is not None:
+                    trace = instruction.cache.trace
+                    exits = {}
+                    for offset, count in zip(trace.exit_offsets, trace.exit_counts):
+                        if count:
+                            exits[offset] = exits.get(offset, 0) + count
+                    stats.append((decoded.name, trace.offset, trace.length, trace.entries, exits))
+        return stats
+
+    def get_inline_stats(self, function=None) -> list:
+        """
+        Gets the functions that have been inlined, and how often the inlined code ran.
+
+        :param function: The function to inspect. This can be a plain function, or an :class:`naft.wrapper.NFunction`.
+            If this is not provided, every function in the code cache is included.
+        :return: A list of ``(function name, call offset, inlined function name, hits, misses)`` for each inlined call.
+            A miss is a call to a different function, which was called as normal.
+        """
+        stats = []
+        for decoded in self._get_decoded(function):
+            for call in decoded.inlined:
+                stats.append((decoded.name, call.offset, call.code.co_name, call.hits, call.misses))
+        return stats
 
     @staticmethod
     def _get_function_object(object_to_inspect):
@@ -54,58 +311,366 @@ class NAFTEngine(object):
         """
         Rewrites a traceback using the call stack.
 
+        The call stack only holds the state of each function that was running. The frames and tracebacks are only
+        built here, once an exception has escaped, using the program counter of each state.
+
         :param exception: The exception that was raised.
         :return: A :class:`naft.exceptions.ntraceback.NTraceback` that represents the current traceback.
         """
         tracebacks = []
-        for x in range(len(self._call_stack)):
-            # Pop the left of the traceback.
-            state, instruction = self._call_stack.popleft()
-            # Create a frame object.
+        # The frames still on the call stack are the outermost, followed by the frames the exception already left.
+        states = list(self._call_stack) + exception._frames
+        self._call_stack.clear()
+        for state in states:
             assert isinstance(state, FunctionState)
-            assert isinstance(instruction, dis.Instruction)
-            frame = NFrame()
-            frame.f_code = state._wrapped_func.__code__
-            frame.f_globals = state._wrapped_func.__globals__
-            # Calculate locals.
-            for xx, val in enumerate(state.names_stored):
-                if val == NAFT_NULL:
-                    continue
+            code_object = state._wrapped_func.__code__
+            lasti = state.instructions[state.pc - 1].offset if state.pc else 0
+            first = len(tracebacks)
 
-                name = state.names[xx]
-                frame.f_locals[name] = val
+            # An instruction of an inlined function gets a frame for the call, and a frame for the inlined function.
+            inlined = None
+            for call in state.decoded.inlined:
+                if call.start <= lasti < call.end:
+                    inlined = call
+                    break
 
-            frame.f_lineno = state.line_no
-            # Create a traceback object that is associated with this frame.
-            tbobb = NTraceback()
-            tbobb.tb_frame = frame
-            tbobb.tb_lineno = frame.f_lineno
-            # Set tb_next of the tracebacks.
-            if tracebacks:
-                tracebacks[-1].tb_next = tbobb
-            # Add it to the tracebacks.
-            tracebacks.append(tbobb)
+            if inlined is None:
+                tracebacks.append(self._make_traceback(state, code_object, 0, state.line_no, lasti))
+            else:
+                tracebacks.append(self._make_traceback(state, code_object, 0, inlined.line_no, inlined.offset))
+                tracebacks.append(self._make_traceback(state, inlined.code, inlined.base, state.line_no,
+                                                       lasti - inlined.start))
+            # The frames this state replaced with tail calls would have been just before it.
+            tracebacks[first].tb_elided = state.elided
 
+        # Set tb_next of the tracebacks.
+        for tb, tb_next in zip(tracebacks, tracebacks[1:]):
+            tb.tb_next = tb_next
         return tracebacks[0]
 
-    def _run_instruction(self, state: FunctionState, instruction: dis.Instruction):
+    @staticmethod
+    def _make_traceback(state: FunctionState, code_object: types.CodeType, base: int, line_no: int,
+                        lasti: int) -> NTraceback:
+        """
+        Creates the traceback for one frame of a state.
+
+        :param state: The state the frame is from.
+        :param code_object: The code object of the frame.
+        :param base: The index of the first local of the frame in the locals of the state.
+        :param line_no: The line number of the frame.
+        :param lasti: The offset of the last instruction run by the frame.
+        """
+        # Create a frame object.
+        frame = NFrame()
+        frame.f_code = code_object
+        frame.f_globals = state.globals
+        # Calculate locals.
+        # The state may also have the locals of inlined functions after its own.
+        for xx, name in enumerate(code_object.co_varnames):
+            val = state.varnames_stored[base + xx]
+            if val is NAFT_NULL:
+                continue
+            frame.f_locals[name] = val
+
+        frame.f_lineno = line_no
+        frame.f_lasti = lasti
+        # Create a traceback object that is associated with this frame.
+        tbobb = NTraceback()
+        tbobb.tb_frame = frame
+        tbobb.tb_lineno = frame.f_lineno
+        tbobb.tb_lasti = frame.f_lasti
+        return tbobb
+
+    def _run_loop(self, state: FunctionState):
+        """
+        Runs the instructions of a function, from its program counter, until a handler signals the engine.
+
+        This is the loop used when there are no hooks installed, so it must be kept as tight as possible.
+        """
+        instructions = state.instructions
+        # Jumps are handled by the operators assigning to the program counter.
+        # The program counter is left pointing after the instruction that signalled or raised, so the function can be
+        # resumed, and the line number can be found.
+        try:
+            while True:
+                instruction = instructions[state.pc]
+                state.pc += 1
+                # The op function is resolved when the code object is decoded.
+                # Handlers return a signal if the engine needs to stop running this function.
+                if instruction.handler(state, instruction):
+                    return
+        except signals.ReturnValue as e:
+            # Handlers that still raise to return.
+            state.return_value = e.val
+
+    def _run_loop_hooked(self, state: FunctionState):
+        """
+        Runs the instructions of a function, from its program counter, until a handler signals the engine, calling the
+        installed hooks as it goes.
+
+        This is the same as :meth:`_run_loop`, but with calls to the hooks added.
+        """
+        instructions = state.instructions
+        on_instruction = [hook.on_instruction for hook in self.hooks]
+
+        try:
+            while True:
+                instruction = instructions[state.pc]
+                state.pc += 1
+                for callback in on_instruction:
+                    callback(state, instruction)
+                if instruction.handler(state, instruction):
+                    return
+        except signals.ReturnValue as e:
+            state.return_value = e.val
+
+    def _run_threaded(self, state: FunctionState):
+        """
+        Runs a function with the closure-threaded backend, from its program counter, until a closure signals the
+        engine.
+
+        The closures don't keep the program counter up to date, so it is only set if the function stops. This means
+        the function can be resumed, and the rewritten traceback is the same as with :meth:`_run_loop`.
+        """
+        decoded = state.decoded
+        threaded = decoded.threaded
+        if threaded is None:
+            threaded = decoded.threaded = compile_threaded(decoded.instructions)
+
+        op = threaded.ops[state.pc]
+        try:
+            while op is not None:
+                op = op(state)
+        except signals.ReturnValue as e:
+            state.return_value = e.val
+        except BaseException:
+            # ``op`` is still the closure that raised.
+            state.pc = threaded.indexes[op] + 1
+            raise
+
+    def _run_register(self, state: FunctionState):
+        """
+        Runs a function with the register backend, from its program counter, until a closure signals the engine.
+
+        The function is translated the first time it is run with this backend. Functions that can't be translated are
+        run with :meth:`_run_loop` instead.
+        """
+        decoded = state.decoded
+        register = decoded.register
+        if register is None:
+            # The function may have been decoded by the cache for functions that override ``tail_calls``.
+            options = dict(self.code_cache.options, tail_calls=bool(decoded.tail_calls))
+            register = decoded.register = compile_register(state._wrapped_func.__code__, self.code_cache.table,
+                                                           options) or False
+        if register is False:
+            state.runner = self._loop_runner
+            return self._run_loop(state)
+
+        # The program counter is an index into the instructions the IR was translated from.
+        state.instructions = register.instructions
+        op = register.entries[state.pc]
+        try:
+            while op is not None:
+                op = op(state)
+        except signals.ReturnValue as e:
+            state.return_value = e.val
+        except BaseException:
+            # ``op`` is still the closure that raised.
+            state.pc = register.indexes[op] + 1
+            raise
+
+    def _push_frame(self, f: types.FunctionType, args: tuple, kwargs: dict, options: dict) -> FunctionState:
+        """
+        Creates the state for a call to a function, and pushes it onto the call stack.
+
+        :param f: The function to call. This must be a function that the engine can run; see :mod:`naft.callables`.
+        :param args: The positional arguments.
+        :param kwargs: The keyword arguments.
+        :param options: The engine options for this function, from ``with_engine``.
+        :return: The :class:`naft.state.FunctionState` for the call.
+        """
+        # Interpreted calls don't use the Python stack, so the depth has to be limited here.
+        if len(self._call_stack) >= self.recursion_limit:
+            raise NFRecursionError("maximum recursion depth exceeded")
+
+        state = self._make_state(f, args, kwargs, options)
+
+        # Push onto the call stack.
+        # There is only one entry per call; the instruction running is found from the program counter of the state.
+        self._call_stack.append(state)
+        for hook in self.hooks:
+            hook.on_call(state)
+
+        return state
+
+    def _make_state(self, f: types.FunctionType, args: tuple, kwargs: dict, options: dict) -> FunctionState:
+        """
+        Creates the state for a call to a function, with its arguments bound, ready to run.
+
+        The parameters are the same as :meth:`_push_frame`.
+        """
+        # Get the decoded function from the code cache.
+        cache = self.code_cache
+        if "tail_calls" in options:
+            cache = self._get_tail_call_cache(options["tail_calls"])
+        decoded = cache.get(f.__code__)
+
+        # Create the function state.
+        # Globals and builtins are looked up in the real dicts as they are needed, so nothing is copied here.
+        globs = f.__globals__
+        # Re-use a released state for this code object if there is one, rather than allocating a new one.
+        free_states = decoded.free_states
+        if free_states:
+            state = free_states.pop()
+            state.reuse(f, globs)
+        else:
+            # The decoded code has the names and locals of any functions inlined into it, as well as its own.
+            state = FunctionState(f, decoded.consts, decoded.names, decoded.varnames, globs,
+                                  stacksize=decoded.stacksize)
+            state.decoded = decoded
+            state.instructions = decoded.instructions
+
+        # Fill in the arguments, with the plan worked out when the code was decoded.
+        try:
+            decoded.plan.bind(f, args, kwargs, state.varnames_stored)
+        except BaseException:
+            # The state was never run, so it can go straight back.
+            state.release()
+            free_states.append(state)
+            raise
+
+        state.engine = self
+
+        # Pick the loop to run the function with.
+        # If there are no hooks, the plain loop doesn't check for them at all.
+        if self.hooks:
+            state.runner = self._hooked_runner
+        else:
+            backend = options.get("backend", self.backend)
+            if backend == "threaded":
+                state.runner = self._threaded_runner
+            elif backend == "register":
+                state.runner = self._register_runner
+            else:
+                state.runner = self._loop_runner
+        return state
+
+    def _make_generator(self, f: types.FunctionType, args: tuple, kwargs: dict, options: dict) -> NGenerator:
+        """
+        Creates the generator for a call to a generator function or a coroutine function.
+
+        The parameters are the same as :meth:`_push_frame`.
+        :return: A new :class:`naft.generator.NGenerator`, which runs the function as it is iterated.
+        """
+        return make_generator(self, self._make_state(f, args, kwargs, options))
+
+    def _resume_frame(self, state: FunctionState):
+        """
+        Pushes the state of a suspended generator back onto the call stack, and runs it until it yields or returns.
+
+        :param state: The state of the generator.
+        :return: The value yielded or returned. ``state.suspended`` is only set if the generator yielded.
         """
-        Work function for running an instruction.
+        if len(self._call_stack) >= self.recursion_limit:
+            raise NFRecursionError("maximum recursion depth exceeded")
+        self._call_stack.append(state)
+        for hook in self.hooks:
+            hook.on_call(state)
+        return self._run_frames(state)
+
+    def _get_tail_call_cache(self, tail_calls: bool) -> code.CodeCache:
         """
-        opcode, opname = instruction.opcode, instruction.opname
-        self.logger.debug("Running operation {}:{} at line {} in function {}".format(opcode, opname,
-                                                                                     instruction.starts_line,
-                                                                                     state._wrapped_func.__name__))
+        Gets the code cache for a function wrapped with ``with_engine(tail_calls=...)``.
 
-        # Get the op function.
-        func = find_operator_implementation(opcode)
-        # Call the function.
-        if func is None:
-            raise BadOpcode(instruction, None)
-        result = func(state, instruction)
-        return result
+        :param tail_calls: The ``tail_calls`` option of the function.
+        :return: The engine's own cache if it already decodes code this way, or a cache that does.
+        """
+        if bool(self.code_cache.options.get("tail_calls")) == bool(tail_calls):
+            return self.code_cache
+        if self._tail_call_cache is None:
+            options = dict(self.code_cache.options, tail_calls=bool(tail_calls))
+            if self.code_cache.table is None:
+                self._tail_call_cache = code.get_shared_cache(**options)
+            else:
+                self._tail_call_cache = code.CodeCache(self.code_cache.table, **options)
+        return self._tail_call_cache
 
-    def run_function(self, function: _NRunnableObject):
+    def _elide_frame(self, state: FunctionState):
+        """
+        Removes the state of a function that made a tail call from the call stack.
+
+        The state of the function it called must be on top of the call stack, just above it. That state takes its place,
+        and returns straight to whatever called it. See :mod:`naft.tailcall`.
+
+        :param state: The state that made the tail call.
+        """
+        frames = self._call_stack
+        callee = frames[-1]
+        assert frames[-2] is state
+        del frames[-2]
+        callee.elided = state.elided + 1
+
+        # The caller is finished with, so it can be re-used like a state that returned. The callee was pushed first, so
+        # a self-recursive call never gets the same state back.
+        free_states = state.decoded.free_states
+        if len(free_states) < MAX_FREE_STATES:
+            state.release()
+            free_states.append(state)
+
+    def _run_frames(self, state: FunctionState):
+        """
+        Runs a function that has been pushed onto the call stack, and every function it calls, until it returns.
+
+        Calls to interpreted functions don't recurse. Instead, the handler pushes the new state onto the call stack and
+        signals the engine, which switches to running it. When it returns, the engine pops it, pushes the return value
+        onto the caller's stack, and resumes the caller where it left off.
+
+        :param state: The state of the function, which must be on top of the call stack.
+        :return: The return value of the function.
+        """
+        frames = self._call_stack
+        # Frames below this belong to whatever called into the engine.
+        base = len(frames) - 1
+        try:
+            while True:
+                state.runner(state)
+                top = frames[-1]
+                if top is not state:
+                    # A handler pushed a new frame.
+                    state = top
+                    continue
+
+                # The function returned, or a generator yielded.
+                value = state.return_value
+                frames.pop()
+                for hook in self.hooks:
+                    hook.on_return(state, value)
+                if state.suspended:
+                    # Only a generator that is being resumed can yield, and that is always the function this loop
+                    # started with. The generator object keeps the state, to resume it again later.
+                    return value
+
+                # The function returned normally, so nothing should be holding on to the state any more.
+                # If it raised, the state is left alone, as the traceback may still need it.
+                free_states = state.decoded.free_states
+                if len(free_states) < MAX_FREE_STATES:
+                    state.release()
+                    free_states.append(state)
+
+                if len(frames) == base:
+                    return value
+                state = frames[-1]
+                state.push(value)
+        except Exception as e:
+            # The exception leaves every frame run by this loop.
+            # They are left on the call stack, so that the traceback can be rewritten.
+            if self.hooks:
+                for index in range(len(frames) - 1, base - 1, -1):
+                    for hook in self.hooks:
+                        hook.on_exception(frames[index], e)
+            raise
+
+    def run_function(self, function: _NRunnableObject, profiler: Profiler = None):
         """
         Runs a function inside the NAFT engine.
 
@@ -113,84 +678,128 @@ class NAFTEngine(object):
         every non-builtin function with the engine.
 
         :param function: The _NRunnableObject to call.
+        :param profiler: A :class:`naft.profiler.Profiler` to profile this call with.
+            It is installed as a hook for the duration of the call, including every function called from it.
         :return: The return result of the function.
         """
-        if self._root is None:
-            self._root = function
+        if profiler is not None:
+            self.add_hook(profiler)
+            try:
+                return self.run_function(function)
+            finally:
+                self.remove_hook(profiler)
 
         # Check if it's a builtin.
         f = self._get_function_object(function)
-        if isinstance(f, types.BuiltinFunctionType) or not hasattr(f, "__code__"):
+        kind = classify(f)
+        if kind == CALLABLE_GENERATOR:
+            # Nothing runs until the generator is iterated.
+            return self._make_generator(f, function.args, function.kwargs, function.options)
+        if kind != CALLABLE_FUNCTION:
             # Just call it.
             return function.run_natively()
 
-        # Since we operate on the function directly, we ask the NRunnableObject to give us some useful data.
-        # Like, yknow, the consts, names, varnames, etc.
-        consts, names, varnames = function.get_data()
+        return self._run_guarded(self._run_call, f, function.args, function.kwargs, function.options)
 
-        # Get the filled in data.
-        filled_in_data = function.get_varnames_filled_in()
+    def run_coroutine(self, function: _NRunnableObject) -> NCoroutine:
+        """
+        Starts a coroutine inside the NAFT engine, to be run on an asyncio event loop.
 
-        # Create the function state.
-        # Merge globals and builtins.
-        globs = f.__globals__.copy()
-        globs.update(__builtins__)
-        state = FunctionState(f, consts, names, varnames, globs)
+        Nothing runs until the coroutine is awaited, or scheduled with ``loop.create_task`` or
+        ``asyncio.ensure_future``. Each step then runs in the engine until the coroutine awaits something that isn't
+        ready, which is handed straight back to the event loop. The loop carries on with other tasks in the meantime,
+        including other interpreted coroutines, which can all share this engine.
 
-        state.engine = self
+        .. code::
 
-        # Fill in the state.
-        for position, item in enumerate(filled_in_data):
-            state.varnames_stored[position] = item
-
-        # Alright, we're ready.
-        # Get a disassembled function.
-        instructions = dis.get_instructions(f)
-
-        # Begin iterating over the instructions.
-        for instruction in instructions:
-            # Update the state with the current line number.
-            if instruction.starts_line:
-                state.line_no = instruction.starts_line
-            # Push onto the call stack.
-            self._call_stack.append((state, instruction))
-            # Call the work function.
-            # This scans the instruction, sets up the state, and saves the result.
-            # It also uses several signalling exceptions to signal to the runner how to proceed.
-            try:
-                result = self._run_instruction(state, instruction)
-            except signals.ReturnValue as e:
-                # We've been told to return a value.
-                # So, that's what we do!
-                return e.val
-            except NFBaseException as e:
-                # Overriding Python's exception interpreter is, unfortunately, not possible.
-                # Well, not in pure-python, as far as I can tell.
-                # It *might* be possible using ctypes magic, but that's out of scope.
-                # The best we can do is print our own traceback, then drop the original exception back down.
-                # This produces terrible traceback spammery, but it's the best we can do.
-
-                # Know if we need to re-write the call stack.
-                if self._root != function:
-                    raise
-                # Re-write the traceback.
-                tb = self._rewrite_traceback(e)
-                e._tb = tb
-                # Call traceback.print_exception.
-                # We can't override the CPython interpreter's output.
-                # So we print our own.
-                # TODO: Make this print the right exception type.
-                traceback.print_exception(e.BASE_TYPE, e.BASE_TYPE(*e.args), tb)
-                print(file=sys.stderr)
-                raise e.BASE_TYPE(*e.args) from e
-            except Exception:
-                # Bare exception.
-                # This means an error within NAFT.
-                # Re-raise.
-                self.logger.critical("Code raised an error!")
-                self.logger.critical("Function stack: {}".format(state.stack))
+            result = await engine.run_coroutine(handler(request))
+
+        :param function: The _NRunnableObject for a call to an ``async def`` function, or to a generator function
+            decorated with ``types.coroutine``.
+        :return: A new :class:`naft.generator.NCoroutine`.
+        :raises TypeError: If the function isn't a coroutine function that the engine can run.
+        """
+        f = self._get_function_object(function)
+        if classify(f) != CALLABLE_GENERATOR or not f.__code__.co_flags & COROUTINE_FLAGS:
+            raise TypeError("{!r} is not a coroutine function".format(f))
+        # Generator-based coroutines are wrapped as a coroutine too, so that they can be scheduled as a task.
+        return NCoroutine(self, self._make_state(f, function.args, function.kwargs, function.options))
+
+    def _run_call(self, f: types.FunctionType, args: tuple, kwargs: dict, options: dict):
+        """
+        Pushes a call to a function, and runs it until it returns.
+
+        The parameters are the same as :meth:`_push_frame`.
+        :return: The return value of the function.
+        """
+        return self._run_frames(self._push_frame(f, args, kwargs, options))
+
+    def _drop_frames(self, depth: int):
+        """
+        Pops every frame above ``depth`` off of the call stack.
+        """
+        call_stack = self._call_stack
+        while len(call_stack) > depth:
+            call_stack.pop()
+
+    def _run_guarded(self, run, *args):
+        """
+        Calls ``run(*args)`` to run something in the engine, and handles any exception that escapes it.
+
+        If nothing else is running in the engine, the traceback of an interpreted exception is rewritten and printed,
+        and the original exception type is raised from it.
+
+        :param run: The method to call.
+        :return: What ``run`` returned.
+        """
+        call_stack = self._call_stack
+        # The outermost call into the engine is the one that rewrites the traceback.
+        is_root = not call_stack
+        depth = len(call_stack)
+
+        # The signals and exceptions from every function called are handled here.
+        try:
+            return run(*args)
+        except NFBaseException as e:
+            # Overriding Python's exception interpreter is, unfortunately, not possible.
+            # Well, not in pure-python, as far as I can tell.
+            # It *might* be possible using ctypes magic, but that's out of scope.
+            # The best we can do is print our own traceback, then drop the original exception back down.
+            # This produces terrible traceback spammery, but it's the best we can do.
+
+            # Know if we need to re-write the call stack.
+            if not is_root:
+                # The exception goes back through native code, which may catch it, so the frames it left can't stay on
+                # the call stack. They are kept on the exception, for the root to rewrite the traceback with.
+                e._frames[:0] = list(call_stack)[depth:]
+                self._drop_frames(depth)
                 raise
-            else:
-                self._call_stack.pop()
-            finally:
-                pass
+            # Re-write the traceback.
+            tb = self._rewrite_traceback(e)
+            e._tb = tb
+            # Call traceback.print_exception.
+            # We can't override the CPython interpreter's output.
+            # So we print our own.
+            # TODO: Make this print the right exception type.
+            traceback.print_exception(e.BASE_TYPE, e.BASE_TYPE(*e.args), tb)
+            # The printed traceback can't show the frames elided by tail calls, so say how many there were.
+            elided = 0
+            frame_tb = tb
+            while frame_tb is not None:
+                elided += frame_tb.tb_elided
+                frame_tb = frame_tb.tb_next
+            if elided:
+                print("({} frames elided by tail calls)".format(elided), file=sys.stderr)
+            print(file=sys.stderr)
+            raise e.BASE_TYPE(*e.args) from e
+        except Exception:
+            # Bare exception.
+            # This means an error within NAFT.
+            # Re-raise.
+            self.logger.critical("Code raised an error!")
+            if call_stack:
+                self.logger.critical("Function stack: {}".format(call_stack[-1].get_items()))
+            # Nothing is going to rewrite the traceback, so don't leave the frames behind.
+            self._drop_frames(depth)
+            raise
+
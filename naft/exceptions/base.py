@@ -17,6 +17,9 @@ class NFBaseException(Exception):
         super().__init__(*args, **kwargs)
 
         self._tb = None
+        # The states of the frames the exception has already left, innermost last.
+        # These are taken off of the call stack when the exception passes back through native code, which may catch it.
+        self._frames = []
 
     @property
     def __traceback__(self):
@@ -29,3 +32,11 @@ class NFNameError(NFBaseException, NameError):
     """
     NAME = "NameError"
     BASE_TYPE = NameError
+
+
+class NFRecursionError(NFBaseException, RecursionError):
+    """
+    An NF recursion error.
+    """
+    NAME = "RecursionError"
+    BASE_TYPE = RecursionError
@@ -37,3 +37,11 @@ class BadPopException(IndexError):
 
     This often means a bug in NAFT.
     """
+
+
+class BadPushException(IndexError):
+    """
+    Called when an item is pushed onto a full function stack.
+
+    The stack is sized by the compiler, so this often means a bug in NAFT.
+    """
@@ -9,6 +9,8 @@ class NTraceback:
     A mock traceback.
 
     This is set on exceptions returned by NAFT as the `__traceback__` attribute.
+
+    ``tb_elided`` is the number of frames that would have been just before this one, but were elided by tail calls.
     """
 
     def __init__(self, next_: 'NTraceback' = None,
@@ -16,5 +18,6 @@ class NTraceback:
         self.tb_next = next_
         self.tb_lasti = 0
         self.tb_lineno = lineno
+        self.tb_elided = 0
         # TODO: Implement a proper ``tb_frame``.
         self.tb_frame = None
@@ -1,9 +1,22 @@
 """
 Signals tell the engine to do certain actions when running.
 
-They're exceptions, but not errors.
+Handlers signal the engine by returning one of the ``WHY_`` codes below; a handler that returns None (or nothing) just
+lets the engine carry on with the next instruction. Jumps don't need a signal, as they assign to the program counter.
+
+The exception classes are the old way of signalling. They're exceptions, but not errors. The engine still catches
+them, so handlers that raise them keep working, but they are much slower than returning a code.
 """
 
+# The function is returning. The value to return is in ``state.return_value``.
+WHY_RETURN = 1
+
+# The function is yielding. The value to yield is in ``state.return_value``.
+WHY_YIELD = 2
+
+# The function is calling another interpreted function. The new state is on top of the engine's call stack.
+WHY_CALL = 3
+
 
 class NAFTSignal(BaseException):
     """
@@ -0,0 +1,49 @@
+"""
+The superinstruction fusion pass.
+
+This runs when a code object is decoded, and replaces common pairs of instructions with a single superinstruction from
+:mod:`naft.ops.fused`.
+"""
+from naft.instruction import NInstruction, get_opname
+from naft.ops.dispatch import DISPATCH_TABLE
+from naft.ops.fused import FUSIONS
+
+
+def fuse_instructions(instructions: list) -> tuple:
+    """
+    Fuses pairs of instructions into superinstructions.
+
+    A pair is only fused if the second instruction is not a jump target and is on the same line as the first, so that
+    jumps and tracebacks behave exactly the same. Pairs where either handler isn't the default one (because it was
+    overridden on the engine, or replaced by an earlier pass) are left alone, so that the replacement still runs.
+
+    This must run before jump targets are linked; the ``target`` of each instruction must still be a bytecode offset.
+
+    :param instructions: The list of :class:`naft.instruction.NInstruction` to fuse.
+    :return: A tuple of the new list of instructions, and a list of ``(offset, name)`` for each fusion that fired.
+    """
+    targets = {instruction.target for instruction in instructions if instruction.target is not None}
+
+    fused = []
+    fired = []
+    index = 0
+    while index < len(instructions):
+        first = instructions[index]
+        if index + 1 < len(instructions):
+            second = instructions[index + 1]
+            fusion = FUSIONS.get((first.opcode, second.opcode))
+            if fusion is not None and second.offset not in targets and second.line_no == first.line_no \
+                    and first.handler is DISPATCH_TABLE[first.opcode] \
+                    and second.handler is DISPATCH_TABLE[second.opcode]:
+                opcode, handler = fusion
+                target = first.target if first.target is not None else second.target
+                fused.append(NInstruction(opcode, first.arg, handler, first.line_no, first.offset, target,
+                                          second.arg))
+                fired.append((first.offset, get_opname(opcode)))
+                index += 2
+                continue
+
+        fused.append(first)
+        index += 1
+
+    return fused, fired
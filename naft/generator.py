@@ -0,0 +1,322 @@
+"""
+Interpreted generators and coroutines.
+
+Calling a generator function doesn't run any of it. Instead, the engine creates the state for the call as normal, binds
+the arguments, and wraps it in an :class:`NGenerator` (or an :class:`NCoroutine`, for an ``async def`` function). This
+is a real iterator, which native code can use like any other generator.
+
+Each ``__next__`` or ``send`` pushes the state back onto the engine's call stack, and runs it from its program counter.
+``YIELD_VALUE`` stops the engine, leaving the state suspended, with everything it needs to carry on: its locals, its
+stack, and its program counter. Nothing else is kept, so a generator uses the same memory however many items it
+produces. When it is resumed, the value sent in is pushed, as the result of the ``yield`` expression.
+
+``yield from`` (and ``await``) is delegated the same way as CPython does it: while the generator is suspended at a
+``YIELD_FROM``, values sent to it are sent straight on to the iterator it is delegating to, without running the frame.
+The frame only runs again once the iterator is exhausted.
+
+Interpreted code can't catch exceptions yet, so an exception thrown into a generator (with ``throw`` or ``close``)
+finishes it, and is raised out of it.
+
+Hooks see each time a generator is resumed as a call, and each time it yields as a return.
+"""
+import inspect
+import sys
+import types
+
+from naft.state import FunctionState
+
+# ``state.suspended`` values, for the state of a generator that has yielded.
+# The generator yielded with YIELD_VALUE, and is resumed by pushing the value sent in.
+SUSPENDED_YIELD = 1
+# The generator is delegating with YIELD_FROM. The iterator it is delegating to is on top of its stack.
+SUSPENDED_YIELD_FROM = 2
+
+# Code flags of functions that can be run as a coroutine: ``async def`` functions, and generator functions decorated
+# with ``types.coroutine``.
+COROUTINE_FLAGS = inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE
+
+# The code flag set by ``from __future__ import generator_stop``.
+CO_FUTURE_GENERATOR_STOP = 0x80000
+
+# If a StopIteration raised inside a generator is always turned into a RuntimeError, as with PEP 479.
+GENERATOR_STOP = sys.version_info >= (3, 7)
+
+
+def send_to(receiver, value):
+    """
+    Sends a value to the iterator a generator is delegating to, like ``YIELD_FROM`` does.
+
+    Generators and coroutines are sent the value. Other iterators only have to support ``__next__``, so they are only
+    sent values other than None.
+    """
+    if value is None and not isinstance(receiver, SENDABLE_TYPES):
+        return next(receiver)
+    return receiver.send(value)
+
+
+class NGenerator:
+    """
+    A generator run by the engine.
+
+    :ivar gi_code: The code object of the generator function.
+    """
+    __slots__ = ("_engine", "_state", "_running", "gi_code", "__weakref__")
+
+    # What this is called in error messages.
+    _kind = "generator"
+
+    def __init__(self, engine, state: FunctionState):
+        self._engine = engine
+        # The state of the frame, or None once the generator is finished.
+        self._state = state
+        self._running = False
+        self.gi_code = state._wrapped_func.__code__
+
+    @property
+    def __name__(self) -> str:
+        return self.gi_code.co_name
+
+    @property
+    def gi_running(self) -> bool:
+        """
+        If the generator is running.
+        """
+        return self._running
+
+    @property
+    def gi_yieldfrom(self):
+        """
+        The iterator the generator is delegating to with ``yield from``, or None.
+        """
+        state = self._state
+        if state is not None and state.suspended == SUSPENDED_YIELD_FROM:
+            return state.stack[state.sp - 1]
+        return None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        """
+        Resumes the generator, with ``value`` as the result of the ``yield`` it is suspended at.
+
+        :return: The next value the generator yields.
+        :raises StopIteration: If the generator returns, with the value it returned.
+        """
+        state = self._state
+        if state is None:
+            raise StopIteration
+        if self._running:
+            raise ValueError("{} already executing".format(self._kind))
+
+        if state.suspended == SUSPENDED_YIELD_FROM:
+            # Hand the value straight on, and only run the frame again once the iterator is exhausted.
+            try:
+                return self._delegate(send_to, state.stack[state.sp - 1], value)
+            except StopIteration as e:
+                # The result of the ``yield from`` replaces the iterator on the stack.
+                state.stack[state.sp - 1] = e.value
+        elif state.pc == 0:
+            if value is not None:
+                raise TypeError("can't send non-None value to a just-started {}".format(self._kind))
+        else:
+            state.push(value)
+        return self._resume()
+
+    def throw(self, typ, val=None, tb=None):
+        """
+        Raises an exception inside the generator, at the ``yield`` it is suspended at.
+
+        If the generator is delegating, the exception is thrown into the iterator it is delegating to first.
+        """
+        if isinstance(typ, BaseException):
+            exc = typ
+        else:
+            exc = typ() if val is None else (val if isinstance(val, typ) else typ(val))
+        if tb is not None:
+            exc = exc.with_traceback(tb)
+
+        state = self._state
+        if state is not None and state.suspended == SUSPENDED_YIELD_FROM and not isinstance(exc, GeneratorExit):
+            receiver = state.stack[state.sp - 1]
+            throw = getattr(receiver, "throw", None)
+            if throw is not None:
+                try:
+                    return self._delegate(throw, exc)
+                except StopIteration as e:
+                    # The iterator handled the exception and returned, so the generator carries on.
+                    state.stack[state.sp - 1] = e.value
+                    return self._resume()
+
+        # Interpreted code can't catch the exception, so it finishes the generator.
+        self.close()
+        raise exc
+
+    def close(self):
+        """
+        Finishes the generator.
+
+        If it is delegating, the iterator it is delegating to is closed first.
+        """
+        state = self._state
+        if state is None:
+            return
+        if self._running:
+            raise ValueError("{} already executing".format(self._kind))
+        self._state = None
+        if state.suspended == SUSPENDED_YIELD_FROM:
+            close = getattr(state.stack[state.sp - 1], "close", None)
+            if close is not None:
+                close()
+        # The frame never gets to run again, so it shouldn't keep anything alive.
+        state.release()
+
+    def _delegate(self, method, *args):
+        """
+        Calls a method of the iterator being delegated to, finishing the generator if it raises anything other than
+        StopIteration.
+        """
+        self._running = True
+        try:
+            return method(*args)
+        except StopIteration:
+            raise
+        except BaseException:
+            self._state = None
+            raise
+        finally:
+            self._running = False
+
+    def _resume(self):
+        """
+        Runs the frame, until it yields or returns.
+        """
+        state = self._state
+        state.suspended = 0
+        self._running = True
+        try:
+            value = self._engine._run_guarded(self._run_frame, state)
+        except BaseException:
+            self._state = None
+            raise
+        finally:
+            self._running = False
+
+        if state.suspended:
+            return value
+        # The engine releases the state once the function returns.
+        self._state = None
+        if value is None:
+            raise StopIteration
+        raise StopIteration(value)
+
+    def _run_frame(self, state: FunctionState):
+        """
+        Pushes the state onto the engine's call stack, and runs it.
+
+        This is run by the engine's error handling, so the traceback of an exception is rewritten like any other, and
+        the frames the exception leaves are taken off of the call stack.
+        """
+        engine = self._engine
+        depth = len(engine._call_stack)
+        try:
+            return engine._resume_frame(state)
+        except StopIteration as e:
+            # A StopIteration can't be allowed to leave a generator as if it had finished normally.
+            engine._drop_frames(depth)
+            if GENERATOR_STOP or self.gi_code.co_flags & CO_FUTURE_GENERATOR_STOP:
+                raise RuntimeError("{} raised StopIteration".format(self._kind)) from e
+            state.suspended = 0
+            return None
+
+    def __repr__(self):  # pragma: no cover
+        return "<NAFT {} object {} at {:#x}>".format(self._kind, self.gi_code.co_name, id(self))
+
+
+class NCoroutine(NGenerator):
+    """
+    A coroutine run by the engine.
+
+    Like a native coroutine, this can only be iterated with ``await``, or by calling ``send``.
+    """
+    __slots__ = ()
+
+    _kind = "coroutine"
+
+    # Coroutines aren't iterable.
+    __iter__ = None
+    __next__ = None
+
+    @property
+    def cr_code(self):
+        return self.gi_code
+
+    @property
+    def cr_running(self) -> bool:
+        return self._running
+
+    @property
+    def cr_await(self):
+        return self.gi_yieldfrom
+
+    def __await__(self):
+        return NCoroutineWrapper(self)
+
+    def __repr__(self):  # pragma: no cover
+        return "<NAFT coroutine object {} at {:#x}>".format(self.gi_code.co_name, id(self))
+
+
+class NCoroutineWrapper:
+    """
+    The iterator returned by :meth:`NCoroutine.__await__`.
+    """
+    __slots__ = ("_coroutine",)
+
+    def __init__(self, coroutine: NCoroutine):
+        self._coroutine = coroutine
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._coroutine.send(None)
+
+    def send(self, value):
+        return self._coroutine.send(value)
+
+    def throw(self, typ, val=None, tb=None):
+        return self._coroutine.throw(typ, val, tb)
+
+    def close(self):
+        return self._coroutine.close()
+
+
+# Types whose ``send`` YIELD_FROM always uses, even to send None.
+SENDABLE_TYPES = (types.GeneratorType, types.CoroutineType, NGenerator)
+
+# Types that can be awaited directly.
+COROUTINE_TYPES = (types.CoroutineType, NCoroutine)
+
+
+# The methods of the generator types are part of the engine, so interpreted code that calls them (such as ``send`` or
+# ``close``) must call them natively, rather than running them itself.
+for _type in (NGenerator, NCoroutine, NCoroutineWrapper):
+    for _value in vars(_type).values():
+        if isinstance(_value, types.FunctionType):
+            _value._no_naft_execute = True
+
+
+def make_generator(engine, state: FunctionState) -> NGenerator:
+    """
+    Wraps the state of a call to a generator function or a coroutine function.
+
+    :param engine: The engine to run it with.
+    :param state: The state of the call, with its arguments bound.
+    :return: An :class:`NCoroutine` for a coroutine, or an :class:`NGenerator`.
+    """
+    if state._wrapped_func.__code__.co_flags & inspect.CO_COROUTINE:
+        return NCoroutine(engine, state)
+    return NGenerator(engine, state)
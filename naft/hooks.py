@@ -0,0 +1,67 @@
+"""
+Engine hooks.
+
+Hooks are used to observe the engine while it runs, for tracing, debugging or profiling.
+When no hooks are installed on an engine, it uses a loop that doesn't check for them at all, so they cost nothing.
+"""
+import logging
+
+from naft.instruction import NInstruction
+from naft.state import FunctionState
+
+
+class EngineHook:
+    """
+    Base class for a hook.
+
+    Subclasses override whichever methods they are interested in; the default implementations do nothing.
+    Install a hook with :meth:`naft.engine.NAFTEngine.add_hook`.
+    """
+
+    def on_call(self, state: FunctionState):
+        """
+        Called when the engine starts running a function.
+
+        :param state: The state of the function, with the arguments filled in.
+        """
+
+    def on_return(self, state: FunctionState, value):
+        """
+        Called when a function returns.
+
+        :param state: The state of the function that is returning.
+        :param value: The value being returned.
+        """
+
+    def on_instruction(self, state: FunctionState, instruction: NInstruction):
+        """
+        Called before each instruction is run.
+
+        :param state: The state of the function that is running.
+        :param instruction: The instruction that is about to be run.
+        """
+
+    def on_exception(self, state: FunctionState, exception: BaseException):
+        """
+        Called when an exception propagates out of a function.
+
+        :param state: The state of the function the exception is leaving.
+        :param exception: The exception that was raised.
+        """
+
+
+class LoggingHook(EngineHook):
+    """
+    A hook that logs each instruction at the DEBUG level, like the engine used to.
+
+    :param logger: The logger to use. Defaults to the ``NAFT.engine`` logger.
+    """
+
+    def __init__(self, logger: logging.Logger = None):
+        self.logger = logger if logger is not None else logging.getLogger("NAFT.engine")
+
+    def on_instruction(self, state: FunctionState, instruction: NInstruction):
+        self.logger.debug("Running operation {}:{} at line {} in function {}".format(instruction.opcode,
+                                                                                     instruction.opname,
+                                                                                     instruction.line_no,
+                                                                                     state._wrapped_func.__name__))
@@ -0,0 +1,224 @@
+"""
+Call-site inlining.
+
+Every call to an interpreted function pushes a new state, binds the arguments, switches the engine over to it, and then
+pops it again when it returns. For the tiny helper functions that most code is full of, this costs far more than the
+body of the function itself.
+
+When code is decoded with ``inline=True``, every ``CALL_FUNCTION`` counts the function it calls. Once a call site has
+called the same function :data:`INLINE_THRESHOLD` times in a row, and that function can be inlined (see
+:func:`can_inline`), the caller is decoded again with the callee's instructions spliced in at the call site:
+
+* the callee's locals are given slots after the caller's own, and its names and constants are added after the caller's;
+* the call becomes a guard, which checks that the function being called is still the one that was inlined. If it is,
+  the arguments are moved into the callee's locals, and the callee's instructions run in place. If not, the function is
+  called as normal;
+* each ``RETURN_VALUE`` of the callee leaves the return value on the stack, and jumps back to after the call.
+
+Functions that are already running keep the code they were started with; only new calls use the re-decoded code.
+
+The spliced instructions keep the line numbers of the callee, and the engine rewrites a traceback through them as a
+frame for the caller at the call site, and a frame for the callee. Inlined calls don't push a state, so hooks don't see
+them as calls.
+"""
+import dis
+import inspect
+
+from naft.callables import CALLABLE_FUNCTION, CALLABLE_NFUNCTION, classify
+from naft.instruction import NInstruction
+from naft.ops.call import call_function, handle_op_131
+from naft.state import FunctionState, get_nulls
+
+# The number of times in a row a call site must call the same function before it is inlined.
+INLINE_THRESHOLD = 16
+
+# The most instructions a function can have to be inlined.
+MAX_INLINE_SIZE = 40
+
+# Code flags that mean a function can't be inlined: its arguments need packing, or it doesn't just run and return.
+UNINLINABLE_FLAGS = inspect.CO_VARARGS | inspect.CO_VARKEYWORDS | inspect.CO_GENERATOR | inspect.CO_COROUTINE \
+                    | inspect.CO_ITERABLE_COROUTINE | getattr(inspect, "CO_ASYNC_GENERATOR", 0)
+
+# Instructions that use the block stack, or that only make sense in a real frame.
+UNINLINABLE = frozenset(dis.opmap[name] for name in (
+    "SETUP_LOOP", "SETUP_EXCEPT", "SETUP_FINALLY", "SETUP_WITH", "SETUP_ASYNC_WITH", "POP_BLOCK", "BREAK_LOOP",
+    "CONTINUE_LOOP", "END_FINALLY", "POP_EXCEPT", "YIELD_VALUE", "YIELD_FROM", "LOAD_NAME", "STORE_NAME",
+    "DELETE_NAME", "IMPORT_STAR", "LOAD_LOCALS", "LOAD_BUILD_CLASS") if name in dis.opmap) | frozenset(dis.hasfree)
+
+# CALL_FUNCTION was replaced in Python 3.11, so this is None there, and no call site is ever inlined.
+CALL_FUNCTION = dis.opmap.get("CALL_FUNCTION")
+
+
+class CallSite:
+    """
+    The inline cache for a ``CALL_FUNCTION`` that may be inlined.
+
+    :ivar func: The interpreted function the call site last called, or None.
+    :ivar count: The number of times in a row it has been called.
+    """
+    __slots__ = ("func", "count")
+
+    def __init__(self):
+        self.func = None
+        self.count = 0
+
+
+class InlinedCall:
+    """
+    A function inlined at a call site.
+
+    :ivar func: The function that was inlined. This is what the guard checks the called function against.
+    :ivar function: The plain function called by ``func``.
+    :ivar code: The code object of the function. The guard also checks that the function still has this code, as
+        ``__code__`` can be reassigned.
+    :ivar globals: The globals of the function, which must be the globals of the caller.
+    :ivar base: The index of the first local of the callee, in the locals of the caller.
+    :ivar line_no: The line number of the call.
+    :ivar offset: The bytecode offset of the call.
+    :ivar start: The offset the callee's instructions were moved to. The instruction at offset ``x`` of the callee is
+        at ``start + x``.
+    :ivar nulls: An empty set of locals for the callee, used to clear them when it returns.
+    :ivar hits: The number of times the guard passed, and the inlined instructions ran.
+    :ivar misses: The number of times a different function was called.
+    """
+    __slots__ = ("func", "function", "code", "globals", "base", "line_no", "offset", "start", "nulls", "hits", "misses")
+
+    def __init__(self, func, base: int, line_no: int, offset: int, start: int):
+        self.func = func
+        self.function = function = _get_function(func)
+        self.code = function.__code__
+        self.globals = function.__globals__
+        self.base = base
+        self.line_no = line_no
+        self.offset = offset
+        self.start = start
+        self.nulls = get_nulls(len(self.code.co_varnames))
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def end(self) -> int:
+        """
+        The offset after the last instruction of the callee.
+        """
+        return self.start + len(self.code.co_code)
+
+
+def _get_function(func):
+    """
+    Gets the plain function called by ``func``.
+    """
+    if classify(func) == CALLABLE_NFUNCTION:
+        return func._callable
+    return func
+
+
+def can_inline(func, state: FunctionState, nargs: int) -> bool:
+    """
+    Checks if a function called by a state can be inlined into it.
+
+    The function must be a plain interpreted function (or one wrapped with ``with_engine`` and no options), share the
+    globals of the caller, and not be the caller itself. Recursive functions aren't worth inlining, as only one level
+    is ever inlined. Recursion is only guessed at from the names the function uses: a function that uses its own name
+    or the name of the caller is assumed to call it, which also rejects some functions that only use the name for
+    something else. It must be small, take exactly the ``nargs``
+    positional arguments it is called with, and only use instructions that work outside of their own frame.
+    """
+    kind = classify(func)
+    if kind == CALLABLE_NFUNCTION:
+        if func.options or classify(func._callable) != CALLABLE_FUNCTION:
+            return False
+        func = func._callable
+    elif kind != CALLABLE_FUNCTION:
+        return False
+
+    code = func.__code__
+    if func.__globals__ is not state.globals or code is state._wrapped_func.__code__:
+        return False
+    # A function that looks up itself or the caller is probably recursive, or mutually recursive with the caller.
+    if code.co_name in code.co_names or state._wrapped_func.__code__.co_name in code.co_names:
+        return False
+    if code.co_flags & UNINLINABLE_FLAGS or code.co_kwonlyargcount or code.co_argcount != nargs \
+            or code.co_cellvars or code.co_freevars:
+        return False
+
+    instructions = list(dis.get_instructions(code))
+    if len(instructions) > MAX_INLINE_SIZE:
+        return False
+    return not any(instruction.opcode in UNINLINABLE for instruction in instructions)
+
+
+def mark_call_sites(instructions: list, end: int):
+    """
+    Gives every ``CALL_FUNCTION`` before ``end`` a :class:`CallSite`, so that it counts the functions it calls.
+
+    Calls inside functions that were already inlined are left alone, so inlining never goes more than one level deep.
+    Instructions whose handler was overridden are left alone too, so that the override still runs.
+    """
+    for instruction in instructions:
+        if instruction.opcode == CALL_FUNCTION and instruction.offset < end and instruction.handler is handle_op_131:
+            instruction.handler = handle_call_site
+            instruction.cache = CallSite()
+
+
+def handle_call_site(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a CALL_FUNCTION opcode, counting the function it calls.
+
+    This replaces :func:`naft.ops.call.handle_op_131` when code is decoded with ``inline=True``. Once the same function
+    has been called enough times in a row, the engine is asked to inline it.
+    """
+    nargs = instruction.arg
+    func = state.stack[state.sp - nargs - 1]
+    site = instruction.cache
+    if func is site.func:
+        site.count += 1
+        if site.count == INLINE_THRESHOLD:
+            # Whether or not it can be inlined, this call site is done counting.
+            instruction.handler = handle_op_131
+            if can_inline(func, state, nargs):
+                state.engine.code_cache.add_inline(state._wrapped_func.__code__, instruction.offset, func)
+    elif classify(func) in (CALLABLE_FUNCTION, CALLABLE_NFUNCTION):
+        site.func = func
+        site.count = 1
+    else:
+        site.func = None
+    return call_function(state, nargs)
+
+
+def handle_inline_call(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a CALL_FUNCTION opcode that has had its function inlined.
+
+    If the function on the stack is the inlined function, and it still has the code that was inlined, its arguments
+    are moved into its locals, and the inlined instructions after this one run. Otherwise, the function is called as
+    normal, and the engine carries on after the inlined instructions.
+    """
+    inlined = instruction.cache
+    nargs = instruction.arg
+    stack = state.stack
+    sp = state.sp - nargs
+    if stack[sp - 1] is inlined.func and inlined.function.__code__ is inlined.code \
+            and state.globals is inlined.globals:
+        inlined.hits += 1
+        base = inlined.base
+        state.varnames_stored[base:base + nargs] = stack[sp:state.sp]
+        state.sp = sp - 1
+        return
+
+    inlined.misses += 1
+    state.pc = instruction.target
+    return call_function(state, nargs)
+
+
+def handle_inline_return(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a RETURN_VALUE opcode of an inlined function.
+
+    The return value is left on the stack as the result of the call, and the locals of the callee are cleared, so that
+    they don't keep anything alive.
+    """
+    inlined = instruction.cache
+    base = inlined.base
+    state.varnames_stored[base:base + len(inlined.nulls)] = inlined.nulls
+    state.pc = instruction.target
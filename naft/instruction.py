@@ -0,0 +1,60 @@
+"""
+Contains the decoded instruction class.
+"""
+import dis
+
+# Names for opcodes that don't exist in CPython, such as superinstructions.
+# These are numbered from 256 upwards, so that they never collide with a real opcode.
+EXTENDED_OPNAMES = {}
+
+
+def get_opname(opcode: int) -> str:
+    """
+    Gets the name of an opcode, including NAFT's extended opcodes.
+
+    :param opcode: The opcode to look up.
+    :return: The human readable name of this opcode.
+    """
+    if opcode < 256:
+        return dis.opname[opcode]
+    return EXTENDED_OPNAMES[opcode]
+
+
+class NInstruction:
+    """
+    A single, pre-resolved instruction.
+
+    This is the engine's version of :class:`dis.Instruction`. It only carries the data needed to execute the
+    instruction, and the handler is resolved ahead of time so that the engine doesn't need to look it up.
+
+    :ivar opcode: The opcode of this instruction.
+    :ivar arg: The numeric argument of this instruction, or None if it doesn't take one.
+    :ivar handler: The operator implementation for this instruction.
+    :ivar line_no: The source line number this instruction belongs to.
+    :ivar offset: The bytecode offset of this instruction.
+    :ivar target: For jump instructions, the index of the instruction jumped to. This is None for other instructions.
+    :ivar arg2: For superinstructions, the argument of the second instruction.
+    :ivar cache: Per-instruction data for handlers that keep an inline cache, or None.
+    """
+    __slots__ = ("opcode", "arg", "handler", "line_no", "offset", "target", "arg2", "cache")
+
+    def __init__(self, opcode: int, arg, handler, line_no: int, offset: int, target: int = None, arg2=None):
+        self.opcode = opcode
+        self.arg = arg
+        self.handler = handler
+        self.line_no = line_no
+        self.offset = offset
+        self.target = target
+        self.arg2 = arg2
+        self.cache = None
+
+    @property
+    def opname(self) -> str:
+        """
+        :return: The human readable name of this opcode.
+        """
+        return get_opname(self.opcode)
+
+    def __repr__(self):  # pragma: no cover
+        return "<NInstruction {}:{} arg={} line={} offset={}>".format(self.opcode, self.opname, self.arg,
+                                                                      self.line_no, self.offset)
@@ -0,0 +1,669 @@
+"""
+The tracing JIT.
+
+Even the fastest backend still runs each instruction as a Python call. The tracing tier compiles hot loops into
+Python functions, so an iteration is just the Python source that the loop body would have been.
+
+When code is decoded with ``jit=True``, every backward ``JUMP_ABSOLUTE`` is given a :class:`LoopAnchor`, which counts
+how many times the loop has gone round. Once a loop goes round :attr:`TraceCache.threshold` times, the next iteration
+is *recorded*: the instructions are run one by one as normal, and every instruction that runs is written down, with
+the branches it took, the types of the locals it read, and the functions it called. The trace ends when the loop gets
+back to its header.
+
+The trace is then compiled into a single Python function. Locals and stack slots become Python variables, each
+operator becomes the Python expression it stands for, and the function loops until something doesn't match the trace:
+
+* the types of the locals the loop reads are checked at the top of every iteration;
+* a branch that goes the other way, or an iterator that runs out, leaves the loop;
+* a call is only made if the callee is the same native function that was recorded.
+
+When a guard fails, the trace writes the locals and the stack back to the state, sets the program counter to where
+the interpreter should carry on, and returns. Line numbers and tracebacks are the same as with the stack engine. If
+the types or functions a trace was specialised for keep failing to match, the trace is thrown away, and the loop is
+recorded again with what it sees now.
+
+Only straight-line code is traced. A loop whose body calls an interpreted function, contains another loop, or uses an
+instruction the trace can't compile (see :data:`TRACEABLE`) stops being recorded after :data:`MAX_ABORTS` attempts.
+Traces only run with the ``stack`` backend, and only when no hooks are installed, as the hooks would miss the
+instructions that ran inside a trace.
+"""
+import collections
+import dis
+
+from naft.callables import CALLABLE_BUILTIN, CALLABLE_NO_NAFT, CALLABLE_OTHER, classify
+from naft.instruction import NInstruction
+from naft.ops import DISPATCH_TABLE
+from naft.ops.attr import AttrCache
+from naft.ops.load import GlobalCache
+from naft.quicken import Specialization
+from naft.state import FunctionState, NAFT_NULL
+
+# The number of times a loop goes round before it is recorded.
+JIT_THRESHOLD = 32
+
+# The default number of compiled traces kept by an engine.
+TRACE_CACHE_SIZE = 64
+
+# The most instructions a single trace can have.
+MAX_TRACE_LENGTH = 200
+
+# The number of failed recordings before a loop is never recorded again.
+MAX_ABORTS = 4
+
+# The number of times in a row the guards on the types or functions a trace saw can fail before the loop is recorded
+# again.
+MAX_GUARD_FAILURES = 8
+
+_opmap = dis.opmap
+
+LOAD_FAST = _opmap["LOAD_FAST"]
+STORE_FAST = _opmap["STORE_FAST"]
+# JUMP_ABSOLUTE and CALL_FUNCTION were replaced in Python 3.11, so these are None there, and no loop is ever anchored.
+JUMP_ABSOLUTE = _opmap.get("JUMP_ABSOLUTE")
+CALL_FUNCTION = _opmap.get("CALL_FUNCTION")
+
+# Python operators for the binary and in-place opcodes.
+BINARY_SYMBOLS = {
+    "POWER": "**",
+    "MULTIPLY": "*",
+    "MATRIX_MULTIPLY": "@",
+    "FLOOR_DIVIDE": "//",
+    "TRUE_DIVIDE": "/",
+    "MODULO": "%",
+    "ADD": "+",
+    "SUBTRACT": "-",
+    "LSHIFT": "<<",
+    "RSHIFT": ">>",
+    "AND": "&",
+    "XOR": "^",
+    "OR": "|",
+}
+BINARY_OPS = {_opmap["BINARY_" + name]: symbol for name, symbol in BINARY_SYMBOLS.items()
+              if "BINARY_" + name in _opmap}
+INPLACE_OPS = {_opmap["INPLACE_" + name]: symbol for name, symbol in BINARY_SYMBOLS.items()
+               if "INPLACE_" + name in _opmap}
+
+UNARY_OPS = {_opmap[name]: symbol for name, symbol in (
+    ("UNARY_POSITIVE", "+"),
+    ("UNARY_NEGATIVE", "-"),
+    ("UNARY_NOT", "not "),
+    ("UNARY_INVERT", "~"),
+) if name in _opmap}
+
+# Comparisons that are Python operators. ``exception match`` isn't one, so it can't be traced.
+COMPARE_SYMBOLS = frozenset(("<", "<=", "==", "!=", ">", ">=", "in", "not in", "is", "is not"))
+
+# The callable kinds that a trace can call directly. Anything else is run by the engine, so it can't be traced.
+NATIVE_KINDS = frozenset((CALLABLE_BUILTIN, CALLABLE_NO_NAFT, CALLABLE_OTHER))
+
+# The opcodes that can be recorded.
+TRACEABLE = frozenset([_opmap[name] for name in (
+    "LOAD_FAST", "LOAD_CONST", "STORE_FAST", "POP_TOP", "LOAD_GLOBAL", "LOAD_ATTR", "BINARY_SUBSCR", "COMPARE_OP",
+    "POP_JUMP_IF_FALSE", "POP_JUMP_IF_TRUE", "JUMP_IF_FALSE_OR_POP", "JUMP_IF_TRUE_OR_POP", "JUMP_FORWARD",
+    "JUMP_ABSOLUTE", "FOR_ITER", "CALL_FUNCTION", "BUILD_TUPLE", "BUILD_LIST") if name in _opmap]
+                      + list(BINARY_OPS) + list(INPLACE_OPS) + list(UNARY_OPS))
+
+# The caches that the decode passes give instructions, without changing what they do.
+SAME_SEMANTICS_CACHES = (GlobalCache, AttrCache, Specialization)
+
+# Returned by ``next`` when an iterator is exhausted, and by ``dict.get`` when a name is missing.
+MISSING = object()
+
+
+class LoopAnchor:
+    """
+    The tracing data for a single backward jump.
+
+    :ivar counter: The number of times the loop has gone round since it was last recorded.
+    :ivar trace: The compiled :class:`Trace` for the loop, or None.
+    :ivar aborts: The number of times recording the loop failed.
+    :ivar retraces: The number of times the trace was thrown away because its guards kept failing.
+    :ivar blacklisted: If the loop is never recorded again.
+    """
+    __slots__ = ("counter", "trace", "aborts", "retraces", "blacklisted")
+
+    def __init__(self):
+        self.counter = 0
+        self.trace = None
+        self.aborts = 0
+        self.retraces = 0
+        self.blacklisted = False
+
+
+class Trace:
+    """
+    A compiled trace of one iteration of a loop.
+
+    :ivar name: The name of the function the loop is in.
+    :ivar offset: The bytecode offset of the loop header.
+    :ivar length: The number of instructions in the trace.
+    :ivar source: The generated Python source of the trace.
+    :ivar func: The compiled trace. This is called with the state, and returns the number of the exit it left by.
+    :ivar exit_offsets: The bytecode offset the interpreter carries on from, for each exit.
+        Exit 0 is the type guard at the top of the loop.
+    :ivar exit_counts: The number of times the trace left by each exit.
+    :ivar guards: The exits taken when something the trace was specialised for doesn't match, rather than because the
+        loop went a different way.
+    :ivar entries: The number of times the trace was entered.
+    :ivar guard_failures: The number of times in a row the trace left by one of its guards.
+    """
+    __slots__ = ("name", "offset", "length", "source", "func", "exit_offsets", "exit_counts", "guards", "entries",
+                 "guard_failures")
+
+    def __init__(self, name: str, offset: int, length: int, source: str, func, exit_offsets: list,
+                 guards: frozenset = frozenset((0,))):
+        self.name = name
+        self.offset = offset
+        self.length = length
+        self.source = source
+        self.func = func
+        self.exit_offsets = exit_offsets
+        self.guards = guards
+        self.exit_counts = [0] * len(exit_offsets)
+        self.entries = 0
+        self.guard_failures = 0
+
+    @property
+    def exits(self) -> int:
+        """
+        The number of times the trace returned to the interpreter.
+        """
+        return sum(self.exit_counts)
+
+    def __repr__(self):  # pragma: no cover
+        return "<Trace for {} at {} ({} instructions)>".format(self.name, self.offset, self.length)
+
+
+def anchor_loops(instructions: list):
+    """
+    Gives every backward ``JUMP_ABSOLUTE`` a :class:`LoopAnchor`.
+
+    This must run before the instructions are linked, as it compares bytecode offsets. Instructions whose handler was
+    overridden are left alone, so that the override still runs.
+    """
+    for instruction in instructions:
+        if instruction.opcode == JUMP_ABSOLUTE and instruction.handler is DISPATCH_TABLE[JUMP_ABSOLUTE] \
+                and instruction.target <= instruction.offset:
+            instruction.handler = handle_jump_backward
+            instruction.cache = LoopAnchor()
+
+
+def _can_trace(instruction: NInstruction) -> bool:
+    """
+    Checks if an instruction can be recorded.
+
+    It must be a real opcode that the trace knows how to compile, and it must still do what its default handler does.
+    """
+    opcode = instruction.opcode
+    if opcode not in TRACEABLE:
+        return False
+    if instruction.handler is not DISPATCH_TABLE[opcode] and not isinstance(instruction.cache, SAME_SEMANTICS_CACHES):
+        return False
+    return opcode != _opmap["COMPARE_OP"] or dis.cmp_op[instruction.arg] in COMPARE_SYMBOLS
+
+
+def record(state: FunctionState, header: int):
+    """
+    Records one iteration of a loop, by running it.
+
+    The program counter must be at the loop header. Each instruction is run with its normal handler, so if recording
+    stops early, the interpreter just carries on from the program counter.
+
+    :param state: The state of the function.
+    :param header: The index of the loop header.
+    :return: A tuple of the trace (or None if recording stopped early), the types of the locals the loop reads before
+        writing, and the signal from the handler that stopped recording (or None).
+    """
+    instructions = state.instructions
+    steps = []
+    types = {}
+    written = set()
+    while len(steps) < MAX_TRACE_LENGTH:
+        index = state.pc
+        instruction = instructions[index]
+        if instruction.handler is handle_jump_backward:
+            # Either the end of this loop, or the end of a loop inside it, which would need its own trace.
+            if instruction.target != header:
+                return None, None, None
+            state.pc = header
+            steps.append((index, instruction, None, header))
+            return steps, types, None
+
+        if not _can_trace(instruction):
+            return None, None, None
+
+        # Write down what the trace needs to guard on.
+        opcode = instruction.opcode
+        observed = None
+        if opcode == LOAD_FAST:
+            arg = instruction.arg
+            if arg not in written and arg not in types:
+                types[arg] = type(state.varnames_stored[arg])
+        elif opcode == STORE_FAST:
+            written.add(instruction.arg)
+        elif opcode == CALL_FUNCTION:
+            observed = state.stack[state.sp - instruction.arg - 1]
+            if classify(observed) not in NATIVE_KINDS:
+                return None, None, None
+
+        state.pc = index + 1
+        why = instruction.handler(state, instruction)
+        steps.append((index, instruction, observed, state.pc))
+        if why:
+            return None, None, why
+
+    return None, None, None
+
+
+class _TraceCompiler:
+    """
+    Generates the Python source of a trace.
+
+    This keeps a symbolic stack of the Python variables that hold each stack slot. Locals are kept in the variables
+    ``l0``, ``l1``..., the stack slots the trace started with in ``s0``, ``s1``..., results in ``t0``, ``t1``..., and
+    constants in ``k0``, ``k1``...
+    """
+
+    def __init__(self, state: FunctionState, steps: list, types: dict, header: int):
+        self.state = state
+        self.steps = steps
+        self.types = types
+        self.header = header
+        self.depth = state.sp
+        self.stack = ["s{}".format(slot) for slot in range(self.depth)]
+        self.namespace = {"NAFT_NULL": NAFT_NULL, "MISSING": MISSING}
+        self.constants = 0
+        self.temps = 0
+        self.lines = []
+
+        self.used = sorted({instruction.arg for index, instruction, observed, next_pc in steps
+                            if instruction.opcode in (LOAD_FAST, STORE_FAST)})
+        self.written = sorted({instruction.arg for index, instruction, observed, next_pc in steps
+                               if instruction.opcode == STORE_FAST})
+        # Exit 0 is the type guard at the top of the loop.
+        self.exit_indexes = [header]
+        self.guards = {0}
+
+    def bind(self, value) -> str:
+        """
+        Makes a value available to the trace as a constant.
+        """
+        name = "k{}".format(self.constants)
+        self.constants += 1
+        self.namespace[name] = value
+        return name
+
+    def temp(self) -> str:
+        name = "t{}".format(self.temps)
+        self.temps += 1
+        return name
+
+    def emit(self, line: str, indent: int = 0):
+        self.lines.append("    " * (3 + indent) + line)
+
+    def emit_exit(self, index: int, stack: list, indent: int = 1):
+        """
+        Emits the code that leaves the trace, so that the interpreter carries on from ``index`` with ``stack``.
+        """
+        for arg in self.written:
+            self.emit("varnames[{0}] = l{0}".format(arg), indent)
+        for slot, item in enumerate(stack):
+            self.emit("stack[{}] = {}".format(slot, item), indent)
+        self.emit("state.sp = {}".format(len(stack)), indent)
+        self.emit("state.pc = {}".format(index), indent)
+        self.emit("return {}".format(len(self.exit_indexes)), indent)
+        self.exit_indexes.append(index)
+
+    def push_result(self, expression: str, index: int):
+        """
+        Emits an operation that may raise, and pushes its result.
+        """
+        # The program counter is only needed if it raises, so it is kept in a variable until then.
+        self.emit("pc = {}".format(index + 1))
+        result = self.temp()
+        self.emit("{} = {}".format(result, expression))
+        self.stack.append(result)
+
+    def compile_step(self, index: int, instruction: NInstruction, observed, next_pc: int) -> bool:
+        """
+        Emits the code for one recorded instruction.
+
+        :return: False if the instruction can't be compiled.
+        """
+        opcode = instruction.opcode
+        opname = instruction.opname
+        arg = instruction.arg
+        stack = self.stack
+
+        if opcode == LOAD_FAST:
+            stack.append("l{}".format(arg))
+        elif opname == "LOAD_CONST":
+            stack.append(self.bind(self.state.consts[arg]))
+        elif opcode == STORE_FAST:
+            value = stack.pop()
+            local = "l{}".format(arg)
+            # Loads of the local that are still on the stack need the old value.
+            if local in stack:
+                copy = self.temp()
+                self.emit("{} = {}".format(copy, local))
+                stack[:] = [copy if item == local else item for item in stack]
+            self.emit("{} = {}".format(local, value))
+        elif opname == "POP_TOP":
+            stack.pop()
+        elif opname == "LOAD_GLOBAL":
+            name = repr(self.state.names[arg])
+            result = self.temp()
+            self.emit("{} = G.get({}, MISSING)".format(result, name))
+            self.emit("if {} is MISSING:".format(result))
+            self.emit("{} = B.get({}, MISSING)".format(result, name), 1)
+            self.emit("if {} is MISSING:".format(result), 1)
+            # Let the interpreter raise the NameError.
+            self.emit_exit(index, stack, 2)
+            stack.append(result)
+        elif opname == "LOAD_ATTR":
+            self.push_result("{}.{}".format(stack.pop(), self.state.names[arg]), index)
+        elif opname == "BINARY_SUBSCR":
+            right = stack.pop()
+            self.push_result("{}[{}]".format(stack.pop(), right), index)
+        elif opcode in BINARY_OPS:
+            right = stack.pop()
+            self.push_result("{} {} {}".format(stack.pop(), BINARY_OPS[opcode], right), index)
+        elif opcode in INPLACE_OPS:
+            right = stack.pop()
+            left = stack.pop()
+            result = self.temp()
+            self.emit("pc = {}".format(index + 1))
+            self.emit("{} = {}".format(result, left))
+            self.emit("{} {}= {}".format(result, INPLACE_OPS[opcode], right))
+            stack.append(result)
+        elif opcode in UNARY_OPS:
+            self.push_result("{}{}".format(UNARY_OPS[opcode], stack.pop()), index)
+        elif opname == "COMPARE_OP":
+            right = stack.pop()
+            self.push_result("{} {} {}".format(stack.pop(), dis.cmp_op[arg], right), index)
+        elif opname in ("BUILD_TUPLE", "BUILD_LIST"):
+            items = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            if opname == "BUILD_TUPLE":
+                result = "({})".format("".join(item + ", " for item in items))
+            else:
+                result = "[{}]".format(", ".join(items))
+            # Building a container can't raise.
+            temp = self.temp()
+            self.emit("{} = {}".format(temp, result))
+            stack.append(temp)
+        elif opcode == CALL_FUNCTION:
+            func = stack[len(stack) - arg - 1]
+            self.emit("if {} is not {}:".format(func, self.bind(observed)))
+            self.guards.add(len(self.exit_indexes))
+            self.emit_exit(index, stack)
+            args = stack[len(stack) - arg:]
+            del stack[len(stack) - arg - 1:]
+            self.push_result("{}({})".format(func, ", ".join(args)), index)
+        elif opname in ("POP_JUMP_IF_FALSE", "POP_JUMP_IF_TRUE"):
+            value = stack.pop()
+            jump_if = opname == "POP_JUMP_IF_TRUE"
+            jumped = next_pc == instruction.target
+            # Leave the trace if the value would have gone the other way.
+            self.emit("pc = {}".format(index + 1))
+            self.emit("if {}{}:".format("" if jumped != jump_if else "not ", value))
+            self.emit_exit(index + 1 if jumped else instruction.target, stack)
+        elif opname in ("JUMP_IF_FALSE_OR_POP", "JUMP_IF_TRUE_OR_POP"):
+            value = stack[-1]
+            jump_if = opname == "JUMP_IF_TRUE_OR_POP"
+            jumped = next_pc == instruction.target
+            self.emit("pc = {}".format(index + 1))
+            self.emit("if {}{}:".format("" if jumped != jump_if else "not ", value))
+            if jumped:
+                # Not jumping pops the value.
+                self.emit_exit(index + 1, stack[:-1])
+            else:
+                self.emit_exit(instruction.target, stack)
+                stack.pop()
+        elif opname in ("JUMP_FORWARD", "JUMP_ABSOLUTE"):
+            pass
+        elif opname == "FOR_ITER":
+            if next_pc != index + 1:
+                return False
+            iterator = stack[-1]
+            self.push_result("next({}, MISSING)".format(iterator), index)
+            self.emit("if {} is MISSING:".format(stack[-1]))
+            # The exhausted iterator is popped, and the loop is over.
+            self.emit_exit(instruction.target, stack[:-2])
+        else:
+            return False
+        return True
+
+    def compile(self) -> str:
+        """
+        :return: The source of the trace, or None if it can't be compiled.
+        """
+        for index, instruction, observed, next_pc in self.steps[:-1]:
+            if not self.compile_step(index, instruction, observed, next_pc):
+                return None
+
+        # Back to the top of the loop, with the stack in the same shape it started in.
+        if len(self.stack) != self.depth:
+            return None
+        changed = [(slot, item) for slot, item in enumerate(self.stack) if item != "s{}".format(slot)]
+        if changed:
+            self.emit("{} = {}".format(", ".join("s{}".format(slot) for slot, item in changed),
+                                       ", ".join(item for slot, item in changed) + ","))
+
+        lines = [
+            "def trace(state):",
+            "    varnames = state.varnames_stored",
+            "    stack = state.stack",
+            "    G = state.globals",
+            "    B = state.builtins",
+        ]
+        lines.extend("    s{0} = stack[{0}]".format(slot) for slot in range(self.depth))
+        lines.extend("    l{0} = varnames[{0}]".format(arg) for arg in self.used)
+        lines.append("    pc = {}".format(self.header + 1))
+        lines.append("    try:")
+        lines.append("        while True:")
+
+        # The types of the locals the loop reads before writing are checked on every iteration.
+        body = self.lines
+        self.lines = []
+        if self.types:
+            guards = " or ".join("type(l{}) is not {}".format(arg, self.bind(tp))
+                                 for arg, tp in sorted(self.types.items()))
+            self.emit("if {}:".format(guards))
+            self.emit_exit_head()
+        lines.extend(self.lines)
+        lines.extend(body)
+        if not body:
+            lines.append("            pass")
+
+        lines.append("    except BaseException:")
+        lines.extend("        varnames[{0}] = l{0}".format(arg) for arg in self.written)
+        lines.append("        state.pc = pc")
+        lines.append("        raise")
+        return "\n".join(lines) + "\n"
+
+    def emit_exit_head(self):
+        """
+        Emits exit 0, which goes back to the interpreter at the top of the loop.
+        """
+        for arg in self.written:
+            self.emit("varnames[{0}] = l{0}".format(arg), 1)
+        for slot in range(self.depth):
+            self.emit("stack[{0}] = s{0}".format(slot), 1)
+        self.emit("state.sp = {}".format(self.depth), 1)
+        self.emit("state.pc = {}".format(self.header), 1)
+        self.emit("return 0", 1)
+
+
+def compile_trace(state: FunctionState, steps: list, types: dict, header: int):
+    """
+    Compiles a recorded trace into a Python function.
+
+    :param state: The state of the function the trace was recorded in. The stack pointer must be at the depth of the
+        loop header.
+    :param steps: The steps returned by :func:`record`.
+    :param types: The types returned by :func:`record`.
+    :param header: The index of the loop header.
+    :return: A new :class:`Trace`, or None if the trace can't be compiled.
+    """
+    compiler = _TraceCompiler(state, steps, types, header)
+    source = compiler.compile()
+    if source is None:
+        return None
+
+    namespace = compiler.namespace
+    instructions = state.instructions
+    name = state.decoded.name
+    offset = instructions[header].offset
+    exec(compile(source, "<trace of {} at {}>".format(name, offset), "exec"), namespace)
+    exit_offsets = [instructions[index].offset for index in compiler.exit_indexes]
+    return Trace(name, offset, len(steps), source, namespace["trace"], exit_offsets, frozenset(compiler.guards))
+
+
+class TraceCache:
+    """
+    The compiled traces of an engine.
+
+    Traces are kept on the :class:`LoopAnchor` of their loop, so that entering one doesn't need a lookup. This keeps
+    track of every anchor with a trace, in the order they were last entered, and throws away the trace that was entered
+    longest ago once there are more than ``max_size``.
+
+    :param max_size: The most traces to keep.
+    :param threshold: The number of times a loop goes round before it is recorded.
+
+    :ivar compiled: The number of traces compiled.
+    :ivar aborts: The number of recordings that stopped before the end of the loop.
+    :ivar evictions: The number of traces thrown away to make room.
+    :ivar retraces: The number of traces thrown away because their guards kept failing.
+    """
+
+    def __init__(self, max_size: int = TRACE_CACHE_SIZE, threshold: int = JIT_THRESHOLD):
+        self.max_size = max_size
+        self.threshold = threshold
+        # Maps anchor -> trace, least recently entered first.
+        self._traces = collections.OrderedDict()
+
+        self.compiled = 0
+        self.aborts = 0
+        self.evictions = 0
+        self.retraces = 0
+
+    def record(self, state: FunctionState, anchor: LoopAnchor, header: int):
+        """
+        Records and compiles the loop at ``header``.
+
+        :return: A tuple of the new :class:`Trace` (or None), and the signal for the engine (or None).
+        """
+        anchor.counter = 0
+        steps, types, why = record(state, header)
+        trace = None
+        if steps is not None:
+            # The loop is back at its header, so the stack is the same depth as when recording started.
+            trace = compile_trace(state, steps, types, header)
+        if trace is None:
+            self.aborts += 1
+            anchor.aborts += 1
+            if anchor.aborts >= MAX_ABORTS:
+                anchor.blacklisted = True
+            return None, why
+
+        self.compiled += 1
+        anchor.trace = trace
+        self._add(anchor, trace)
+        return trace, None
+
+    def _add(self, anchor: LoopAnchor, trace: Trace):
+        """
+        Starts keeping track of the trace of a loop, throwing away the trace entered longest ago if there are too many.
+        """
+        traces = self._traces
+        traces[anchor] = trace
+        if len(traces) > self.max_size:
+            evicted, _ = traces.popitem(last=False)
+            evicted.trace = None
+            self.evictions += 1
+
+    def enter(self, state: FunctionState, anchor: LoopAnchor, trace: Trace):
+        """
+        Runs a trace, until it leaves the loop or a guard fails.
+        """
+        traces = self._traces
+        if anchor in traces:
+            traces.move_to_end(anchor)
+        else:
+            # Compiled by another engine sharing the same code cache.
+            self._add(anchor, trace)
+        trace.entries += 1
+        exit_number = trace.func(state)
+        trace.exit_counts[exit_number] += 1
+        if exit_number not in trace.guards:
+            # The trace ran as recorded, so the guards only need to fail again if they keep failing in a row.
+            trace.guard_failures = 0
+            return
+        trace.guard_failures += 1
+        if trace.guard_failures >= MAX_GUARD_FAILURES:
+            # The loop sees different types or functions now, so record it again.
+            self.discard(anchor)
+            self.retraces += 1
+            anchor.retraces += 1
+            if anchor.retraces >= MAX_ABORTS:
+                anchor.blacklisted = True
+
+    def discard(self, anchor: LoopAnchor):
+        """
+        Throws away the trace of a loop, so that it is recorded again once it is hot.
+        """
+        self._traces.pop(anchor, None)
+        anchor.trace = None
+        anchor.counter = 0
+
+    def clear(self):
+        """
+        Throws away every trace, and resets the counters.
+        """
+        for anchor in self._traces:
+            anchor.trace = None
+            anchor.counter = 0
+        self._traces.clear()
+        self.compiled = 0
+        self.aborts = 0
+        self.evictions = 0
+        self.retraces = 0
+
+    def stats(self) -> dict:
+        """
+        :return: A dict of the number of traces compiled, aborted, evicted and retraced, and the current size.
+        """
+        return {"compiled": self.compiled, "aborts": self.aborts, "evictions": self.evictions,
+                "retraces": self.retraces, "size": len(self._traces)}
+
+    def __len__(self):
+        return len(self._traces)
+
+
+def handle_jump_backward(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a backward JUMP_ABSOLUTE, when code is decoded with ``jit=True``.
+
+    This jumps, and then counts the loop, records it once it is hot, or runs its trace.
+    """
+    header = instruction.target
+    state.pc = header
+    anchor = instruction.cache
+    trace = anchor.trace
+    if trace is None and anchor.blacklisted:
+        return
+    engine = state.engine
+    # Traces skip the hooks, and the other backends don't keep the program counter up to date.
+    if state.runner is not engine._loop_runner:
+        return
+
+    traces = engine.trace_cache
+    if trace is None:
+        anchor.counter += 1
+        if anchor.counter < traces.threshold:
+            return
+        trace, why = traces.record(state, anchor, header)
+        if trace is None:
+            return why
+    traces.enter(state, anchor, trace)
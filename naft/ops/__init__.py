@@ -2,19 +2,26 @@
 This package contains the NAFT operators.
 
 They're grouped into files that are similar.
+Each operator registers itself into :data:`naft.ops.dispatch.DISPATCH_TABLE` when its module is imported.
 """
 
-import functools
-
 # Imports.
 # Make sure to keep these updated.
 from naft.ops import load
+from naft.ops import store
 from naft.ops import call
+from naft.ops import attr
 from naft.ops import misc
+from naft.ops import jump
+from naft.ops import binary
+from naft.ops import build
+from naft.ops import fused
+from naft.ops import generator
+
+from naft.ops.dispatch import DISPATCH_TABLE, register
 
 
-@functools.lru_cache(maxsize=None)
-def find_operator_implementation(opcode: int):
+def find_operator_implementation(opcode: int, table: list = None):
     """
     Finds the NAFT implementation of this opcode.
 
@@ -23,11 +30,10 @@ def find_operator_implementation(opcode: int):
     If the function could not be found, it will return None.
 
     :param opcode: The opcode to search.
+    :param table: The dispatch table to search. Defaults to the global dispatch table.
     :return: The callable function.
     """
-    for k, v in globals().items():
-        f = getattr(v, "handle_op_{}".format(opcode), None)
-        if f:
-            return f
+    if table is None:
+        table = DISPATCH_TABLE
 
-    return None
+    return table[opcode]
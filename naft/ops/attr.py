@@ -0,0 +1,255 @@
+"""
+Attribute access opcodes.
+
+The generic handlers just call :func:`getattr`, :func:`setattr` and :func:`delattr`. When a code object is decoded with
+``cache_attributes=True``, ``LOAD_ATTR`` and ``LOAD_METHOD`` get an :class:`AttrCache` instead, which remembers how an
+attribute was found on the last type it was loaded from:
+
+ - ``instance``: the attribute isn't on the class, so it comes from the instance dict.
+ - ``slot``: the attribute is a slot on the class, so it is read straight from the slot.
+ - ``method``: the attribute is a plain function (or builtin method) on the class.
+ - ``class``: the attribute is any other non-data descriptor or value on the class.
+ - ``descriptor``: the attribute is any other data descriptor on the class, such as a property.
+ - ``generic``: the type customises attribute access, so nothing is cached and :func:`getattr` is used.
+
+The class attribute is found by walking the MRO once, and is used for as long as the receiver has the same type and no
+class has been changed; see :func:`naft.watch.changed_class`. A hit only compares the type and that version, so it costs
+the same however deep the MRO is. The price is that changes made to a class by native code (setting or deleting a class
+attribute, or assigning ``__bases__``) aren't seen until :func:`naft.watch.changed_class` is called.
+"""
+import types
+
+from naft import watch
+from naft.instruction import NInstruction
+from naft.ops.call import EMPTY_DICT, call
+from naft.ops.dispatch import register
+from naft.state import FunctionState, NAFT_NULL
+
+ATTR_GENERIC = 0
+ATTR_INSTANCE = 1
+ATTR_SLOT = 2
+ATTR_METHOD = 3
+ATTR_CLASS = 4
+ATTR_DESCRIPTOR = 5
+
+# The names of the kinds, for stats.
+KIND_NAMES = ("generic", "instance", "slot", "method", "class", "descriptor")
+
+# Types of class attributes that can be called with the receiver as the first argument, instead of being bound.
+METHOD_TYPES = (types.FunctionType, type(str.join))
+
+# Marks a name that isn't on the class at all.
+_MISSING = object()
+
+_OBJECT_GETATTRIBUTE = object.__getattribute__
+
+
+def _lookup_class(tp: type, name: str):
+    """
+    Looks up a name on a class, by walking its MRO like CPython does.
+
+    :return: The class attribute, or ``_MISSING`` if no class in the MRO has it.
+    """
+    for klass in tp.__mro__:
+        namespace = klass.__dict__
+        if name in namespace:
+            return namespace[name]
+    return _MISSING
+
+
+class AttrCache:
+    """
+    The inline cache for a single LOAD_ATTR or LOAD_METHOD instruction.
+
+    :ivar name: The name of the attribute.
+    :ivar type: The type of the receiver the cache was filled for.
+    :ivar version: The version of :data:`naft.watch.classes` the cache was filled with.
+    :ivar kind: How the attribute is found; one of the ``ATTR_`` kinds.
+    :ivar dict_first: If the instance dict has to be checked before the class attribute.
+    :ivar value: The class attribute, or ``_MISSING`` if the name isn't on the class (or the kind is generic).
+    :ivar getter: The ``__get__`` of the class attribute, if it is a descriptor.
+    :ivar hits: The number of loads that used the cache.
+    :ivar misses: The number of loads that had to fill the cache.
+    """
+    __slots__ = ("name", "type", "version", "kind", "dict_first", "value", "getter", "hits", "misses")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.type = None
+        self.version = -1
+        self.kind = ATTR_GENERIC
+        self.dict_first = False
+        self.value = _MISSING
+        self.getter = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def kind_name(self) -> str:
+        return KIND_NAMES[self.kind]
+
+    def fill(self, tp: type):
+        """
+        Fills the cache for a receiver type.
+        """
+        self.type = tp
+        self.version = watch.classes.version
+        self.dict_first = False
+        self.value = _MISSING
+        self.getter = None
+
+        if _lookup_class(tp, "__getattribute__") is not _OBJECT_GETATTRIBUTE:
+            # Attribute access is customised (this includes classes and modules), so it can't be predicted.
+            self.kind = ATTR_GENERIC
+            return
+
+        has_dict = tp.__dictoffset__ != 0
+        value = _lookup_class(tp, self.name)
+        if value is _MISSING:
+            # Without an instance dict, this is either __getattr__ or an AttributeError.
+            self.kind = ATTR_INSTANCE if has_dict else ATTR_GENERIC
+            self.dict_first = has_dict
+            return
+
+        self.value = value
+        descriptor_type = type(value)
+        if hasattr(descriptor_type, "__set__") or hasattr(descriptor_type, "__delete__"):
+            # Data descriptors take priority over the instance dict.
+            self.kind = ATTR_SLOT if descriptor_type is types.MemberDescriptorType else ATTR_DESCRIPTOR
+            self.getter = value.__get__
+            return
+
+        self.dict_first = has_dict
+        if hasattr(descriptor_type, "__get__"):
+            self.getter = value.__get__
+        self.kind = ATTR_METHOD if descriptor_type in METHOD_TYPES else ATTR_CLASS
+
+    def load(self, obj):
+        """
+        Loads the attribute from an object of the cached type.
+        """
+        if self.dict_first:
+            try:
+                return obj.__dict__[self.name]
+            except KeyError:
+                pass
+        getter = self.getter
+        if getter is not None:
+            return getter(obj, self.type)
+        value = self.value
+        if value is _MISSING:
+            # Let getattr call __getattr__, or raise the AttributeError.
+            return getattr(obj, self.name)
+        return value
+
+
+def _get_cache(instruction: NInstruction, obj) -> AttrCache:
+    """
+    Gets the cache of an instruction, filling it if it doesn't match the type of ``obj``.
+    """
+    cache = instruction.cache
+    tp = type(obj)
+    if cache.type is tp and cache.version == watch.classes.version:
+        cache.hits += 1
+    else:
+        cache.misses += 1
+        cache.fill(tp)
+    return cache
+
+
+@register("LOAD_ATTR")
+def handle_op_106(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a LOAD_ATTR opcode.
+
+    This replaces the top of the stack with the attribute named by ``names[arg]``.
+    """
+    sp = state.sp - 1
+    state.stack[sp] = getattr(state.stack[sp], state.names[instruction.arg])
+
+
+def handle_load_attr_cached(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a LOAD_ATTR opcode, using the inline cache on the instruction.
+
+    This replaces :func:`handle_op_106` when the engine is created with ``cache_attributes=True``.
+    """
+    stack = state.stack
+    sp = state.sp - 1
+    obj = stack[sp]
+    stack[sp] = _get_cache(instruction, obj).load(obj)
+
+
+@register("STORE_ATTR")
+def handle_op_95(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a STORE_ATTR opcode.
+
+    The top of the stack is the object, and below it is the value.
+    """
+    obj = state.pop()
+    value = state.pop()
+    setattr(obj, state.names[instruction.arg], value)
+    if isinstance(obj, type):
+        watch.changed_class(obj)
+
+
+@register("DELETE_ATTR")
+def handle_op_96(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a DELETE_ATTR opcode.
+    """
+    obj = state.pop()
+    delattr(obj, state.names[instruction.arg])
+    if isinstance(obj, type):
+        watch.changed_class(obj)
+
+
+# LOAD_METHOD and CALL_METHOD only exist on Python 3.7 and above.
+# On older versions, a method call is a LOAD_ATTR followed by a CALL_FUNCTION, and the bound method is unpacked when it
+# is called instead; see :func:`naft.ops.call.call`.
+
+@register("LOAD_METHOD")
+def handle_op_160(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a LOAD_METHOD opcode.
+
+    This pushes two items for CALL_METHOD. Without the cache, this is always ``NAFT_NULL`` and the bound attribute.
+    """
+    obj = state.pop()
+    state.push(NAFT_NULL)
+    state.push(getattr(obj, state.names[instruction.arg]))
+
+
+def handle_load_method_cached(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a LOAD_METHOD opcode, using the inline cache on the instruction.
+
+    If the attribute is a method on the class, and isn't shadowed by the instance dict, this pushes the unbound method
+    and the receiver, so that no bound method is created.
+    """
+    obj = state.pop()
+    cache = _get_cache(instruction, obj)
+    if cache.kind == ATTR_METHOD and not (cache.dict_first and cache.name in obj.__dict__):
+        state.push(cache.value)
+        state.push(obj)
+    else:
+        state.push(NAFT_NULL)
+        state.push(cache.load(obj))
+
+
+@register("CALL_METHOD")
+def handle_op_161(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a CALL_METHOD opcode.
+
+    Below the arguments are the two items pushed by LOAD_METHOD: either an unbound method and its receiver, or
+    ``NAFT_NULL`` and a callable.
+    """
+    args = state.pop_n(instruction.arg)
+    receiver = state.pop()
+    method = state.pop()
+    if method is NAFT_NULL:
+        return call(state, receiver, args, EMPTY_DICT)
+    args.insert(0, receiver)
+    return call(state, method, args, EMPTY_DICT)
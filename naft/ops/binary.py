@@ -0,0 +1,102 @@
+"""
+Binary, in-place, unary and comparison operators.
+
+These all map directly onto a function in :mod:`operator`, so the handlers are generated from a table rather than
+written out one by one.
+"""
+import dis
+import operator
+
+from naft.instruction import NInstruction
+from naft.ops.dispatch import register
+from naft.state import FunctionState
+
+BINARY_OPERATORS = {
+    "BINARY_POWER": operator.pow,
+    "BINARY_MULTIPLY": operator.mul,
+    "BINARY_MATRIX_MULTIPLY": operator.matmul,
+    "BINARY_FLOOR_DIVIDE": operator.floordiv,
+    "BINARY_TRUE_DIVIDE": operator.truediv,
+    "BINARY_MODULO": operator.mod,
+    "BINARY_ADD": operator.add,
+    "BINARY_SUBTRACT": operator.sub,
+    "BINARY_SUBSCR": operator.getitem,
+    "BINARY_LSHIFT": operator.lshift,
+    "BINARY_RSHIFT": operator.rshift,
+    "BINARY_AND": operator.and_,
+    "BINARY_XOR": operator.xor,
+    "BINARY_OR": operator.or_,
+    "INPLACE_POWER": operator.ipow,
+    "INPLACE_MULTIPLY": operator.imul,
+    "INPLACE_MATRIX_MULTIPLY": operator.imatmul,
+    "INPLACE_FLOOR_DIVIDE": operator.ifloordiv,
+    "INPLACE_TRUE_DIVIDE": operator.itruediv,
+    "INPLACE_MODULO": operator.imod,
+    "INPLACE_ADD": operator.iadd,
+    "INPLACE_SUBTRACT": operator.isub,
+    "INPLACE_LSHIFT": operator.ilshift,
+    "INPLACE_RSHIFT": operator.irshift,
+    "INPLACE_AND": operator.iand,
+    "INPLACE_XOR": operator.ixor,
+    "INPLACE_OR": operator.ior,
+}
+
+UNARY_OPERATORS = {
+    "UNARY_POSITIVE": operator.pos,
+    "UNARY_NEGATIVE": operator.neg,
+    "UNARY_NOT": operator.not_,
+    "UNARY_INVERT": operator.invert,
+}
+
+# Indexed by the argument to COMPARE_OP.
+# This follows the order of ``dis.cmp_op``.
+COMPARE_OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda a, b: a in b,
+    "not in": lambda a, b: a not in b,
+    "is": operator.is_,
+    "is not": operator.is_not,
+}
+COMPARE_TABLE = [COMPARE_OPERATORS.get(name) for name in dis.cmp_op]
+
+
+def _make_binary_handler(name: str, func):
+    def handler(state: FunctionState, instruction: NInstruction):
+        right = state.pop()
+        left = state.pop()
+        state.push(func(left, right))
+
+    handler.__name__ = "handle_op_{}".format(dis.opmap.get(name))
+    handler.__doc__ = "Handles {}.".format(name)
+    return handler
+
+
+def _make_unary_handler(name: str, func):
+    def handler(state: FunctionState, instruction: NInstruction):
+        state.push(func(state.pop()))
+
+    handler.__name__ = "handle_op_{}".format(dis.opmap.get(name))
+    handler.__doc__ = "Handles {}.".format(name)
+    return handler
+
+
+for _name, _func in BINARY_OPERATORS.items():
+    register(_name)(_make_binary_handler(_name, _func))
+
+for _name, _func in UNARY_OPERATORS.items():
+    register(_name)(_make_unary_handler(_name, _func))
+
+
+@register("COMPARE_OP")
+def handle_op_107(state: FunctionState, instruction: NInstruction):
+    """
+    Handles COMPARE_OP.
+    """
+    right = state.pop()
+    left = state.pop()
+    state.push(COMPARE_TABLE[instruction.arg](left, right))
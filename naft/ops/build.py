@@ -0,0 +1,75 @@
+"""
+Handling for BUILD_ opcodes.
+"""
+
+from naft.instruction import NInstruction
+from naft.ops.dispatch import register
+from naft.state import FunctionState
+
+
+@register("BUILD_TUPLE")
+def handle_op_102(state: FunctionState, instruction: NInstruction):
+    """
+    Handles BUILD_TUPLE.
+    """
+    state.push(tuple(state.pop_n(instruction.arg)))
+
+
+@register("BUILD_LIST")
+def handle_op_103(state: FunctionState, instruction: NInstruction):
+    """
+    Handles BUILD_LIST.
+    """
+    state.push(state.pop_n(instruction.arg))
+
+
+@register("BUILD_MAP")
+def handle_op_105(state: FunctionState, instruction: NInstruction):
+    """
+    Handles BUILD_MAP.
+
+    The stack holds the keys and values, as key, value, key, value...
+    """
+    items = state.pop_n(instruction.arg * 2)
+    state.push(dict(zip(items[::2], items[1::2])))
+
+
+@register("BUILD_CONST_KEY_MAP")
+def handle_op_156(state: FunctionState, instruction: NInstruction):
+    """
+    Handles BUILD_CONST_KEY_MAP.
+
+    The top of the stack is a tuple of keys, and below that are the values.
+    """
+    keys = state.pop()
+    state.push(dict(zip(keys, state.pop_n(instruction.arg))))
+
+
+@register("BUILD_TUPLE_UNPACK_WITH_CALL")
+def handle_op_158(state: FunctionState, instruction: NInstruction):
+    """
+    Handles BUILD_TUPLE_UNPACK_WITH_CALL.
+
+    This joins the iterables on the stack into one tuple of positional arguments, for CALL_FUNCTION_EX.
+    """
+    args = []
+    for iterable in state.pop_n(instruction.arg):
+        args.extend(iterable)
+    state.push(tuple(args))
+
+
+@register("BUILD_MAP_UNPACK_WITH_CALL")
+def handle_op_159(state: FunctionState, instruction: NInstruction):
+    """
+    Handles BUILD_MAP_UNPACK_WITH_CALL.
+
+    This joins the mappings on the stack into one dict of keyword arguments, for CALL_FUNCTION_EX. Like a call, a
+    keyword may only be given once.
+    """
+    kwargs = {}
+    for mapping in state.pop_n(instruction.arg):
+        for key in mapping.keys():
+            if key in kwargs:
+                raise TypeError("got multiple values for keyword argument '{}'".format(key))
+            kwargs[key] = mapping[key]
+    state.push(kwargs)
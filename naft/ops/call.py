@@ -3,43 +3,113 @@ CALL_FUNCTION opcode.
 
 This function is pretty heavy handed, which is why it needs to be isolated and special cased.
 """
-import dis
-import functools
-
+from naft.callables import CALLABLE_FUNCTION, CALLABLE_GENERATOR, CALLABLE_METHOD, CALLABLE_NFUNCTION, classify
+from naft.exceptions import signals
+from naft.instruction import NInstruction
+from naft.ops.dispatch import register
 from naft.state import FunctionState
-from naft.wrapper import NFunction, _NRunnableObject
+
+# Shared empty keyword arguments and options, for calls that don't have any.
+# This must never be modified.
+EMPTY_DICT = {}
 
 
-def handle_op_131(state: FunctionState, instruction: dis.Instruction):
+def call(state: FunctionState, func, args, kwargs: dict):
     """
-    Handles CALL_FUNCTION.
+    Calls a function with some arguments.
+
+    Native functions are called straight away, and the result is pushed. Interpreted functions are pushed onto the
+    engine's call stack instead, and the engine is signalled to switch to them; the engine pushes the result once the
+    function returns. Interpreted generator functions push a new generator; see :mod:`naft.generator`.
+
+    :return: The signal for the engine, if there is one.
     """
-    # args are on the stack backwards
-    # this means we have to use a reverse() on a list.
-    args_to_get = instruction.arg
-    args = []
-    for i in range(0, args_to_get):
-        # Pop from the stack and add it to args.
-        args.append(state.pop())
+    kind = classify(func)
+    if kind == CALLABLE_METHOD:
+        method_kind = classify(func.__func__)
+        if method_kind == CALLABLE_FUNCTION or method_kind == CALLABLE_GENERATOR:
+            # A method of an interpreted function; run the function with the receiver as the first argument.
+            args = (func.__self__,) + tuple(args)
+            func = func.__func__
+            kind = method_kind
+    if kind == CALLABLE_FUNCTION:
+        state.engine._push_frame(func, args, kwargs, EMPTY_DICT)
+        return signals.WHY_CALL
+
+    options = EMPTY_DICT
+    if kind == CALLABLE_NFUNCTION:
+        # Run it with its own options.
+        options = func.options
+        func = func._callable
+        kind = classify(func)
+        if kind == CALLABLE_FUNCTION:
+            state.engine._push_frame(func, args, kwargs, options)
+            return signals.WHY_CALL
+    if kind == CALLABLE_GENERATOR:
+        # Calling a generator function only creates the generator. Nothing in it runs until it is iterated.
+        state.push(state.engine._make_generator(func, args, kwargs, options))
+        return
+
+    # Anything else is called natively, without wrapping it.
+    if kwargs:
+        state.push(func(*args, **kwargs))
+    else:
+        state.push(func(*args))
 
-    # Reverse the args.
-    args = list(reversed(args))
+
+def call_function(state: FunctionState, args_to_get: int):
+    """
+    Calls the function on the stack with ``args_to_get`` positional arguments.
+
+    This is shared between CALL_FUNCTION and the superinstructions that contain it.
+    """
+    # The args are the top of the stack, in order, so they can be taken as one slice.
+    args = state.pop_n(args_to_get)
     # Pop the function.
     func = state.pop()
-    if isinstance(func, NFunction):
-        # No need to wrap, just create the _NRunnableObject.
-        runnable = func(*args)
-        runnable = functools.partial(state.engine.run_function, runnable)
-    # Check if the function is marked with a `_no_naft_execute`
-    if hasattr(func, "_no_naft_execute"):
-        # Create a plain executor.
-        runnable = functools.partial(func, *args)
+    return call(state, func, args, EMPTY_DICT)
+
+
+@register("CALL_FUNCTION")
+def handle_op_131(state: FunctionState, instruction: NInstruction):
+    """
+    Handles CALL_FUNCTION.
+    """
+    return call_function(state, instruction.arg)
+
+
+@register("CALL_FUNCTION_KW")
+def handle_op_141(state: FunctionState, instruction: NInstruction):
+    """
+    Handles CALL_FUNCTION_KW.
+
+    The top of the stack is a tuple of keyword names. Below that are the arguments, with the values of the keyword
+    arguments last, and below those is the function.
+    """
+    names = state.pop()
+    args = state.pop_n(instruction.arg)
+    func = state.pop()
+    split = len(args) - len(names)
+    kwargs = dict(zip(names, args[split:]))
+    return call(state, func, args[:split], kwargs)
+
+
+@register("CALL_FUNCTION_EX")
+def handle_op_142(state: FunctionState, instruction: NInstruction):
+    """
+    Handles CALL_FUNCTION_EX.
+
+    If the lowest bit of the argument is set, the top of the stack is a mapping of keyword arguments. Below that is an
+    iterable of positional arguments, and below that is the function.
+    """
+    if instruction.arg & 1:
+        kwargs = state.pop()
+        if not isinstance(kwargs, dict):
+            kwargs = dict(kwargs)
     else:
-        # Wrap the function in an _NRunnableObject.
-        wrapped = _NRunnableObject(func, args, {})
-        runnable = functools.partial(state.engine.run_function, wrapped)
-
-    # Run the runnable.
-    result = runnable()
-    # Push it onto the stack.
-    state.push(result)
+        kwargs = EMPTY_DICT
+    args = state.pop()
+    if not isinstance(args, tuple):
+        args = tuple(args)
+    func = state.pop()
+    return call(state, func, args, kwargs)
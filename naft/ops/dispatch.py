@@ -0,0 +1,47 @@
+"""
+The opcode dispatch table.
+
+Operators register themselves into this table with the :func:`register` decorator. The table is a flat list indexed by
+opcode, which is then used to resolve the handler for each instruction when a code object is decoded.
+"""
+import dis
+
+from naft.exceptions.internal import BadOpcode
+
+# The default dispatch table.
+# Every engine uses this, unless it overrides a handler.
+DISPATCH_TABLE = [None] * 256
+
+
+def register(opcode, table: list = None):
+    """
+    Decorator that registers an operator implementation for an opcode.
+
+    :param opcode: The opcode to register, either as a number or as an opname (e.g. ``"LOAD_GLOBAL"``).
+        If an opname doesn't exist on this version of Python, the function is not registered.
+    :param table: The dispatch table to register into. Defaults to the global :data:`DISPATCH_TABLE`.
+    """
+    if table is None:
+        table = DISPATCH_TABLE
+
+    def _inner(func):
+        if isinstance(opcode, str):
+            if opcode not in dis.opmap:
+                return func
+            op = dis.opmap[opcode]
+        else:
+            op = opcode
+
+        table[op] = func
+        return func
+
+    return _inner
+
+
+def handle_bad_opcode(state, instruction):
+    """
+    Placeholder handler for opcodes that have no implementation.
+
+    This is resolved at decode time, so that the engine never needs to check for a missing handler.
+    """
+    raise BadOpcode(instruction, state._wrapped_func)
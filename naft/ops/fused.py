@@ -0,0 +1,122 @@
+"""
+Superinstructions.
+
+These are handlers for common pairs of instructions, fused into one instruction when a code object is decoded. This
+saves a full trip through the engine loop for the second instruction.
+
+The fused instruction takes the ``arg`` of the first instruction, the ``arg2`` of the second instruction, and the
+``target`` of whichever instruction jumps.
+"""
+import dis
+
+from naft.exceptions import signals
+from naft.instruction import EXTENDED_OPNAMES, NInstruction
+from naft.ops.binary import COMPARE_TABLE
+from naft.ops.call import call_function
+from naft.ops.load import load_global
+from naft.state import FunctionState, NAFT_NULL
+
+# Maps (first opcode, second opcode) -> (fused opcode, handler).
+FUSIONS = {}
+
+
+def fusion(first: str, second: str):
+    """
+    Decorator that registers a superinstruction for a pair of opnames.
+
+    The superinstruction is given a new opcode, numbered from 256 upwards.
+    If either opname doesn't exist on this version of Python, the function is not registered.
+    """
+
+    def _inner(func):
+        if first not in dis.opmap or second not in dis.opmap:
+            return func
+
+        opcode = 256 + len(EXTENDED_OPNAMES)
+        EXTENDED_OPNAMES[opcode] = "{}__{}".format(first, second)
+        FUSIONS[(dis.opmap[first], dis.opmap[second])] = (opcode, func)
+        return func
+
+    return _inner
+
+
+@fusion("LOAD_FAST", "LOAD_FAST")
+def handle_load_fast_load_fast(state: FunctionState, instruction: NInstruction):
+    """
+    Handles LOAD_FAST; LOAD_FAST.
+    """
+    first = state.varnames_stored[instruction.arg]
+    if first == NAFT_NULL:
+        raise SystemError("unable to load varname '{}'".format(state.varnames[instruction.arg]))
+    second = state.varnames_stored[instruction.arg2]
+    if second == NAFT_NULL:
+        raise SystemError("unable to load varname '{}'".format(state.varnames[instruction.arg2]))
+    state.push(first)
+    state.push(second)
+
+
+@fusion("LOAD_FAST", "LOAD_CONST")
+def handle_load_fast_load_const(state: FunctionState, instruction: NInstruction):
+    """
+    Handles LOAD_FAST; LOAD_CONST.
+    """
+    varname = state.varnames_stored[instruction.arg]
+    if varname == NAFT_NULL:
+        raise SystemError("unable to load varname '{}'".format(state.varnames[instruction.arg]))
+    state.push(varname)
+    state.push(state.consts[instruction.arg2])
+
+
+@fusion("STORE_FAST", "LOAD_FAST")
+def handle_store_fast_load_fast(state: FunctionState, instruction: NInstruction):
+    """
+    Handles STORE_FAST; LOAD_FAST.
+    """
+    state.varnames_stored[instruction.arg] = state.pop()
+    varname = state.varnames_stored[instruction.arg2]
+    if varname == NAFT_NULL:
+        raise SystemError("unable to load varname '{}'".format(state.varnames[instruction.arg2]))
+    state.push(varname)
+
+
+@fusion("LOAD_FAST", "RETURN_VALUE")
+def handle_load_fast_return_value(state: FunctionState, instruction: NInstruction):
+    """
+    Handles LOAD_FAST; RETURN_VALUE.
+    """
+    varname = state.varnames_stored[instruction.arg]
+    if varname == NAFT_NULL:
+        raise SystemError("unable to load varname '{}'".format(state.varnames[instruction.arg]))
+    state.return_value = varname
+    return signals.WHY_RETURN
+
+
+@fusion("LOAD_CONST", "RETURN_VALUE")
+def handle_load_const_return_value(state: FunctionState, instruction: NInstruction):
+    """
+    Handles LOAD_CONST; RETURN_VALUE.
+    """
+    state.return_value = state.consts[instruction.arg]
+    return signals.WHY_RETURN
+
+
+@fusion("LOAD_GLOBAL", "CALL_FUNCTION")
+def handle_load_global_call_function(state: FunctionState, instruction: NInstruction):
+    """
+    Handles LOAD_GLOBAL; CALL_FUNCTION.
+
+    The global loaded is either the function being called with no arguments, or its last argument.
+    """
+    load_global(state, instruction.arg)
+    return call_function(state, instruction.arg2)
+
+
+@fusion("COMPARE_OP", "POP_JUMP_IF_FALSE")
+def handle_compare_op_pop_jump_if_false(state: FunctionState, instruction: NInstruction):
+    """
+    Handles COMPARE_OP; POP_JUMP_IF_FALSE.
+    """
+    right = state.pop()
+    left = state.pop()
+    if not COMPARE_TABLE[instruction.arg](left, right):
+        state.pc = instruction.target
@@ -0,0 +1,95 @@
+"""
+Generator and coroutine opcodes.
+
+These only run inside the frame of an :class:`naft.generator.NGenerator`; see :mod:`naft.generator`.
+"""
+import inspect
+
+from naft.exceptions import signals
+from naft.generator import COROUTINE_FLAGS, COROUTINE_TYPES, SENDABLE_TYPES, SUSPENDED_YIELD, SUSPENDED_YIELD_FROM, \
+    send_to
+from naft.instruction import NInstruction
+from naft.ops.dispatch import register
+from naft.state import FunctionState
+
+
+def _is_awaitable_generator(value) -> bool:
+    """
+    Checks if a value is a generator that can be awaited, because it was decorated with ``types.coroutine``.
+    """
+    if not isinstance(value, SENDABLE_TYPES) or isinstance(value, COROUTINE_TYPES):
+        return False
+    return bool(value.gi_code.co_flags & inspect.CO_ITERABLE_COROUTINE)
+
+
+def get_awaitable_iter(value):
+    """
+    Gets the iterator that ``await value`` delegates to.
+    """
+    if isinstance(value, COROUTINE_TYPES) or _is_awaitable_generator(value):
+        return value
+
+    await_ = getattr(type(value), "__await__", None)
+    if await_ is None:
+        raise TypeError("object {} can't be used in 'await' expression".format(type(value).__name__))
+    result = await_(value)
+    if isinstance(result, COROUTINE_TYPES):
+        raise TypeError("__await__() returned a coroutine")
+    if not hasattr(result, "__next__"):
+        raise TypeError("__await__() returned non-iterator of type '{}'".format(type(result).__name__))
+    return result
+
+
+@register("YIELD_VALUE")
+def handle_op_86(state: FunctionState, instruction: NInstruction):
+    """
+    Handles YIELD_VALUE.
+
+    The generator is suspended, and the value is handed to whatever resumed it. When the generator is resumed again,
+    the value sent in is pushed.
+    """
+    state.return_value = state.pop()
+    state.suspended = SUSPENDED_YIELD
+    return signals.WHY_YIELD
+
+
+@register("YIELD_FROM")
+def handle_op_72(state: FunctionState, instruction: NInstruction):
+    """
+    Handles YIELD_FROM.
+
+    The top of the stack is the value to send, and below that is the iterator to send it to. If the iterator is
+    exhausted, the value it returned replaces it. Otherwise, the generator is suspended with the iterator still on the
+    stack, and the generator object sends values straight on to it until it is exhausted.
+    """
+    value = state.pop()
+    try:
+        state.return_value = send_to(state.stack[state.sp - 1], value)
+    except StopIteration as e:
+        state.stack[state.sp - 1] = e.value
+        return
+    state.suspended = SUSPENDED_YIELD_FROM
+    return signals.WHY_YIELD
+
+
+@register("GET_YIELD_FROM_ITER")
+def handle_op_69(state: FunctionState, instruction: NInstruction):
+    """
+    Handles GET_YIELD_FROM_ITER.
+
+    Generators and coroutines are delegated to directly; anything else is iterated.
+    """
+    value = state.stack[state.sp - 1]
+    if isinstance(value, COROUTINE_TYPES):
+        if not state._wrapped_func.__code__.co_flags & COROUTINE_FLAGS:
+            raise TypeError("cannot 'yield from' a coroutine object in a non-coroutine generator")
+    elif not isinstance(value, SENDABLE_TYPES):
+        state.stack[state.sp - 1] = iter(value)
+
+
+@register("GET_AWAITABLE")
+def handle_op_73(state: FunctionState, instruction: NInstruction):
+    """
+    Handles GET_AWAITABLE.
+    """
+    state.stack[state.sp - 1] = get_awaitable_iter(state.stack[state.sp - 1])
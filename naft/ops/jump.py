@@ -0,0 +1,133 @@
+"""
+Jump and loop opcodes.
+
+Jump targets are translated into instruction indexes when the code object is decoded, so all of these just assign to
+the program counter.
+"""
+
+from naft.instruction import NInstruction
+from naft.ops.dispatch import register
+from naft.state import FunctionState
+
+
+@register("JUMP_FORWARD")
+def handle_op_110(state: FunctionState, instruction: NInstruction):
+    """
+    Handles JUMP_FORWARD.
+    """
+    state.pc = instruction.target
+
+
+@register("JUMP_ABSOLUTE")
+def handle_op_113(state: FunctionState, instruction: NInstruction):
+    """
+    Handles JUMP_ABSOLUTE.
+    """
+    state.pc = instruction.target
+
+
+@register("POP_JUMP_IF_FALSE")
+def handle_op_114(state: FunctionState, instruction: NInstruction):
+    """
+    Handles POP_JUMP_IF_FALSE.
+    """
+    if not state.pop():
+        state.pc = instruction.target
+
+
+@register("POP_JUMP_IF_TRUE")
+def handle_op_115(state: FunctionState, instruction: NInstruction):
+    """
+    Handles POP_JUMP_IF_TRUE.
+    """
+    if state.pop():
+        state.pc = instruction.target
+
+
+@register("JUMP_IF_FALSE_OR_POP")
+def handle_op_111(state: FunctionState, instruction: NInstruction):
+    """
+    Handles JUMP_IF_FALSE_OR_POP.
+
+    If the top of the stack is false, this jumps and leaves it on the stack. Otherwise, it is popped.
+    """
+    if not state.stack[state.sp - 1]:
+        state.pc = instruction.target
+    else:
+        state.pop()
+
+
+@register("JUMP_IF_TRUE_OR_POP")
+def handle_op_112(state: FunctionState, instruction: NInstruction):
+    """
+    Handles JUMP_IF_TRUE_OR_POP.
+
+    If the top of the stack is true, this jumps and leaves it on the stack. Otherwise, it is popped.
+    """
+    if state.stack[state.sp - 1]:
+        state.pc = instruction.target
+    else:
+        state.pop()
+
+
+@register("GET_ITER")
+def handle_op_68(state: FunctionState, instruction: NInstruction):
+    """
+    Handles GET_ITER.
+    """
+    state.push(iter(state.pop()))
+
+
+@register("FOR_ITER")
+def handle_op_93(state: FunctionState, instruction: NInstruction):
+    """
+    Handles FOR_ITER.
+
+    The iterator on top of the stack is advanced. When it is exhausted, it is popped and the loop jumps to the end.
+    """
+    try:
+        val = next(state.stack[state.sp - 1])
+    except StopIteration:
+        state.pop()
+        state.pc = instruction.target
+    else:
+        state.push(val)
+
+
+@register("SETUP_LOOP")
+def handle_op_120(state: FunctionState, instruction: NInstruction):
+    """
+    Handles SETUP_LOOP.
+
+    This pushes a block, which records where to jump to on a ``break``, and how big the stack should be.
+    """
+    state.block_stack.append((instruction.target, state.sp))
+
+
+@register("POP_BLOCK")
+def handle_op_87(state: FunctionState, instruction: NInstruction):
+    """
+    Handles POP_BLOCK.
+    """
+    state.block_stack.pop()
+
+
+@register("BREAK_LOOP")
+def handle_op_80(state: FunctionState, instruction: NInstruction):
+    """
+    Handles BREAK_LOOP.
+
+    This pops the current block, unwinds the stack back to the level it was at when the loop started, and jumps to the
+    end of the loop.
+    """
+    target, level = state.block_stack.pop()
+    state.sp = level
+    state.pc = target
+
+
+@register("CONTINUE_LOOP")
+def handle_op_119(state: FunctionState, instruction: NInstruction):
+    """
+    Handles CONTINUE_LOOP.
+    """
+    state.pc = instruction.target
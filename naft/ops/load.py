@@ -1,31 +1,114 @@
 """
 Handling for LOAD_ opcodes.
 """
-import dis
 
+from naft import watch
 from naft.exceptions.base import NFNameError
+from naft.instruction import NInstruction
+from naft.ops.dispatch import register
 from naft.state import FunctionState, NAFT_NULL
 
 
-def handle_op_116(state: FunctionState, instruction: dis.Instruction):
+def load_global(state: FunctionState, arg: int):
     """
-    Handles a LOAD_GLOBAL opcode.
+    Loads the global named by ``names[arg]`` onto the stack.
+
+    This is shared between LOAD_GLOBAL and the superinstructions that contain it.
     """
-    globals = state.globals
-    # Extract the argument from the instruction, and check the `names`.
-    arg = instruction.arg
+    # Check the argument against the `names`.
     if arg > len(state.names) - 1:
         raise IndexError("{} is longer than names".format(arg))
     val = state.names[arg]
-    # Look up the global in the globals.
-    if val not in globals:
-        # Raise a NameError.
-        raise NFNameError("name '{}' is not defined".format(val))
+    # Look up the global in the module globals, then in the builtins.
+    # These are the real dicts, so nothing is copied, and globals shadow builtins just like in CPython.
+    try:
+        item = state.globals[val]
+    except KeyError:
+        try:
+            item = state.builtins[val]
+        except KeyError:
+            # Raise a NameError.
+            raise NFNameError("name '{}' is not defined".format(val)) from None
     # Push it onto the stack.
-    state.push(globals[val])
+    state.push(item)
+
+
+@register("LOAD_GLOBAL")
+def handle_op_116(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a LOAD_GLOBAL opcode.
+    """
+    load_global(state, instruction.arg)
+
+
+class GlobalCache:
+    """
+    The inline cache for a single LOAD_GLOBAL instruction.
+
+    This remembers the value the name resolved to, and the versions of the globals and builtins at the time. The value
+    is valid for as long as neither mapping has changed; see :mod:`naft.watch`.
+
+    A hit only compares the mappings and their versions, so it never looks the name up. Writes made by NAFT bump the
+    versions, but native writes to the globals or the builtins (a ``global`` statement in a native function, or
+    assigning to ``builtins``) aren't seen until :func:`naft.watch.changed` is called for the mapping.
+
+    :ivar name: The name being loaded.
+    :ivar value: The cached value.
+    :ivar hits: The number of times the cached value was used.
+    :ivar misses: The number of times the name had to be looked up.
+    """
+    __slots__ = ("name", "value", "globals_version", "builtins_version", "globals_seen", "builtins_seen", "hits",
+                 "misses")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value = None
+        self.globals_version = None
+        self.builtins_version = None
+        self.globals_seen = -1
+        self.builtins_seen = -1
+        self.hits = 0
+        self.misses = 0
+
+
+def handle_load_global_cached(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a LOAD_GLOBAL opcode, using the inline cache on the instruction.
+
+    This replaces :func:`handle_op_116` when the engine is created with ``cache_globals=True``.
+    """
+    cache = instruction.cache
+    globals_version = cache.globals_version
+    builtins_version = cache.builtins_version
+    if globals_version is not None and globals_version.mapping is state.globals \
+            and builtins_version.mapping is state.builtins \
+            and globals_version.version == cache.globals_seen \
+            and builtins_version.version == cache.builtins_seen:
+        cache.hits += 1
+        state.push(cache.value)
+        return
+
+    cache.misses += 1
+    name = cache.name
+    try:
+        value = state.globals[name]
+    except KeyError:
+        try:
+            value = state.builtins[name]
+        except KeyError:
+            raise NFNameError("name '{}' is not defined".format(name)) from None
+
+    # Watch both mappings, and remember which versions this value came from.
+    cache.globals_version = watch.watch(state.globals)
+    cache.builtins_version = watch.watch(state.builtins)
+    cache.globals_seen = cache.globals_version.version
+    cache.builtins_seen = cache.builtins_version.version
+    cache.value = value
+    state.push(value)
 
 
-def handle_op_100(state: FunctionState, instruction: dis.Instruction):
+@register("LOAD_CONST")
+def handle_op_100(state: FunctionState, instruction: NInstruction):
     """
     Handles a LOAD_CONST opcode.
 
@@ -35,7 +118,8 @@ def handle_op_100(state: FunctionState, instruction: dis.Instruction):
     state.push(const)
 
 
-def handle_op_124(state: FunctionState, instruction: dis.Instruction):
+@register("LOAD_FAST")
+def handle_op_124(state: FunctionState, instruction: NInstruction):
     """
     Handles a LOAD_FAST opcode.
 
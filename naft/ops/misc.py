@@ -1,24 +1,27 @@
 """
 "Misc" operators.
 """
-import dis
 
 from naft.exceptions import signals
+from naft.instruction import NInstruction
+from naft.ops.dispatch import register
 from naft.state import FunctionState
 
 
-def handle_op_1(state: FunctionState, instruction: dis.Instruction):
+@register("POP_TOP")
+def handle_op_1(state: FunctionState, instruction: NInstruction):
     """
     Handles POP_TOP.
     """
     state.pop()
 
 
-def handle_op_83(state: FunctionState, instruction: dis.Instruction):
+@register("RETURN_VALUE")
+def handle_op_83(state: FunctionState, instruction: NInstruction):
     """
     Handles RETURN_VALUE.
     """
     # Pop the latest value off of the stack
-    val = state.pop()
+    state.return_value = state.pop()
     # Signal a return.
-    raise signals.ReturnValue(val)
+    return signals.WHY_RETURN
@@ -0,0 +1,43 @@
+"""
+Handling for STORE_ opcodes.
+"""
+
+from naft import watch
+from naft.exceptions.base import NFNameError
+from naft.instruction import NInstruction
+from naft.ops.dispatch import register
+from naft.state import FunctionState
+
+
+@register("STORE_FAST")
+def handle_op_125(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a STORE_FAST opcode.
+
+    Used for varnames.
+    """
+    state.varnames_stored[instruction.arg] = state.pop()
+
+
+@register("STORE_GLOBAL")
+def handle_op_97(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a STORE_GLOBAL opcode.
+
+    This writes straight into the module globals, so the store is visible to the module and to native code.
+    """
+    state.globals[state.names[instruction.arg]] = state.pop()
+    watch.changed(state.globals)
+
+
+@register("DELETE_GLOBAL")
+def handle_op_98(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a DELETE_GLOBAL opcode.
+    """
+    name = state.names[instruction.arg]
+    try:
+        del state.globals[name]
+    except KeyError:
+        raise NFNameError("name '{}' is not defined".format(name)) from None
+    watch.changed(state.globals)
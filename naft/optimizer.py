@@ -0,0 +1,370 @@
+"""
+The bytecode optimizer.
+
+This runs when a code object is decoded with ``optimize=True``, straight after disassembly and before any other pass.
+It rewrites the decoded instructions, not the code object, and repeats these passes until none of them change anything:
+
+ - Constant folding: operators applied to constants are worked out ahead of time, and replaced with a ``LOAD_CONST``
+   of the result. Folded values are appended to a copy of the constants of the code object.
+ - Constant branches: conditional jumps on a constant are replaced with an unconditional jump, or removed.
+ - Jump threading: jumps to an unconditional jump go straight to its target, and unconditional jumps to the next
+   instruction are removed.
+ - Dead code removal: instructions that can't be reached from the start of the function are removed.
+ - Redundant loads: a ``LOAD_CONST`` followed by a ``POP_TOP`` is removed.
+
+Every instruction that is kept keeps its original offset and line number, so tracebacks and ``f_lasti`` are the same as
+for the unoptimized code. Nothing that could raise an exception is removed or folded; if folding raises, the instructions
+are left alone so that the error is raised at runtime, on the right line.
+"""
+import dis
+
+from naft.instruction import NInstruction
+from naft.ops.binary import BINARY_OPERATORS, COMPARE_TABLE, UNARY_OPERATORS
+from naft.ops.dispatch import DISPATCH_TABLE
+
+LOAD_CONST = dis.opmap["LOAD_CONST"]
+POP_TOP = dis.opmap["POP_TOP"]
+BUILD_TUPLE = dis.opmap["BUILD_TUPLE"]
+COMPARE_OP = dis.opmap["COMPARE_OP"]
+JUMP_FORWARD = dis.opmap["JUMP_FORWARD"]
+# The jumps were changed in Python 3.11, so these are None there, and never match an opcode.
+JUMP_ABSOLUTE = dis.opmap.get("JUMP_ABSOLUTE")
+POP_JUMP_IF_FALSE = dis.opmap.get("POP_JUMP_IF_FALSE")
+POP_JUMP_IF_TRUE = dis.opmap.get("POP_JUMP_IF_TRUE")
+JUMP_IF_FALSE_OR_POP = dis.opmap.get("JUMP_IF_FALSE_OR_POP")
+JUMP_IF_TRUE_OR_POP = dis.opmap.get("JUMP_IF_TRUE_OR_POP")
+
+# Maps opcode -> function, for the operators that can be folded.
+# In-place operators are left out, as they never have a constant on the left.
+BINARY_FOLDS = {dis.opmap[name]: func for name, func in BINARY_OPERATORS.items()
+                if name in dis.opmap and name.startswith("BINARY_")}
+UNARY_FOLDS = {dis.opmap[name]: func for name, func in UNARY_OPERATORS.items() if name in dis.opmap}
+
+# Comparisons that can be folded. ``is`` and ``is not`` depend on the identity of constants, so they are left alone.
+FOLDABLE_COMPARISONS = frozenset(index for index, name in enumerate(dis.cmp_op)
+                                 if COMPARE_TABLE[index] is not None and name not in ("is", "is not"))
+
+# Instructions that never fall through to the next instruction.
+TERMINATORS = frozenset(dis.opmap[name] for name in ("RETURN_VALUE", "RAISE_VARARGS", "JUMP_ABSOLUTE", "JUMP_FORWARD",
+                                                     "BREAK_LOOP", "CONTINUE_LOOP") if name in dis.opmap)
+
+UNCONDITIONAL_JUMPS = frozenset(opcode for opcode in (JUMP_ABSOLUTE, JUMP_FORWARD) if opcode is not None)
+
+# Jumps whose target can be threaded through an unconditional jump.
+THREADABLE_JUMPS = frozenset(dis.opmap[name] for name in ("JUMP_ABSOLUTE", "JUMP_FORWARD", "POP_JUMP_IF_FALSE",
+                                                          "POP_JUMP_IF_TRUE", "JUMP_IF_FALSE_OR_POP",
+                                                          "JUMP_IF_TRUE_OR_POP", "FOR_ITER") if name in dis.opmap)
+
+# Maps conditional jump -> (jumps if the value is true, pops the value when it jumps).
+CONDITIONAL_JUMPS = {opcode: behaviour for opcode, behaviour in (
+    (POP_JUMP_IF_FALSE, (False, True)),
+    (POP_JUMP_IF_TRUE, (True, True)),
+    (JUMP_IF_FALSE_OR_POP, (False, False)),
+    (JUMP_IF_TRUE_OR_POP, (True, False)),
+) if opcode is not None}
+
+# Types of constants that can be folded. These are all immutable, and can't run arbitrary code when used.
+SAFE_TYPES = (type(None), bool, int, float, complex, str, bytes)
+
+# The largest string, bytes or tuple that folding will create, so that code objects don't fill up with huge constants.
+MAX_SEQUENCE_SIZE = 20
+
+# The largest int, in bits, that folding will create.
+MAX_INT_BITS = 128
+
+
+def _is_safe(value) -> bool:
+    """
+    Checks if a constant can be folded.
+    """
+    if isinstance(value, tuple):
+        return all(_is_safe(item) for item in value)
+    return isinstance(value, SAFE_TYPES)
+
+
+def _is_small(value) -> bool:
+    """
+    Checks if the result of folding is small enough to keep as a constant.
+    """
+    if isinstance(value, (str, bytes, tuple)):
+        return len(value) <= MAX_SEQUENCE_SIZE
+    if isinstance(value, int):
+        return value.bit_length() <= MAX_INT_BITS
+    return True
+
+
+def _is_cheap(opcode: int, left, right) -> bool:
+    """
+    Checks that a binary operator won't take a long time (or a lot of memory) before its result can be checked.
+    """
+    name = dis.opname[opcode]
+    if name in ("BINARY_POWER", "BINARY_LSHIFT"):
+        return not isinstance(right, int) or right <= MAX_INT_BITS
+    if name == "BINARY_MULTIPLY":
+        for count, other in ((left, right), (right, left)):
+            if isinstance(count, int) and isinstance(other, (str, bytes, tuple)):
+                return count * len(other) <= MAX_SEQUENCE_SIZE
+    return True
+
+
+class _Optimizer:
+    """
+    The state of the optimizer for a single code object.
+
+    :ivar instructions: The current list of :class:`naft.instruction.NInstruction`, with targets as bytecode offsets.
+    :ivar consts: The constants, including any folded values.
+    :ivar fired: A list of ``(offset, name)`` for each optimization.
+    """
+
+    def __init__(self, instructions: list, consts: tuple):
+        self.instructions = instructions
+        self.consts = list(consts)
+        self.fired = []
+
+    def _targets(self) -> set:
+        return {instruction.target for instruction in self.instructions if instruction.target is not None}
+
+    @staticmethod
+    def _is_default(instruction: NInstruction) -> bool:
+        return instruction.handler is DISPATCH_TABLE[instruction.opcode]
+
+    def _is_const(self, instruction: NInstruction) -> bool:
+        return instruction.opcode == LOAD_CONST and self._is_default(instruction) \
+            and _is_safe(self.consts[instruction.arg])
+
+    def _make_const(self, value, instruction: NInstruction) -> NInstruction:
+        """
+        Makes a LOAD_CONST of a folded value, at the offset and line of ``instruction``.
+        """
+        self.consts.append(value)
+        return NInstruction(LOAD_CONST, len(self.consts) - 1, DISPATCH_TABLE[LOAD_CONST], instruction.line_no,
+                            instruction.offset)
+
+    def _make_jump(self, target: int, instruction: NInstruction) -> NInstruction:
+        """
+        Makes an unconditional jump, at the offset and line of ``instruction``.
+        """
+        return NInstruction(JUMP_ABSOLUTE, None, DISPATCH_TABLE[JUMP_ABSOLUTE], instruction.line_no,
+                            instruction.offset, target)
+
+    def _replace(self, start: int, count: int, replacement: list):
+        """
+        Replaces ``count`` instructions from ``start`` with a list of new instructions.
+
+        Jumps to a removed instruction are moved to the next instruction that is kept.
+        """
+        instructions = self.instructions
+        removed = [instruction.offset for instruction in instructions[start:start + count]]
+        instructions[start:start + count] = replacement
+        kept = {instruction.offset for instruction in replacement}
+        following = start + len(replacement)
+        next_offset = replacement[0].offset if replacement else \
+            (instructions[following].offset if following < len(instructions) else None)
+        moved = {offset: next_offset for offset in removed if offset not in kept}
+        if moved:
+            for instruction in instructions:
+                if instruction.target in moved:
+                    instruction.target = moved[instruction.target]
+
+    def fold_constants(self) -> bool:
+        """
+        Folds operators applied to constants.
+        """
+        changed = False
+        index = 0
+        targets = self._targets()
+        while index < len(self.instructions):
+            instruction = self.instructions[index]
+            folded = self._fold_at(index, instruction, targets)
+            if folded is None:
+                index += 1
+                continue
+            start, value = folded
+            self._replace(start, index + 1 - start, [self._make_const(value, self.instructions[start])])
+            self.fired.append((self.instructions[start].offset, "fold"))
+            changed = True
+            index = start
+        return changed
+
+    def _fold_at(self, index: int, instruction: NInstruction, targets: set):
+        """
+        Tries to fold the operator at ``index`` with the constants before it.
+
+        :return: A tuple of the index of the first constant and the folded value, or None if it can't be folded.
+        """
+        opcode = instruction.opcode
+        if not self._is_default(instruction):
+            return None
+        if opcode in UNARY_FOLDS:
+            count = 1
+        elif opcode in BINARY_FOLDS or (opcode == COMPARE_OP and instruction.arg in FOLDABLE_COMPARISONS):
+            count = 2
+        elif opcode == BUILD_TUPLE:
+            count = instruction.arg
+        else:
+            return None
+
+        start = index - count
+        if start < 0:
+            return None
+        operands = self.instructions[start:index]
+        # Only the first constant can be jumped to; anything else would change the stack of the jump.
+        if not all(self._is_const(operand) for operand in operands) \
+                or any(other.offset in targets for other in self.instructions[start + 1:index + 1]):
+            return None
+        values = [self.consts[operand.arg] for operand in operands]
+
+        try:
+            if opcode == BUILD_TUPLE:
+                value = tuple(values)
+            elif opcode in UNARY_FOLDS:
+                value = UNARY_FOLDS[opcode](values[0])
+            elif opcode == COMPARE_OP:
+                value = COMPARE_TABLE[instruction.arg](*values)
+            else:
+                if not _is_cheap(opcode, *values):
+                    return None
+                value = BINARY_FOLDS[opcode](*values)
+        except Exception:
+            # Leave it to raise at runtime.
+            return None
+
+        if not _is_safe(value) or not _is_small(value):
+            return None
+        return start, value
+
+    def fold_branches(self) -> bool:
+        """
+        Replaces conditional jumps on a constant with an unconditional jump, or removes them.
+        """
+        changed = False
+        targets = self._targets()
+        index = 0
+        while index + 1 < len(self.instructions):
+            const, jump = self.instructions[index], self.instructions[index + 1]
+            if jump.opcode not in CONDITIONAL_JUMPS or not self._is_const(const) or not self._is_default(jump) \
+                    or jump.offset in targets:
+                index += 1
+                continue
+
+            jumps_if, pops = CONDITIONAL_JUMPS[jump.opcode]
+            if bool(self.consts[const.arg]) == jumps_if:
+                replacement = [self._make_jump(jump.target, jump)]
+                if not pops:
+                    # The value stays on the stack when it jumps.
+                    replacement.insert(0, const)
+            else:
+                # The value is popped, and it falls through.
+                replacement = []
+            self._replace(index, 2, replacement)
+            self.fired.append((jump.offset, "branch"))
+            changed = True
+        return changed
+
+    def thread_jumps(self) -> bool:
+        """
+        Threads jumps through unconditional jumps, and removes unconditional jumps to the next instruction.
+        """
+        changed = False
+        by_offset = {instruction.offset: instruction for instruction in self.instructions}
+        for instruction in self.instructions:
+            if instruction.opcode not in THREADABLE_JUMPS or not self._is_default(instruction):
+                continue
+            target = instruction.target
+            seen = set()
+            while True:
+                destination = by_offset.get(target)
+                if destination is None or destination.opcode not in UNCONDITIONAL_JUMPS \
+                        or not self._is_default(destination) or target in seen:
+                    break
+                seen.add(target)
+                target = destination.target
+            if target != instruction.target:
+                instruction.target = target
+                self.fired.append((instruction.offset, "thread"))
+                changed = True
+
+        index = 0
+        while index + 1 < len(self.instructions):
+            instruction = self.instructions[index]
+            if instruction.opcode in UNCONDITIONAL_JUMPS and self._is_default(instruction) \
+                    and instruction.target == self.instructions[index + 1].offset:
+                self.fired.append((instruction.offset, "jump"))
+                self._replace(index, 1, [])
+                changed = True
+            else:
+                index += 1
+        return changed
+
+    def remove_dead_code(self) -> bool:
+        """
+        Removes instructions that can't be reached from the start of the function.
+        """
+        instructions = self.instructions
+        indexes = {instruction.offset: index for index, instruction in enumerate(instructions)}
+        reachable = set()
+        pending = [0] if instructions else []
+        while pending:
+            index = pending.pop()
+            if index in reachable or index >= len(instructions):
+                continue
+            reachable.add(index)
+            instruction = instructions[index]
+            if instruction.target is not None:
+                pending.append(indexes[instruction.target])
+            if instruction.opcode not in TERMINATORS:
+                pending.append(index + 1)
+
+        if len(reachable) == len(instructions):
+            return False
+        for index, instruction in enumerate(instructions):
+            if index not in reachable:
+                self.fired.append((instruction.offset, "dead"))
+        # Nothing reachable jumps to a dead instruction, so no targets need moving.
+        self.instructions = [instruction for index, instruction in enumerate(instructions) if index in reachable]
+        return True
+
+    def remove_load_pop(self) -> bool:
+        """
+        Removes a ``LOAD_CONST`` followed by a ``POP_TOP``.
+        """
+        changed = False
+        targets = self._targets()
+        index = 0
+        while index + 1 < len(self.instructions):
+            load, pop = self.instructions[index], self.instructions[index + 1]
+            if load.opcode == LOAD_CONST and self._is_default(load) and pop.opcode == POP_TOP \
+                    and self._is_default(pop) and pop.offset not in targets:
+                self.fired.append((load.offset, "load_pop"))
+                self._replace(index, 2, [])
+                changed = True
+            else:
+                index += 1
+        return changed
+
+    def run(self):
+        passes = (self.fold_constants, self.fold_branches, self.thread_jumps, self.remove_dead_code,
+                  self.remove_load_pop)
+        changed = True
+        while changed:
+            changed = False
+            for optimization in passes:
+                # Every pass must run, so this can't short-circuit.
+                changed = optimization() or changed
+
+
+def optimize(instructions: list, consts: tuple) -> tuple:
+    """
+    Optimizes a list of decoded instructions.
+
+    This must run before jump targets are linked; the ``target`` of each instruction must still be a bytecode offset.
+    Instructions whose handler isn't the default one (because it was overridden on the engine) are never changed.
+
+    :param instructions: The list of :class:`naft.instruction.NInstruction` to optimize.
+    :param consts: The constants of the code object.
+    :return: A tuple of the new list of instructions, the new constants, and a list of ``(offset, name)`` for each
+        optimization that fired.
+    """
+    optimizer = _Optimizer(list(instructions), consts)
+    optimizer.run()
+    return optimizer.instructions, tuple(optimizer.consts), optimizer.fired
@@ -0,0 +1,186 @@
+"""
+The NAFT profiler.
+
+This records where time goes inside interpreted code: per-opcode execution counts and handler time, and per-function
+call counts with inclusive and exclusive time.
+
+Use it by passing a :class:`Profiler` to :meth:`naft.engine.NAFTEngine.run_function`:
+
+.. code::
+
+    profiler = Profiler()
+    engine.run_function(func(1, 2), profiler=profiler)
+    profiler.report()
+    profiler.dump_stats("naft.prof")  # Readable with pstats.
+"""
+import marshal
+import sys
+import time
+
+from naft.hooks import EngineHook
+from naft.instruction import NInstruction, get_opname
+from naft.state import FunctionState
+
+
+class Profiler(EngineHook):
+    """
+    A hook which profiles the engine.
+
+    Time is charged to the opcode that was running, up until the next event. When a function call is made, the time
+    spent in the callee is charged to the callee, not to the ``CALL_FUNCTION``, so opcode times are exclusive.
+
+    :param timer: The timer function to use. Defaults to :func:`time.perf_counter`.
+
+    :ivar opcodes: A dict of opcode -> [execution count, total time].
+    :ivar functions: A dict of function key -> [primitive calls, total calls, exclusive time, inclusive time, callers].
+        Function keys are ``(filename, first line number, name)`` tuples, like :mod:`pstats` uses.
+    """
+
+    def __init__(self, timer=time.perf_counter):
+        self.timer = timer
+
+        self.opcodes = {}
+        self.functions = {}
+
+        # The opcode currently being charged for time, and when it started being charged.
+        self._current_op = None
+        self._last = 0.0
+
+        # The stack of functions that are running.
+        # Each item is a [key, start time, time spent in children, opcode running in the caller] list.
+        self._frames = []
+        # Maps function key -> the number of its frames on the stack, so that recursion can be seen without a scan.
+        self._active = {}
+
+    @staticmethod
+    def _get_key(state: FunctionState) -> tuple:
+        code = state._wrapped_func.__code__
+        return code.co_filename, code.co_firstlineno, code.co_name
+
+    def _charge(self, now: float):
+        """
+        Charges the time since the last event to the current opcode.
+        """
+        if self._current_op is not None:
+            self.opcodes[self._current_op][1] += now - self._last
+        self._last = now
+
+    def on_call(self, state: FunctionState):
+        now = self.timer()
+        self._charge(now)
+        key = self._get_key(state)
+        self._frames.append([key, now, 0.0, self._current_op])
+        self._active[key] = self._active.get(key, 0) + 1
+        self._current_op = None
+
+    def on_instruction(self, state: FunctionState, instruction: NInstruction):
+        now = self.timer()
+        self._charge(now)
+        opcode = instruction.opcode
+        try:
+            self.opcodes[opcode][0] += 1
+        except KeyError:
+            self.opcodes[opcode] = [1, 0.0]
+        self._current_op = opcode
+
+    def on_return(self, state: FunctionState, value):
+        now = self.timer()
+        self._charge(now)
+        key, start, children, caller_op = self._frames.pop()
+        inclusive = now - start
+
+        # Recursive calls don't count towards the inclusive time, otherwise it would be counted twice.
+        active = self._active[key] - 1
+        recursive = active > 0
+        if recursive:
+            self._active[key] = active
+        else:
+            del self._active[key]
+
+        try:
+            stats = self.functions[key]
+        except KeyError:
+            stats = self.functions[key] = [0, 0, 0.0, 0.0, {}]
+        stats[1] += 1
+        stats[2] += inclusive - children
+        if not recursive:
+            stats[0] += 1
+            stats[3] += inclusive
+
+        if self._frames:
+            parent = self._frames[-1]
+            parent[2] += inclusive
+            # Callers are recorded like cProfile does; (total calls, primitive calls, exclusive, inclusive).
+            caller = stats[4].setdefault(parent[0], [0, 0, 0.0, 0.0])
+            caller[0] += 1
+            caller[2] += inclusive - children
+            if not recursive:
+                caller[1] += 1
+                caller[3] += inclusive
+
+        # Go back to charging the opcode that made the call.
+        self._current_op = caller_op
+
+    # Exceptions leave a function the same way as returning does.
+    def on_exception(self, state: FunctionState, exception: BaseException):
+        self.on_return(state, None)
+
+    def clear(self):
+        """
+        Clears all the recorded data.
+        """
+        self.opcodes.clear()
+        self.functions.clear()
+        self._frames.clear()
+        self._active.clear()
+        self._current_op = None
+
+    def create_stats(self):
+        """
+        Creates the ``stats`` attribute, in the format used by :mod:`pstats`.
+
+        This means that a profiler can be passed directly to :class:`pstats.Stats`.
+        """
+        self.stats = {}
+        for key, (cc, nc, tt, ct, callers) in self.functions.items():
+            self.stats[key] = (cc, nc, tt, ct, {caller: tuple(data) for caller, data in callers.items()})
+
+    def dump_stats(self, filename: str):
+        """
+        Writes the per-function data to a file, which can be loaded by :class:`pstats.Stats`.
+
+        :param filename: The file to write to.
+        """
+        self.create_stats()
+        with open(filename, "wb") as f:
+            marshal.dump(self.stats, f)
+
+    def report(self, stream=None, sort: str = "time", limit: int = None):
+        """
+        Writes a text report of the opcodes and functions run.
+
+        :param stream: The stream to write to. Defaults to stdout.
+        :param sort: What to sort by: ``"time"`` (exclusive time), ``"cumulative"`` or ``"calls"``.
+        :param limit: The maximum number of rows to write for each table.
+        """
+        if stream is None:
+            stream = sys.stdout
+
+        opcode_sort = {"calls": lambda item: item[1][0]}.get(sort, lambda item: item[1][1])
+        opcodes = sorted(self.opcodes.items(), key=opcode_sort, reverse=True)[:limit]
+
+        stream.write("Opcodes\n")
+        stream.write("{:>10} {:>12} {:>12}  {}\n".format("count", "tottime", "percount", "opcode"))
+        for opcode, (count, total) in opcodes:
+            stream.write("{:>10} {:>12.6f} {:>12.9f}  {}:{}\n".format(count, total, total / count, opcode,
+                                                                      get_opname(opcode)))
+
+        function_sort = {"calls": lambda item: item[1][1],
+                         "cumulative": lambda item: item[1][3]}.get(sort, lambda item: item[1][2])
+        functions = sorted(self.functions.items(), key=function_sort, reverse=True)[:limit]
+
+        stream.write("\nFunctions\n")
+        stream.write("{:>10} {:>12} {:>12}  {}\n".format("ncalls", "tottime", "cumtime", "function"))
+        for (filename, line_no, name), (cc, nc, tt, ct, callers) in functions:
+            calls = str(nc) if nc == cc else "{}/{}".format(nc, cc)
+            stream.write("{:>10} {:>12.6f} {:>12.6f}  {}:{}({})\n".format(calls, tt, ct, filename, line_no, name))
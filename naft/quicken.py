@@ -0,0 +1,176 @@
+"""
+Adaptive quickening.
+
+The handlers for binary operators and comparisons are generic: they pop both operands, look up the operator, call it,
+and push the result. When a code object is decoded with ``quicken=True``, those instructions are given an *adaptive*
+handler instead. This runs the generic handler, but also watches the types of the operands. Once an instruction has
+run :data:`QUICKEN_THRESHOLD` times in a row with the same operand types, its handler is rewritten in place to a
+specialised variant for those types, such as ``BINARY_ADD_INT``.
+
+Specialised handlers work on the stack directly, and guard on the operand types. If the guard fails, the instruction
+is deoptimised back to the adaptive handler, and the generic handler runs instead.
+"""
+import dis
+import operator
+
+from naft.instruction import NInstruction
+from naft.ops import DISPATCH_TABLE
+from naft.ops.binary import COMPARE_TABLE
+from naft.state import FunctionState
+
+# The number of times an instruction must run with the same operand types before it is specialised.
+QUICKEN_THRESHOLD = 8
+
+# The most an instruction waits before trying to specialise again, after failing to find a specialisation.
+MAX_THRESHOLD = 1024
+
+
+class Specialization:
+    """
+    The quickening data for a single instruction.
+
+    :ivar generic: The generic handler for the instruction.
+    :ivar name: The name of the specialisation currently in use, or None.
+    :ivar types: The operand types seen by the last run of the adaptive handler.
+    :ivar counter: The number of times in a row the adaptive handler has seen ``types``.
+    :ivar threshold: The number of times in a row that triggers specialisation. This goes up each time no
+        specialisation can be found, so that unspecialisable instructions don't keep trying.
+    :ivar specializations: The number of times the instruction was specialised.
+    :ivar deopts: The number of times a specialised handler's guard failed.
+    """
+    __slots__ = ("generic", "name", "types", "counter", "threshold", "specializations", "deopts")
+
+    def __init__(self, generic):
+        self.generic = generic
+        self.name = None
+        self.types = None
+        self.counter = 0
+        self.threshold = QUICKEN_THRESHOLD
+        self.specializations = 0
+        self.deopts = 0
+
+
+# Maps (opcode, left type, right type) -> (name, specialised handler).
+SPECIALIZATIONS = {}
+
+
+def deoptimize(state: FunctionState, instruction: NInstruction):
+    """
+    Puts an instruction back to the adaptive handler, and runs the generic handler.
+
+    This is called by specialised handlers when their guard fails.
+    """
+    cache = instruction.cache
+    cache.deopts += 1
+    cache.name = None
+    cache.types = None
+    cache.counter = 0
+    instruction.handler = handle_adaptive
+    return cache.generic(state, instruction)
+
+
+def handle_adaptive(state: FunctionState, instruction: NInstruction):
+    """
+    Runs the generic handler for an instruction, and specialises it once the operand types are stable.
+    """
+    cache = instruction.cache
+    sp = state.sp
+    stack = state.stack
+    types = (stack[sp - 2].__class__, stack[sp - 1].__class__)
+    if types == cache.types:
+        cache.counter += 1
+        if cache.counter >= cache.threshold:
+            specialized = SPECIALIZATIONS.get((instruction.opcode,) + types)
+            if specialized is not None:
+                cache.name, instruction.handler = specialized
+                cache.specializations += 1
+            else:
+                # Nothing to specialise to, so back off.
+                cache.counter = 0
+                cache.threshold = min(cache.threshold * 2, MAX_THRESHOLD)
+    else:
+        cache.types = types
+        cache.counter = 1
+    return cache.generic(state, instruction)
+
+
+def _make_binary_specialization(func, left_type: type, right_type: type):
+    def handler(state: FunctionState, instruction: NInstruction):
+        stack = state.stack
+        sp = state.sp - 1
+        left = stack[sp - 1]
+        right = stack[sp]
+        if left.__class__ is left_type and right.__class__ is right_type:
+            stack[sp - 1] = func(left, right)
+            state.sp = sp
+        else:
+            return deoptimize(state, instruction)
+
+    return handler
+
+
+def _make_compare_specialization(left_type: type, right_type: type):
+    def handler(state: FunctionState, instruction: NInstruction):
+        stack = state.stack
+        sp = state.sp - 1
+        left = stack[sp - 1]
+        right = stack[sp]
+        if left.__class__ is left_type and right.__class__ is right_type:
+            stack[sp - 1] = COMPARE_TABLE[instruction.arg](left, right)
+            state.sp = sp
+        else:
+            return deoptimize(state, instruction)
+
+    return handler
+
+
+def specialize(opname: str, name: str, left_type: type, right_type: type, handler):
+    """
+    Registers a specialised handler for an opname and a pair of operand types.
+
+    If the opname doesn't exist on this version of Python, the handler is not registered.
+    """
+    if opname in dis.opmap:
+        handler.__name__ = "handle_{}".format(name.lower())
+        handler.__doc__ = "Handles {}, specialised from {}.".format(name, opname)
+        SPECIALIZATIONS[(dis.opmap[opname], left_type, right_type)] = (name, handler)
+
+
+for _opname, _func in [("BINARY_ADD", operator.add), ("BINARY_SUBTRACT", operator.sub),
+                       ("BINARY_MULTIPLY", operator.mul), ("INPLACE_ADD", operator.iadd),
+                       ("INPLACE_SUBTRACT", operator.isub), ("INPLACE_MULTIPLY", operator.imul)]:
+    for _type in (int, float):
+        _name = "{}_{}".format(_opname, _type.__name__.upper())
+        specialize(_opname, _name, _type, _type, _make_binary_specialization(_func, _type, _type))
+
+specialize("BINARY_ADD", "BINARY_ADD_STR", str, str, _make_binary_specialization(operator.add, str, str))
+specialize("INPLACE_ADD", "INPLACE_ADD_STR", str, str, _make_binary_specialization(operator.iadd, str, str))
+specialize("BINARY_TRUE_DIVIDE", "BINARY_TRUE_DIVIDE_FLOAT", float, float,
+           _make_binary_specialization(operator.truediv, float, float))
+
+for _container in (list, tuple):
+    _name = "BINARY_SUBSCR_{}_INT".format(_container.__name__.upper())
+    specialize("BINARY_SUBSCR", _name, _container, int, _make_binary_specialization(operator.getitem, _container, int))
+for _key in (str, int):
+    _name = "BINARY_SUBSCR_DICT_{}".format(_key.__name__.upper())
+    specialize("BINARY_SUBSCR", _name, dict, _key, _make_binary_specialization(operator.getitem, dict, _key))
+
+for _type in (int, float, str):
+    specialize("COMPARE_OP", "COMPARE_OP_{}".format(_type.__name__.upper()), _type, _type,
+               _make_compare_specialization(_type, _type))
+
+# The opcodes that have at least one specialisation.
+QUICKENED_OPCODES = frozenset(key[0] for key in SPECIALIZATIONS)
+
+
+def quicken(instructions: list):
+    """
+    Gives every instruction that can be specialised the adaptive handler.
+
+    Instructions whose handler was overridden are left alone, so that the override still runs.
+    """
+    for instruction in instructions:
+        opcode = instruction.opcode
+        if opcode in QUICKENED_OPCODES and instruction.handler is DISPATCH_TABLE[opcode]:
+            instruction.cache = Specialization(instruction.handler)
+            instruction.handler = handle_adaptive
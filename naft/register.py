@@ -0,0 +1,557 @@
+"""
+The register backend.
+
+The stack engine moves every value through the stack: ``LOAD_FAST a; LOAD_FAST b; BINARY_ADD; STORE_FAST c`` is two
+pushes, two pops, another push and another pop. This backend translates the instructions of a function into a
+register-based IR first, where that sequence is the single three-address operation ``c = a + b``.
+
+The registers are the locals of the function, plus one register for each slot of the stack. CPython works out the
+maximum depth of the stack at every instruction (``co_stacksize``), and the depth at each instruction is fixed, so the
+stack slot a value lives in is known when the function is translated. ``FunctionState.stack`` is used as the stack
+registers, so the two formats can be mixed freely.
+
+Translation keeps a symbolic stack of operands. Loading a local or a constant doesn't emit anything; the operand is
+just read by whatever uses it. Operators write straight into the register they are stored to. At the start of every
+block, and before any instruction without a register form, every operand is moved into its stack register, so that the
+stack looks exactly like it does in the stack engine. Instructions without a register form (such as calls) then run
+their normal handler.
+
+The IR is then compiled into closures, chained together like the closure-threaded backend, with the operands of each
+operation baked in. Each IR operation remembers the index of the instruction it came from, so line numbers and
+tracebacks are the same as with the stack engine.
+"""
+import dis
+
+from naft.code import decode
+from naft.ops import DISPATCH_TABLE
+from naft.ops.binary import BINARY_OPERATORS, COMPARE_TABLE, UNARY_OPERATORS
+from naft.state import FunctionState, NAFT_NULL
+
+# The kinds of operand.
+LOCAL = 0
+CONST = 1
+STACK = 2
+
+_opmap = dis.opmap
+
+BINARY_FUNCS = {_opmap[name]: func for name, func in BINARY_OPERATORS.items() if name in _opmap}
+UNARY_FUNCS = {_opmap[name]: func for name, func in UNARY_OPERATORS.items() if name in _opmap}
+
+LOAD_FAST = _opmap["LOAD_FAST"]
+LOAD_CONST = _opmap["LOAD_CONST"]
+STORE_FAST = _opmap["STORE_FAST"]
+POP_TOP = _opmap["POP_TOP"]
+COMPARE_OP = _opmap["COMPARE_OP"]
+RETURN_VALUE = _opmap["RETURN_VALUE"]
+FOR_ITER = _opmap["FOR_ITER"]
+# The loop blocks were removed in Python 3.8, so these are None there, and never match an opcode.
+SETUP_LOOP = _opmap.get("SETUP_LOOP")
+BREAK_LOOP = _opmap.get("BREAK_LOOP")
+CONTINUE_LOOP = _opmap.get("CONTINUE_LOOP")
+
+UNCONDITIONAL_JUMPS = frozenset(_opmap[name] for name in ("JUMP_ABSOLUTE", "JUMP_FORWARD", "CONTINUE_LOOP")
+                                if name in _opmap)
+
+# Maps conditional jump -> (jumps if the value is true, pops the value when it jumps).
+CONDITIONAL_JUMPS = {_opmap[name]: behaviour for name, behaviour in (
+    ("POP_JUMP_IF_FALSE", (False, True)),
+    ("POP_JUMP_IF_TRUE", (True, True)),
+    ("JUMP_IF_FALSE_OR_POP", (False, False)),
+    ("JUMP_IF_TRUE_OR_POP", (True, False)),
+) if name in _opmap}
+
+# Instructions that never fall through to the next instruction.
+TERMINATORS = frozenset(_opmap[name] for name in ("RETURN_VALUE", "RAISE_VARARGS", "JUMP_ABSOLUTE", "JUMP_FORWARD",
+                                                  "BREAK_LOOP", "CONTINUE_LOOP") if name in _opmap)
+
+# Instructions that change the block stack in a way the translation can't follow. Functions that use these are run by
+# the stack engine instead.
+UNTRANSLATABLE = frozenset(_opmap[name] for name in ("SETUP_EXCEPT", "SETUP_FINALLY", "SETUP_WITH", "SETUP_ASYNC_WITH",
+                                                     "END_FINALLY", "POP_EXCEPT", "WITH_CLEANUP_START",
+                                                     "WITH_CLEANUP_FINISH", "YIELD_VALUE", "YIELD_FROM")
+                           if name in _opmap)
+
+# The decode options that the translation does itself, or that would hide instructions from it.
+# Traces only run with the stack backend, so loops aren't counted either, and functions are only inlined into the
+# decoded code that the other backends run.
+IGNORED_OPTIONS = ("fuse", "quicken", "jit", "inline")
+
+
+class RInstruction:
+    """
+    A single operation of the register IR.
+
+    :ivar op: The name of the operation, such as ``BINARY`` or ``MOVE``.
+    :ivar sources: A list of ``(kind, value)`` operands. The value is a register number, or the constant itself.
+    :ivar dest: The ``(kind, register)`` this operation writes to, or None.
+    :ivar func: The function applied to the sources, for operators.
+    :ivar jump_if: For conditional jumps, if the jump happens when the value is true.
+    :ivar target: For jumps, the index of the instruction jumped to.
+    :ivar index: The index of the instruction this operation came from, for line numbers.
+    :ivar instruction: For ``GENERIC`` operations, the instruction whose handler is run.
+    :ivar depth: For ``GENERIC`` operations, the depth of the stack before the instruction runs.
+    """
+    __slots__ = ("op", "sources", "dest", "func", "jump_if", "target", "index", "instruction", "depth")
+
+    def __init__(self, op: str, index: int, sources: list = (), dest: tuple = None, func=None, jump_if: bool = None,
+                 target: int = None, instruction=None, depth: int = 0):
+        self.op = op
+        self.sources = list(sources)
+        self.dest = dest
+        self.func = func
+        self.jump_if = jump_if
+        self.target = target
+        self.index = index
+        self.instruction = instruction
+        self.depth = depth
+
+    def __repr__(self):  # pragma: no cover
+        return "<RInstruction {} {} -> {} index={}>".format(self.op, self.sources, self.dest, self.index)
+
+
+class RegisterCode:
+    """
+    The register form of a code object.
+
+    :ivar instructions: The decoded instructions the IR was translated from. The program counter of a function run
+        with this backend is an index into these, so that line numbers can be found.
+    :ivar ir: The list of :class:`RInstruction`.
+    :ivar ops: The list of closures, one per IR operation.
+    :ivar indexes: A dict of closure -> the index of the instruction it came from.
+    :ivar entries: A dict of instruction index -> the closure to resume from, for every jump target and every
+        instruction after one that may signal the engine.
+    """
+    __slots__ = ("instructions", "ir", "ops", "indexes", "entries")
+
+    def __init__(self, instructions: list, ir: list, ops: list, indexes: dict, entries: dict):
+        self.instructions = instructions
+        self.ir = ir
+        self.ops = ops
+        self.indexes = indexes
+        self.entries = entries
+
+
+class Untranslatable(Exception):
+    """
+    Raised when a function can't be translated into the register IR.
+    """
+
+
+def _jump_depths(instruction, depth: int) -> tuple:
+    """
+    Works out the depth of the stack after an instruction.
+
+    :return: A tuple of the depth if it falls through (or None if it doesn't), and the depth at its target (or None if
+        it doesn't jump).
+    """
+    opcode = instruction.opcode
+    if opcode in CONDITIONAL_JUMPS:
+        jumps_if, pops = CONDITIONAL_JUMPS[opcode]
+        return depth - 1, depth - 1 if pops else depth
+    if opcode == FOR_ITER:
+        return depth + 1, depth - 1
+    if opcode == SETUP_LOOP:
+        # The target is where a ``break`` goes, with the stack as it is now.
+        return depth, depth
+    if opcode in TERMINATORS:
+        # Jumps from BREAK_LOOP and CONTINUE_LOOP go somewhere with a depth that is already known.
+        return None, depth if opcode in UNCONDITIONAL_JUMPS and opcode != CONTINUE_LOOP else None
+    try:
+        effect = dis.stack_effect(opcode, instruction.arg) if opcode >= dis.HAVE_ARGUMENT \
+            else dis.stack_effect(opcode)
+    except ValueError:
+        raise Untranslatable("unknown stack effect for {}".format(instruction.opname)) from None
+    return depth + effect, None
+
+
+def stack_depths(instructions: list) -> list:
+    """
+    Works out the depth of the stack before each instruction.
+
+    :return: A list of depths, with None for instructions that can't be reached.
+    """
+    depths = [None] * len(instructions)
+    pending = [(0, 0)] if instructions else []
+    while pending:
+        index, depth = pending.pop()
+        if index >= len(instructions):
+            continue
+        if depths[index] is not None:
+            if depths[index] != depth:
+                raise Untranslatable("inconsistent stack depth at {}".format(index))
+            continue
+        depths[index] = depth
+        instruction = instructions[index]
+        if instruction.opcode in UNTRANSLATABLE:
+            raise Untranslatable("{} is not supported".format(instruction.opname))
+        fallthrough, jump = _jump_depths(instruction, depth)
+        if jump is not None:
+            pending.append((instruction.target, jump))
+        if fallthrough is not None:
+            pending.append((index + 1, fallthrough))
+    return depths
+
+
+class _Translator:
+    """
+    The state of the translation of a single code object.
+    """
+
+    def __init__(self, instructions: list, consts: tuple):
+        self.instructions = instructions
+        self.consts = consts
+        self.ir = []
+        # The symbolic stack; a list of operands.
+        self.stack = []
+        # Instruction indexes waiting for the next operation, so they can be resumed from.
+        self.pending = []
+        self.entries = {}
+        # The last operation, if its destination can still be changed.
+        self.last = None
+
+    def emit(self, operation: RInstruction) -> RInstruction:
+        self.ir.append(operation)
+        for index in self.pending:
+            self.entries[index] = len(self.ir) - 1
+        del self.pending[:]
+        self.last = None
+        return operation
+
+    def flush(self):
+        """
+        Moves every operand on the symbolic stack into its stack register.
+        """
+        for position, operand in enumerate(self.stack):
+            if operand != (STACK, position):
+                self.emit(RInstruction("MOVE", self._index, [operand], (STACK, position)))
+                self.stack[position] = (STACK, position)
+
+    def flush_local(self, register: int):
+        """
+        Moves every operand that reads a local into its stack register, before the local is written to.
+        """
+        for position, operand in enumerate(self.stack):
+            if operand == (LOCAL, register):
+                self.emit(RInstruction("MOVE", self._index, [operand], (STACK, position)))
+                self.stack[position] = (STACK, position)
+
+    def push_result(self, operation: RInstruction):
+        operation.dest = (STACK, len(self.stack))
+        self.emit(operation)
+        self.stack.append(operation.dest)
+        self.last = operation
+
+    def translate(self):
+        instructions = self.instructions
+        depths = stack_depths(instructions)
+        targets = {instruction.target for instruction in instructions if instruction.target is not None}
+        falls_through = False
+        for index, instruction in enumerate(instructions):
+            self._index = index
+            depth = depths[index]
+            if depth is None:
+                # Dead code.
+                falls_through = False
+                continue
+            if index in targets or not falls_through:
+                # The start of a block; every path into it must agree on where the values are.
+                if falls_through:
+                    self.flush()
+                self.stack = [(STACK, position) for position in range(depth)]
+                self.pending.append(index)
+                self.last = None
+            falls_through = self.translate_instruction(index, instruction)
+
+        # Anything still waiting can't be reached.
+        for index in self.pending:
+            self.entries[index] = None
+
+    def translate_instruction(self, index: int, instruction) -> bool:
+        """
+        Translates one instruction.
+
+        :return: If the instruction can fall through to the next one.
+        """
+        opcode = instruction.opcode
+        stack = self.stack
+        if instruction.handler is not DISPATCH_TABLE[opcode]:
+            return self.translate_generic(index, instruction)
+
+        if opcode == LOAD_FAST:
+            stack.append((LOCAL, instruction.arg))
+        elif opcode == LOAD_CONST:
+            stack.append((CONST, self.consts[instruction.arg]))
+        elif opcode == STORE_FAST:
+            self.translate_store(index, instruction.arg)
+        elif opcode == POP_TOP:
+            operand = stack.pop()
+            if operand[0] == LOCAL:
+                # Loading it can still fail.
+                self.emit(RInstruction("MOVE", index, [operand], (STACK, len(stack))))
+        elif opcode in BINARY_FUNCS or (opcode == COMPARE_OP and COMPARE_TABLE[instruction.arg] is not None):
+            func = BINARY_FUNCS[opcode] if opcode != COMPARE_OP else COMPARE_TABLE[instruction.arg]
+            right = stack.pop()
+            left = stack.pop()
+            self.push_result(RInstruction("COMPARE" if opcode == COMPARE_OP else "BINARY", index, [left, right],
+                                          func=func))
+        elif opcode in UNARY_FUNCS:
+            self.push_result(RInstruction("UNARY", index, [stack.pop()], func=UNARY_FUNCS[opcode]))
+        elif opcode == RETURN_VALUE:
+            self.emit(RInstruction("RETURN", index, [stack.pop()]))
+            return False
+        elif opcode in UNCONDITIONAL_JUMPS:
+            self.flush()
+            self.emit(RInstruction("JUMP", index, target=instruction.target))
+            return False
+        elif opcode in CONDITIONAL_JUMPS:
+            self.translate_branch(index, instruction)
+        elif opcode == FOR_ITER:
+            self.flush()
+            self.push_result(RInstruction("FOR_ITER", index, [(STACK, len(stack) - 1)], target=instruction.target))
+        else:
+            return self.translate_generic(index, instruction)
+        return True
+
+    def translate_store(self, index: int, register: int):
+        value = self.stack.pop()
+        last = self.last
+        if last is not None and value == last.dest and value == (STACK, len(self.stack)) \
+                and (LOCAL, register) not in self.stack:
+            # Write the result straight into the local, instead of into the stack and then moving it.
+            last.dest = (LOCAL, register)
+            self.last = None
+            return
+        self.flush_local(register)
+        self.emit(RInstruction("MOVE", index, [value], (LOCAL, register)))
+
+    def translate_branch(self, index: int, instruction):
+        jumps_if, pops = CONDITIONAL_JUMPS[instruction.opcode]
+        value = self.stack.pop()
+        last = self.last
+        self.flush()
+        if pops:
+            if last is not None and last.op == "COMPARE" and self.ir[-1] is last and value == last.dest:
+                # Nothing was moved in between, so the comparison can jump itself.
+                last.op = "COMPARE_BRANCH"
+                last.dest = None
+                last.jump_if = jumps_if
+                last.target = instruction.target
+                self.last = None
+                return
+            self.emit(RInstruction("BRANCH", index, [value], jump_if=jumps_if, target=instruction.target))
+        else:
+            self.emit(RInstruction("BRANCH_OR_POP", index, [value], (STACK, len(self.stack)), jump_if=jumps_if,
+                                   target=instruction.target))
+
+    def translate_generic(self, index: int, instruction) -> bool:
+        """
+        Runs the handler of an instruction that has no register form, with the stack as the stack engine would have it.
+        """
+        self.flush()
+        depth = len(self.stack)
+        # BREAK_LOOP jumps without a target; it uses the block stack.
+        op = "GENERIC_JUMP" if instruction.target is not None or instruction.opcode == BREAK_LOOP else "GENERIC"
+        self.emit(RInstruction(op, index, instruction=instruction, depth=depth))
+        # The handler may signal the engine, so the function must be able to resume after it.
+        self.pending.append(index + 1)
+        fallthrough, jump = _jump_depths(instruction, depth)
+        if fallthrough is None:
+            return False
+        self.stack = [(STACK, position) for position in range(fallthrough)]
+        return True
+
+
+def translate(instructions: list, consts: tuple) -> tuple:
+    """
+    Translates decoded instructions into the register IR.
+
+    :param instructions: The linked list of :class:`naft.instruction.NInstruction` to translate.
+    :param consts: The constants the instructions load from.
+    :return: A tuple of the list of :class:`RInstruction`, and a dict of instruction index -> IR index for each
+        place the function can be resumed from.
+    :raises Untranslatable: If the instructions can't be translated.
+    """
+    translator = _Translator(instructions, consts)
+    translator.translate()
+    return translator.ir, translator.entries
+
+
+# Compiling the IR into closures.
+# Operations are generated from templates, with a closure factory for each combination of operand kinds. The factories
+# are created the first time they're needed, and shared.
+
+_OP_TEMPLATES = {
+    "MOVE": "{dest} = v0\n        return nxt",
+    "BINARY": "{dest} = func(v0, v1)\n        return nxt",
+    "COMPARE": "{dest} = func(v0, v1)\n        return nxt",
+    "UNARY": "{dest} = func(v0)\n        return nxt",
+    "RETURN": "state.return_value = v0\n        return None",
+    ("BRANCH", True): "if v0:\n            return target\n        return nxt",
+    ("BRANCH", False): "if not v0:\n            return target\n        return nxt",
+    ("COMPARE_BRANCH", True): "if func(v0, v1):\n            return target\n        return nxt",
+    ("COMPARE_BRANCH", False): "if not func(v0, v1):\n            return target\n        return nxt",
+    ("BRANCH_OR_POP", True): "if v0:\n            stack[d] = v0\n            return target\n        return nxt",
+    ("BRANCH_OR_POP", False): "if not v0:\n            stack[d] = v0\n            return target\n        return nxt",
+    "FOR_ITER": "try:\n            v = next(v0)\n        except StopIteration:\n            return target\n"
+                "        {dest} = v\n        return nxt",
+}
+
+_FACTORY_TEMPLATE = """
+def factory(s0, s1, d, func):
+    nxt = target = None
+
+    def op(state):
+{prelude}{reads}
+        {body}
+
+    def link(nxt_, target_):
+        nonlocal nxt, target
+        nxt, target = nxt_, target_
+
+    return op, link
+"""
+
+_READ_TEMPLATES = {
+    LOCAL: "        v{n} = varnames[s{n}]\n"
+           "        if v{n} is NAFT_NULL:\n"
+           "            raise SystemError(\"unable to load varname '{{}}'\".format(state.varnames[s{n}]))",
+    STACK: "        v{n} = stack[s{n}]",
+    CONST: "        v{n} = s{n}",
+}
+
+_DEST_TEMPLATES = {LOCAL: "varnames[d]", STACK: "stack[d]"}
+
+# Maps (template key, source kinds, dest kind) -> closure factory.
+_factories = {}
+
+
+def _get_factory(key, source_kinds: tuple, dest_kind):
+    factory_key = (key, source_kinds, dest_kind)
+    try:
+        return _factories[factory_key]
+    except KeyError:
+        pass
+    reads = "\n".join(_READ_TEMPLATES[kind].format(n=n) for n, kind in enumerate(source_kinds))
+    body = _OP_TEMPLATES[key].format(dest=_DEST_TEMPLATES.get(dest_kind))
+    # Only look up the registers that are used.
+    prelude = ""
+    for name, attribute in (("varnames", "varnames_stored"), ("stack", "stack")):
+        if name in reads or name in body:
+            prelude += "        {} = state.{}\n".format(name, attribute)
+    namespace = {"NAFT_NULL": NAFT_NULL}
+    exec(_FACTORY_TEMPLATE.format(prelude=prelude, reads=reads, body=body), namespace)
+    factory = _factories[factory_key] = namespace["factory"]
+    return factory
+
+
+def _make_template_op(operation: RInstruction):
+    key = operation.op if operation.jump_if is None else (operation.op, operation.jump_if)
+    kinds = tuple(kind for kind, value in operation.sources)
+    values = [value for kind, value in operation.sources] + [None, None]
+    dest_kind, dest = operation.dest if operation.dest is not None else (None, None)
+    op, link = _get_factory(key, kinds, dest_kind)(values[0], values[1], dest, operation.func)
+
+    def _link(ops: list, entries: dict, index: int):
+        target = entries[operation.target] if operation.target is not None else None
+        link(ops[index + 1] if index + 1 < len(ops) else None, target)
+
+    return op, _link
+
+
+def _make_jump(operation: RInstruction):
+    target = None
+
+    def op(state: FunctionState):
+        return target
+
+    def link(ops: list, entries: dict, index: int):
+        nonlocal target
+        target = entries[operation.target]
+
+    return op, link
+
+
+def _make_generic(operation: RInstruction):
+    instruction = operation.instruction
+    handler = instruction.handler
+    depth = operation.depth
+    resume = operation.index + 1
+    nxt = None
+
+    def op(state: FunctionState):
+        state.sp = depth
+        if handler(state, instruction):
+            # The engine has been signalled, so stop here, and make sure the function can be resumed.
+            state.pc = resume
+            return None
+        return nxt
+
+    def link(ops: list, entries: dict, index: int):
+        nonlocal nxt
+        nxt = ops[index + 1] if index + 1 < len(ops) else None
+
+    return op, link
+
+
+def _make_generic_jump(operation: RInstruction):
+    # The handler may assign to the program counter, so go wherever that points.
+    instruction = operation.instruction
+    handler = instruction.handler
+    depth = operation.depth
+    resume = operation.index + 1
+    entries = None
+
+    def op(state: FunctionState):
+        state.sp = depth
+        state.pc = resume
+        if handler(state, instruction):
+            return None
+        return entries[state.pc]
+
+    def link(ops: list, entries_: dict, index: int):
+        nonlocal entries
+        entries = entries_
+
+    return op, link
+
+
+_FACTORIES = {
+    "JUMP": _make_jump,
+    "GENERIC": _make_generic,
+    "GENERIC_JUMP": _make_generic_jump,
+}
+
+
+def compile_register(code_object, table: list = None, options: dict = None):
+    """
+    Decodes and translates a code object into a :class:`RegisterCode`.
+
+    The code object is decoded again, without the options that would hide instructions from the translation.
+
+    :param code_object: The code object to compile.
+    :param table: The dispatch table used to resolve handlers.
+    :param options: Options passed to :func:`naft.code.decode`.
+    :return: A new :class:`RegisterCode`, or None if the code object can't be translated.
+    """
+    options = {name: value for name, value in (options or {}).items() if name not in IGNORED_OPTIONS}
+    decoded = decode(code_object, table, **options)
+    try:
+        ir, ir_entries = translate(decoded.instructions, decoded.consts)
+    except Untranslatable:
+        return None
+
+    ops = []
+    links = []
+    indexes = {}
+    for operation in ir:
+        factory = _FACTORIES.get(operation.op, _make_template_op)
+        op, link = factory(operation)
+        ops.append(op)
+        links.append(link)
+        indexes[op] = operation.index
+
+    entries = {index: (ops[position] if position is not None else None) for index, position in ir_entries.items()}
+    for position, link in enumerate(links):
+        link(ops, entries, position)
+
+    return RegisterCode(decoded.instructions, ir, ops, indexes, entries)
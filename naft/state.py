@@ -2,9 +2,9 @@
 Contains the "state" for the function currently running.
 """
 
-import collections
+import builtins
 
-from naft.exceptions.internal import BadPopException
+from naft.exceptions.internal import BadPopException, BadPushException
 
 # "Special" value.
 # Used to signify a null value in the names or varnames.
@@ -13,6 +13,34 @@ from naft.exceptions.internal import BadPopException
 
 NAFT_NULL = type("NAFTNULL", (), {})
 
+# Tuples of NAFT_NULL, keyed by length.
+# These are used to fill in and clear the storage for names and varnames without building a new list every time.
+_nulls = {}
+
+
+def get_nulls(length: int) -> tuple:
+    """
+    Gets a tuple of ``length`` NAFT_NULLs.
+    """
+    try:
+        return _nulls[length]
+    except KeyError:
+        nulls = _nulls[length] = (NAFT_NULL,) * length
+        return nulls
+
+
+def get_builtins(globals_: dict) -> dict:
+    """
+    Gets the builtins used by code running with ``globals_``.
+
+    Like CPython, this is the ``__builtins__`` of the globals, which may be either a module or a dict.
+    If there isn't one, the real builtins are used.
+    """
+    builtins_ = globals_.get("__builtins__", builtins)
+    if isinstance(builtins_, dict):
+        return builtins_
+    return builtins_.__dict__
+
 
 class FunctionState:
     """
@@ -21,50 +49,204 @@ class FunctionState:
     It contains the stack, the "storage" for varnames and names, and other information like that.
     This is heavily passed around to other functions in the engine, allowing functions to modify the state.
 
-    :ivar stack: The current function stack.
+    States are recycled by the engine once a function returns; see :meth:`release`. Don't keep a reference to a state
+    after its function has returned.
+
+    :ivar stack: The current function stack. This is a list of ``co_stacksize`` slots, and only the slots below ``sp``
+        are in use.
+    :ivar sp: The stack pointer; the index of the next free slot in the stack.
     :ivar names: The current storage for the names.
     :ivar varnames: The current storage for the varnames.
+    :ivar pc: The program counter; the index of the next instruction to run.
+    :ivar return_value: The value being returned, once a handler has signalled a return.
+    :ivar decoded: The :class:`naft.code.DecodedCode` of the function.
+    :ivar instructions: The decoded instructions of the function, used to work out the current line number.
+    :ivar runner: The engine loop that runs this function.
+    :ivar globals: The module globals of the function. This is the real dict, not a copy.
+    :ivar builtins: The builtins of the function, which are looked up if a name is not in the globals.
+    :ivar suspended: Set when the function is a generator that has yielded; see :mod:`naft.generator`.
+    :ivar elided: The number of frames this state replaced on the call stack with tail calls; see :mod:`naft.tailcall`.
     """
+    __slots__ = ("_wrapped_func", "consts", "names", "names_stored", "varnames", "varnames_stored", "stack", "sp", "_name",
+                 "globals", "builtins", "engine", "decoded", "instructions", "runner",
+                 "pc", "block_stack", "return_value", "suspended", "elided")
 
     def __init__(self, func, consts: tuple, names: list, varnames: list,
-                 globals_: dict):
+                 globals_: dict, builtins_: dict = None, stacksize: int = None):
         self._wrapped_func = func
         self.consts = consts
         self.names = names
-        self.names_stored = [NAFT_NULL for x in range(len(names))]
+        self.names_stored = list(get_nulls(len(names)))
         self.varnames = varnames
-        self.varnames_stored = [NAFT_NULL for x in range(len(varnames))]
-        # The stack is only as big as the func's stack size.
-        stack_size = func.__code__.co_stacksize
-
-        self.stack = collections.deque(maxlen=stack_size)
+        self.varnames_stored = list(get_nulls(len(varnames)))
+        # The stack is only as big as the func's stack size, unless the decoded code needs more.
+        # It is allocated up front, and items are pushed and popped by moving the stack pointer.
+        if stacksize is None:
+            stacksize = func.__code__.co_stacksize
+        self.stack = list(get_nulls(stacksize))
+        self.sp = 0
 
         self._name = self._wrapped_func.__name__
 
         self.globals = globals_
+        self.builtins = builtins_ if builtins_ is not None else get_builtins(globals_)
 
         # The current NAFTEngine that the state is associated with.
         self.engine = None
 
-        # The current line number.
-        self.line_no = 0
+        # The decoded code being run.
+        # This is set by the engine, and stays the same when the state is re-used, as the code object is the same.
+        self.decoded = None
+        self.instructions = ()
+
+        # The engine loop used to run the function, picked by the engine for each call.
+        self.runner = None
+
+        # The index of the next instruction to run.
+        self.pc = 0
+
+        # The block stack, used by loops.
+        # Each item is a (target index, stack level) tuple.
+        self.block_stack = []
+
+        # The value being returned; see :mod:`naft.exceptions.signals`.
+        self.return_value = None
+
+        # How a generator was suspended when it yielded, or 0 if it is running or returned.
+        self.suspended = 0
+
+        # The number of frames elided by tail calls below this one.
+        self.elided = 0
+
+    def reuse(self, func, globals_: dict, builtins_: dict = None):
+        """
+        Prepares a released state to run a function again.
+
+        The function must have the same code object as the function this state was created for.
+
+        :param func: The function to run.
+        :param globals_: The globals to run the function with.
+        :param builtins_: The builtins to run the function with. Defaults to the builtins of ``globals_``.
+        """
+        self._wrapped_func = func
+        self._name = func.__name__
+        self.globals = globals_
+        self.builtins = builtins_ if builtins_ is not None else get_builtins(globals_)
+        self.pc = 0
+        self.suspended = 0
+        self.elided = 0
+
+    @property
+    def line_no(self) -> int:
+        """
+        The current line number.
+
+        This is worked out from the program counter when it is needed, rather than being tracked as the function runs.
+        """
+        if self.pc == 0:
+            return self._wrapped_func.__code__.co_firstlineno
+        return self.instructions[self.pc - 1].line_no
+
+    def release(self):
+        """
+        Clears this state, once its function has returned, so that it can be re-used.
+
+        This drops every reference the state holds to the function, its locals and its stack, so that a recycled
+        state doesn't keep anything alive.
+        """
+        self.varnames_stored[:] = get_nulls(len(self.varnames_stored))
+        self.names_stored[:] = get_nulls(len(self.names_stored))
+        self.stack[:] = get_nulls(len(self.stack))
+        self.sp = 0
+        del self.block_stack[:]
+
+        self._wrapped_func = None
+        self.globals = None
+        self.builtins = None
+        self.engine = None
+        self.runner = None
+        self.return_value = None
+        # A backend may have run the function from its own instructions.
+        if self.decoded is not None:
+            self.instructions = self.decoded.instructions
 
     def pop(self):
         """
         Pops the right most item off of the function stack.
 
-        If there is no value here, it will raise a :class:`naft.exc.BadPopException`.
-        :return: The item existing at the left of the function stack.
+        The slot isn't cleared, so the item is kept alive until it is overwritten or the state is released.
+
+        If there is no value here, it will raise a :class:`naft.exceptions.internal.BadPopException`.
+        :return: The item existing at the right of the function stack.
         """
-        try:
-            return self.stack.pop()
-        except IndexError as e:
-            raise BadPopException() from e
+        sp = self.sp - 1
+        if sp < 0:
+            raise BadPopException()
+        self.sp = sp
+        return self.stack[sp]
 
     def push(self, value: object):
         """
         Pushes an item onto the stack.
 
+        If the stack is full, it will raise a :class:`naft.exceptions.internal.BadPushException`.
         :param value: The item to push onto the stack.
         """
-        self.stack.append(value)
+        try:
+            self.stack[self.sp] = value
+        except IndexError as e:
+            raise BadPushException() from e
+        self.sp += 1
+
+    def top(self):
+        """
+        :return: The right most item of the function stack, without popping it.
+        """
+        if not self.sp:
+            raise BadPopException()
+        return self.stack[self.sp - 1]
+
+    def pop_n(self, count: int) -> list:
+        """
+        Pops ``count`` items off of the stack at once.
+
+        :param count: The number of items to pop.
+        :return: A list of the items, in the order they were pushed.
+        """
+        sp = self.sp - count
+        if sp < 0:
+            raise BadPopException()
+        items = self.stack[sp:self.sp]
+        self.sp = sp
+        return items
+
+    def peek_n(self, count: int) -> list:
+        """
+        Gets the top ``count`` items of the stack, without popping them.
+
+        :param count: The number of items to get.
+        :return: A list of the items, in the order they were pushed.
+        """
+        if count > self.sp:
+            raise BadPopException()
+        return self.stack[self.sp - count:self.sp]
+
+    def rotate(self, count: int):
+        """
+        Moves the top item of the stack down to position ``count``, shifting the items above it up by one.
+
+        ``rotate(2)`` is ``ROT_TWO``, and ``rotate(3)`` is ``ROT_THREE``.
+
+        :param count: The number of items to rotate.
+        """
+        sp = self.sp
+        if count > sp:
+            raise BadPopException()
+        stack = self.stack
+        stack[sp - count:sp] = [stack[sp - 1]] + stack[sp - count:sp - 1]
+
+    def get_items(self) -> list:
+        """
+        :return: A list of the items on the stack, from the bottom up.
+        """
+        return self.stack[:self.sp]
@@ -0,0 +1,80 @@
+"""
+Tail-call elimination.
+
+A call that is immediately followed by ``RETURN_VALUE`` is a tail call: once the callee returns, the caller only hands
+its return value straight back. The caller's frame isn't needed while the callee runs, so tail-recursive code doesn't
+need a frame for every level of recursion.
+
+When code is decoded with ``tail_calls=True``, every tail call gets :func:`handle_tail_call` as its handler. It makes
+the call as normal, and if that pushed the state of an interpreted function, the engine removes the caller from the
+call stack from under it, and releases the caller's state so that it can be re-used. The callee then returns straight to
+whatever called the caller. Tail-recursive code runs with a constant call stack depth, and only ever has two states for
+each function, so it isn't limited by the engine's ``recursion_limit``.
+
+The frames that were removed can't show up in a traceback. Instead, the traceback of the frame that replaced them has
+``tb_elided`` set to the number of frames that were elided before it.
+
+Frames aren't elided while hooks are installed, as the hooks expect a return for every call.
+"""
+import dis
+import inspect
+
+from naft.exceptions.signals import WHY_CALL
+from naft.instruction import NInstruction
+from naft.ops import DISPATCH_TABLE
+from naft.state import FunctionState
+
+_opmap = dis.opmap
+
+# The calls that can be tail calls.
+# CALL_FUNCTION_EX only exists on Python 3.6 and above.
+CALL_OPCODES = frozenset(_opmap[name] for name in ("CALL_FUNCTION", "CALL_FUNCTION_KW", "CALL_FUNCTION_EX")
+                         if name in _opmap)
+
+RETURN_VALUE = _opmap["RETURN_VALUE"]
+
+# Code flags that mean the frame of a function is needed after it returns a value: a generator or a coroutine returns
+# by finishing, not by handing a value to its caller.
+NO_TAIL_CALL_FLAGS = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE \
+                     | getattr(inspect, "CO_ASYNC_GENERATOR", 0)
+
+# Blocks that run code when the function returns, or that catch exceptions raised by the callee. A call inside one of
+# these needs the frame of the caller, so code that uses them doesn't get tail calls at all.
+HANDLER_BLOCKS = frozenset(_opmap[name] for name in ("SETUP_EXCEPT", "SETUP_FINALLY", "SETUP_WITH", "SETUP_ASYNC_WITH")
+                           if name in _opmap)
+
+
+def mark_tail_calls(code, instructions: list) -> list:
+    """
+    Gives every tail call in some instructions :func:`handle_tail_call` as its handler.
+
+    Instructions whose handler was overridden are left alone, so that the override still runs.
+
+    :param code: The code object the instructions are from.
+    :param instructions: The instructions to mark.
+    :return: A list of the offsets of each tail call.
+    """
+    if code.co_flags & NO_TAIL_CALL_FLAGS or any(instruction.opcode in HANDLER_BLOCKS for instruction in instructions):
+        return []
+
+    tail_calls = []
+    for instruction, following in zip(instructions, instructions[1:]):
+        if instruction.opcode in CALL_OPCODES and following.opcode == RETURN_VALUE \
+                and instruction.handler is DISPATCH_TABLE[instruction.opcode] \
+                and following.handler is DISPATCH_TABLE[RETURN_VALUE]:
+            instruction.handler = handle_tail_call
+            tail_calls.append(instruction.offset)
+    return tail_calls
+
+
+def handle_tail_call(state: FunctionState, instruction: NInstruction):
+    """
+    Handles a call that is immediately followed by RETURN_VALUE.
+
+    This runs the default handler for the call. If that pushed an interpreted function, the engine elides the frame of
+    this state.
+    """
+    why = DISPATCH_TABLE[instruction.opcode](state, instruction)
+    if why == WHY_CALL and not state.engine.hooks:
+        state.engine._elide_frame(state)
+    return why
@@ -0,0 +1,401 @@
+"""
+The closure-threaded backend.
+
+Instead of looping over the instructions and calling ``handler(state, instruction)`` for each one, this backend compiles
+the decoded instructions of a function into a chain of closures. Each closure runs one instruction, with its operands
+baked in, and returns the next closure to run, or None once the engine has been signalled (for example, because the
+function has returned). Jump targets are linked directly to the closure they jump to, so running
+a function is just a sequence of closure calls with no lookups in between.
+
+Instructions that have no specialised closure here fall back to calling their handler, so anything the stack engine can
+run, this can run too.
+"""
+import dis
+
+from naft.ops import DISPATCH_TABLE, binary, jump, load, misc, store
+from naft.ops.fused import handle_compare_op_pop_jump_if_false
+from naft.quicken import Specialization, handle_adaptive
+from naft.state import FunctionState, NAFT_NULL
+
+
+class ThreadedCode:
+    """
+    The closure-threaded form of a :class:`naft.code.DecodedCode`.
+
+    :ivar ops: The list of closures, one per instruction. A function is resumed from the closure at its program counter.
+    :ivar indexes: A dict of closure -> the index of the instruction it runs. This is used to set the program counter
+        when an exception is raised, so the line number can be found.
+    """
+    __slots__ = ("ops", "indexes")
+
+    def __init__(self, ops: list, indexes: dict):
+        self.ops = ops
+        self.indexes = indexes
+
+    @property
+    def entry(self):
+        """
+        The closure for the first instruction.
+        """
+        return self.ops[0]
+
+
+def _get_next(ops: list, index: int):
+    """
+    Gets the closure after ``index``, or None if this is the last one.
+    """
+    if index + 1 < len(ops):
+        return ops[index + 1]
+    return None
+
+
+# Each factory takes an instruction, and returns an (op, link) tuple.
+# ``op`` is the closure, and ``link(ops, index)`` is called once every closure has been created, so that the closure
+# can be pointed at the closures it continues to.
+
+def _make_generic(instruction):
+    handler = instruction.handler
+    nxt = None
+    resume = 0
+
+    def op(state: FunctionState):
+        if handler(state, instruction):
+            # The engine has been signalled, so stop here, and make sure the function can be resumed.
+            state.pc = resume
+            return None
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt, resume
+        nxt, resume = _get_next(ops, index), index + 1
+
+    return op, link
+
+
+def _make_generic_jump(instruction):
+    # An instruction with a jump target that has no specialised closure.
+    # The handler may assign to the program counter, so go wherever that points.
+    handler = instruction.handler
+    ops = None
+    index = 0
+
+    def op(state: FunctionState):
+        state.pc = index + 1
+        if handler(state, instruction):
+            return None
+        return ops[state.pc]
+
+    def link(ops_: list, index_: int):
+        nonlocal ops, index
+        ops, index = ops_, index_
+
+    return op, link
+
+
+def _make_adaptive(instruction):
+    # An instruction that rewrites its own handler, so the handler has to be looked up every time.
+    nxt = None
+
+    def op(state: FunctionState):
+        instruction.handler(state, instruction)
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt
+        nxt = _get_next(ops, index)
+
+    return op, link
+
+
+def _make_load_fast(instruction):
+    arg = instruction.arg
+    nxt = None
+
+    def op(state: FunctionState):
+        varname = state.varnames_stored[arg]
+        if varname == NAFT_NULL:
+            raise SystemError("unable to load varname '{}'".format(state.varnames[arg]))
+        state.push(varname)
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt
+        nxt = _get_next(ops, index)
+
+    return op, link
+
+
+def _make_load_const(instruction):
+    arg = instruction.arg
+    nxt = None
+
+    def op(state: FunctionState):
+        state.push(state.consts[arg])
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt
+        nxt = _get_next(ops, index)
+
+    return op, link
+
+
+def _make_store_fast(instruction):
+    arg = instruction.arg
+    nxt = None
+
+    def op(state: FunctionState):
+        state.varnames_stored[arg] = state.pop()
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt
+        nxt = _get_next(ops, index)
+
+    return op, link
+
+
+def _make_pop_top(instruction):
+    nxt = None
+
+    def op(state: FunctionState):
+        state.pop()
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt
+        nxt = _get_next(ops, index)
+
+    return op, link
+
+
+def _make_return_value(instruction):
+    def op(state: FunctionState):
+        state.return_value = state.pop()
+        return None
+
+    def link(ops: list, index: int):
+        pass
+
+    return op, link
+
+
+def _make_binary(func):
+    def factory(instruction):
+        nxt = None
+
+        def op(state: FunctionState):
+            right = state.pop()
+            left = state.pop()
+            state.push(func(left, right))
+            return nxt
+
+        def link(ops: list, index: int):
+            nonlocal nxt
+            nxt = _get_next(ops, index)
+
+        return op, link
+
+    return factory
+
+
+def _make_compare_op(instruction):
+    compare = binary.COMPARE_TABLE[instruction.arg]
+    nxt = None
+
+    def op(state: FunctionState):
+        right = state.pop()
+        left = state.pop()
+        state.push(compare(left, right))
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt
+        nxt = _get_next(ops, index)
+
+    return op, link
+
+
+def _make_jump(instruction):
+    target = None
+
+    def op(state: FunctionState):
+        return target
+
+    def link(ops: list, index: int):
+        nonlocal target
+        target = ops[instruction.target]
+
+    return op, link
+
+
+def _make_pop_jump_if_false(instruction):
+    nxt = target = None
+
+    def op(state: FunctionState):
+        if not state.pop():
+            return target
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt, target
+        nxt, target = _get_next(ops, index), ops[instruction.target]
+
+    return op, link
+
+
+def _make_pop_jump_if_true(instruction):
+    nxt = target = None
+
+    def op(state: FunctionState):
+        if state.pop():
+            return target
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt, target
+        nxt, target = _get_next(ops, index), ops[instruction.target]
+
+    return op, link
+
+
+def _make_jump_if_false_or_pop(instruction):
+    nxt = target = None
+
+    def op(state: FunctionState):
+        if not state.stack[state.sp - 1]:
+            return target
+        state.pop()
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt, target
+        nxt, target = _get_next(ops, index), ops[instruction.target]
+
+    return op, link
+
+
+def _make_jump_if_true_or_pop(instruction):
+    nxt = target = None
+
+    def op(state: FunctionState):
+        if state.stack[state.sp - 1]:
+            return target
+        state.pop()
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt, target
+        nxt, target = _get_next(ops, index), ops[instruction.target]
+
+    return op, link
+
+
+def _make_for_iter(instruction):
+    nxt = target = None
+
+    def op(state: FunctionState):
+        try:
+            val = next(state.stack[state.sp - 1])
+        except StopIteration:
+            state.pop()
+            return target
+        state.push(val)
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt, target
+        nxt, target = _get_next(ops, index), ops[instruction.target]
+
+    return op, link
+
+
+def _make_break_loop(instruction):
+    # The end of the loop comes from the block stack, so this has to look it up.
+    ops = None
+
+    def op(state: FunctionState):
+        target, level = state.block_stack.pop()
+        state.sp = level
+        return ops[target]
+
+    def link(ops_: list, index: int):
+        nonlocal ops
+        ops = ops_
+
+    return op, link
+
+
+def _make_compare_op_pop_jump_if_false(instruction):
+    compare = binary.COMPARE_TABLE[instruction.arg]
+    nxt = target = None
+
+    def op(state: FunctionState):
+        right = state.pop()
+        left = state.pop()
+        if not compare(left, right):
+            return target
+        return nxt
+
+    def link(ops: list, index: int):
+        nonlocal nxt, target
+        nxt, target = _get_next(ops, index), ops[instruction.target]
+
+    return op, link
+
+
+# Maps handler -> closure factory.
+# This is keyed on the handler rather than the opcode, so that handlers overridden on an engine still get called.
+FACTORIES = {
+    load.handle_op_124: _make_load_fast,
+    load.handle_op_100: _make_load_const,
+    store.handle_op_125: _make_store_fast,
+    misc.handle_op_1: _make_pop_top,
+    misc.handle_op_83: _make_return_value,
+    binary.handle_op_107: _make_compare_op,
+    jump.handle_op_110: _make_jump,
+    jump.handle_op_113: _make_jump,
+    jump.handle_op_119: _make_jump,
+    jump.handle_op_114: _make_pop_jump_if_false,
+    jump.handle_op_115: _make_pop_jump_if_true,
+    jump.handle_op_111: _make_jump_if_false_or_pop,
+    jump.handle_op_112: _make_jump_if_true_or_pop,
+    jump.handle_op_93: _make_for_iter,
+    jump.handle_op_80: _make_break_loop,
+    handle_compare_op_pop_jump_if_false: _make_compare_op_pop_jump_if_false,
+    handle_adaptive: _make_adaptive,
+}
+
+for _name, _func in binary.BINARY_OPERATORS.items():
+    if _name in dis.opmap:
+        FACTORIES[DISPATCH_TABLE[dis.opmap[_name]]] = _make_binary(_func)
+
+
+def compile_threaded(instructions: list) -> ThreadedCode:
+    """
+    Compiles a list of decoded instructions into closure-threaded code.
+
+    :param instructions: The list of :class:`naft.instruction.NInstruction` to compile.
+    :return: A new :class:`ThreadedCode`.
+    """
+    ops = []
+    links = []
+    indexes = {}
+    for index, instruction in enumerate(instructions):
+        if isinstance(instruction.cache, Specialization):
+            # A quickened instruction may already have been specialised by another backend sharing the decoded code,
+            # so its handler is only a snapshot, and it has to be looked up every time.
+            factory = _make_adaptive
+        else:
+            factory = FACTORIES.get(instruction.handler)
+        if factory is None:
+            factory = _make_generic if instruction.target is None else _make_generic_jump
+        op, link = factory(instruction)
+        ops.append(op)
+        links.append(link)
+        indexes[op] = index
+
+    for index, link in enumerate(links):
+        link(ops, index)
+
+    return ThreadedCode(ops, indexes)
@@ -0,0 +1,83 @@
+"""
+Version counters for watched mappings.
+
+CPython keeps a version tag on every dict, but it isn't exposed to Python code, so NAFT keeps its own. A mapping that
+NAFT caches lookups from (such as the module globals or the builtins) is *watched*, and gets a version counter. Every
+time NAFT writes to a watched mapping, its version is bumped, and any cache filled with the old version is invalid.
+
+Writes made by native code can't be seen by NAFT. If native code changes a watched mapping while cached code is
+running, it must call :func:`changed` (or :func:`changed_all`), or the caches keep using the old values.
+
+Classes are versioned the same way, but with one version shared by every class. A change to a class also changes the
+attributes of its subclasses, and there's no cheap way to find those, so any change to any class invalidates every
+cache filled from a class. Native code that changes a class while cached code is running must call
+:func:`changed_class`.
+"""
+
+
+class MappingVersion:
+    """
+    The version counter of a watched mapping.
+
+    :ivar mapping: The mapping being watched.
+    :ivar version: The current version. This goes up by one every time the mapping is changed.
+    """
+    __slots__ = ("mapping", "version")
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.version = 0
+
+
+# The version shared by every class. The mapping is always None.
+classes = MappingVersion(None)
+
+# Maps id(mapping) -> MappingVersion.
+# Dicts can't be weakly referenced, so this holds on to the mappings. In practice, these are module globals and
+# builtins, which live for the lifetime of the program anyway.
+_watched = {}
+
+
+def watch(mapping) -> MappingVersion:
+    """
+    Starts watching a mapping, if it isn't already watched.
+
+    :param mapping: The mapping to watch.
+    :return: The :class:`MappingVersion` for this mapping.
+    """
+    try:
+        return _watched[id(mapping)]
+    except KeyError:
+        version = _watched[id(mapping)] = MappingVersion(mapping)
+        return version
+
+
+def changed(mapping):
+    """
+    Marks a mapping as changed, invalidating anything cached from it.
+
+    This does nothing if the mapping isn't watched.
+
+    :param mapping: The mapping that was changed.
+    """
+    version = _watched.get(id(mapping))
+    if version is not None:
+        version.version += 1
+
+
+def changed_class(cls: type = None):
+    """
+    Marks a class as changed, invalidating anything cached from any class.
+
+    :param cls: The class that was changed. This is only for documentation; every class is invalidated.
+    """
+    classes.version += 1
+
+
+def changed_all():
+    """
+    Marks every watched mapping, and every class, as changed.
+    """
+    for version in _watched.values():
+        version.version += 1
+    classes.version += 1
@@ -1,9 +1,20 @@
 """
 Contains the wrapper that turns a function into one that we execute.
 """
+import functools
 import inspect
 import typing
 
+from naft.binding import BindingPlan
+from naft.state import get_nulls
+
+# The backends that can run a function.
+# ``stack`` loops over the decoded instructions, and ``threaded`` runs them as a chain of closures.
+BACKENDS = ("stack", "threaded", "register")
+
+# The engine options that can be set for a single function with ``with_engine``.
+FUNCTION_OPTIONS = ("backend", "tail_calls")
+
 
 class _NRunnableObject:
     """
@@ -12,11 +23,12 @@ class _NRunnableObject:
     This is created by ``DFunction.__call__()`` which is actually passed to the engine.
     """
 
-    def __init__(self, fun, args, kwargs):
+    def __init__(self, fun, args, kwargs, options: dict = None):
         self.func = fun
         self.args = args
-        # TODO: Add proper kwargs support.
         self.kwargs = kwargs
+        # Engine options for this function, from ``with_engine``.
+        self.options = options if options is not None else {}
 
     def run_natively(self):
         """
@@ -26,8 +38,8 @@ class _NRunnableObject:
 
         .. warning::
 
-            If this is called inside a NAFT function, it is functionally equivalent to just calling the function,
-            due to how the engine processes function calls recursively.
+            If this is called inside a NAFT function, it is functionally equivalent to just calling the function; the
+            function is not run by the engine.
 
         :return: The result of the function.
         """
@@ -47,20 +59,10 @@ class _NRunnableObject:
         This uses the args, and kwargs, to fill in varnames.
         :return: A tuple of varnames, which are filled with the arguments.
         """
-        # TODO: Add proper kwargs support.
-        # This is a temporary raise until I add proper keyword argument filling in.
-        if self.kwargs:
-            raise NotImplementedError("Keyword arguments are not implemented yet")
-        # Calculate the number of arguments.
-        if not self.func.__defaults__:
-            n_defaults = 0
-        else:
-            n_defaults = len(self.func.__defaults__)
-        no_of_args = self.func.__code__.co_argcount - n_defaults
-        if no_of_args != len(self.args):
-            raise TypeError("{}() takes {} positional arguments but {} were given".format(self.func.__qualname__,
-                                                                                          no_of_args, len(self.args)))
-        return self.args
+        code = self.func.__code__
+        varnames_stored = list(get_nulls(len(code.co_varnames)))
+        BindingPlan(code).bind(self.func, self.args, self.kwargs, varnames_stored)
+        return tuple(varnames_stored)
 
     def __repr__(self):  # pragma: no cover
         # construct the qualname
@@ -73,12 +75,21 @@ class NFunction:
     Class returned by ``with_engine``.
 
     :param callable_: The function to call.
+    :param options: Engine options for this function, which override the engine's own; see :data:`FUNCTION_OPTIONS`.
+    :raises TypeError: If an option isn't one of :data:`FUNCTION_OPTIONS`.
+    :raises ValueError: If the backend isn't one of :data:`BACKENDS`.
     """
 
-    def __init__(self, callable_):
+    def __init__(self, callable_, **options):
         if not callable(callable_):
             raise TypeError("Object must be a callable")
+        for name in options:
+            if name not in FUNCTION_OPTIONS:
+                raise TypeError("Unknown engine option '{}'".format(name))
+        if "backend" in options and options["backend"] not in BACKENDS:
+            raise ValueError("Unknown backend '{}'".format(options["backend"]))
         self._callable = callable_
+        self.options = options
 
     def __call__(self, *args, **kwargs) -> _NRunnableObject:
         """
@@ -89,17 +100,29 @@ class NFunction:
 
         :return: A :class:`_DRunnableObject` which can be sent into the object for executing.
         """
-        return _NRunnableObject(self._callable, args, kwargs)
+        return _NRunnableObject(self._callable, args, kwargs, self.options)
 
 
-def with_engine(function: typing.Callable) -> NFunction:
+def with_engine(function: typing.Callable = None, **options) -> NFunction:
     """
     Decorator that marks a function as running with the NAFT engine.
 
     This returns a wrapper which, when run with ``engine.run_function(func(*args, **kwargs))``, will be executed by
     NAFT.
 
+    It can also be called with engine options, which apply only to this function:
+
+    .. code::
+
+        @with_engine(backend="threaded")
+        def func():
+            ...
+
     :param function: The function to wrap.
+    :param options: Engine options for this function. Currently, these are ``backend`` and ``tail_calls``.
+        Unknown options raise a :class:`TypeError`, and unknown backends a :class:`ValueError`.
     :return: A :class:`naft.wrapper.DFunction`, which is then used by the engine.
     """
-    return NFunction(function)
+    if function is None:
+        return functools.partial(with_engine, **options)
+    return NFunction(function, **options)
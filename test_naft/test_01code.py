@@ -0,0 +1,55 @@
+"""
+Code cache tests.
+
+Checks that functions are decoded once, and re-used across calls and engines.
+"""
+import gc
+
+from naft.code import CodeCache, NInstruction
+from naft.engine import NAFTEngine
+from naft.wrapper import with_engine
+
+
+@with_engine
+def some_func(a):
+    return a
+
+
+def test_decoded_instructions():
+    cache = CodeCache()
+    decoded = cache.get(some_func._callable.__code__)
+    assert all(isinstance(i, NInstruction) for i in decoded.instructions)
+    assert decoded.instructions[0].opname == "LOAD_FAST"
+    assert decoded.instructions[0].handler is not None
+    assert decoded.instructions[0].line_no == 15
+
+
+def test_cache_hits():
+    cache = CodeCache()
+    engine = NAFTEngine(code_cache=cache)
+    for x in range(10):
+        assert engine.run_function(some_func(x)) == x
+
+    assert cache.misses == 1
+    assert cache.hits == 9
+
+
+def test_cache_shared_between_engines():
+    cache = CodeCache()
+    NAFTEngine(code_cache=cache).run_function(some_func(1))
+    NAFTEngine(code_cache=cache).run_function(some_func(1))
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_cache_eviction():
+    cache = CodeCache()
+    namespace = {}
+    exec("def f(a):\n    return a", namespace)
+    f = namespace.pop("f")
+    cache.get(f.__code__)
+    assert f.__code__ in cache
+    assert len(cache) == 1
+
+    del f
+    gc.collect()
+    assert len(cache) == 0
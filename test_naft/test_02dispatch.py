@@ -0,0 +1,63 @@
+"""
+Dispatch table tests.
+"""
+import dis
+
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.exceptions.internal import BadOpcode
+from naft.ops import DISPATCH_TABLE, find_operator_implementation
+from naft.ops.dispatch import register
+from naft.wrapper import with_engine
+
+
+@with_engine
+def some_func(a):
+    return a
+
+
+@with_engine
+def uses_unimplemented_op(a):
+    import os
+
+
+def test_table_is_filled():
+    assert len(DISPATCH_TABLE) == 256
+    assert find_operator_implementation(dis.opmap["LOAD_GLOBAL"]) is not None
+    assert find_operator_implementation(dis.opmap["IMPORT_NAME"]) is None
+
+
+def test_register_into_table():
+    table = [None] * 256
+
+    @register("NOP", table)
+    def handle_nop(state, instruction):
+        pass
+
+    assert table[dis.opmap["NOP"]] is handle_nop
+
+    # Unknown opnames are ignored.
+    @register("NOT_A_REAL_OPCODE", table)
+    def handle_nothing(state, instruction):
+        pass
+
+    assert handle_nothing not in table
+
+
+def test_unimplemented_opcode():
+    engine = NAFTEngine()
+    with pytest.raises(BadOpcode):
+        engine.run_function(uses_unimplemented_op(1))
+
+
+def test_engine_override():
+    def handle_load_fast(state, instruction):
+        state.push(42)
+
+    engine = NAFTEngine(handlers={"LOAD_FAST": handle_load_fast})
+    assert engine.run_function(some_func(1)) == 42
+    assert engine.dispatch_table is not DISPATCH_TABLE
+
+    # Other engines are unaffected.
+    assert NAFTEngine().run_function(some_func(1)) == 1
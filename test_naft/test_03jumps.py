@@ -0,0 +1,62 @@
+"""
+Jump and loop tests.
+"""
+from naft.code import CodeCache
+from naft.engine import NAFTEngine
+from naft.wrapper import with_engine
+
+
+@with_engine
+def branches(a):
+    if a > 2:
+        return "big"
+    elif a == 2:
+        return "two"
+    return "small"
+
+
+@with_engine
+def loops(n):
+    total = 1
+    for i in range(n):
+        if i > 5:
+            break
+        total += i
+
+    while total < 100:
+        total = total * 2
+
+    return total
+
+
+@with_engine
+def short_circuit(a, b):
+    return (a and b) or -1
+
+
+def test_jump_targets():
+    decoded = CodeCache().get(loops._callable.__code__)
+    for instruction in decoded.instructions:
+        if instruction.opname in ("JUMP_ABSOLUTE", "FOR_ITER", "SETUP_LOOP", "POP_JUMP_IF_FALSE"):
+            assert 0 <= instruction.target < len(decoded.instructions)
+        else:
+            assert instruction.target is None
+
+
+def test_branches():
+    engine = NAFTEngine()
+    assert engine.run_function(branches(3)) == "big"
+    assert engine.run_function(branches(2)) == "two"
+    assert engine.run_function(branches(1)) == "small"
+
+
+def test_loops():
+    engine = NAFTEngine()
+    for n in (0, 1, 4, 10):
+        assert engine.run_function(loops(n)) == loops._callable(n)
+
+
+def test_short_circuit():
+    engine = NAFTEngine()
+    for a, b in ((0, 1), (1, 0), (1, 2)):
+        assert engine.run_function(short_circuit(a, b)) == short_circuit._callable(a, b)
@@ -0,0 +1,82 @@
+"""
+Engine hook tests.
+"""
+import logging
+
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.hooks import EngineHook, LoggingHook
+from naft.wrapper import with_engine
+
+
+@with_engine
+def some_func(a):
+    return a
+
+
+@with_engine
+def some_other_func(a, b):
+    return some_func(a), b
+
+
+@with_engine
+def bad_func():
+    return some_func()
+
+
+class RecordingHook(EngineHook):
+    def __init__(self):
+        self.events = []
+
+    def on_call(self, state):
+        self.events.append(("call", state._name))
+
+    def on_return(self, state, value):
+        self.events.append(("return", state._name, value))
+
+    def on_instruction(self, state, instruction):
+        self.events.append(("instruction", instruction.opname))
+
+    def on_exception(self, state, exception):
+        self.events.append(("exception", state._name, type(exception)))
+
+
+def test_hook_events():
+    engine = NAFTEngine()
+    hook = RecordingHook()
+    engine.add_hook(hook)
+    assert engine.run_function(some_other_func(1, 2)) == (1, 2)
+
+    calls = [event for event in hook.events if event[0] != "instruction"]
+    assert calls == [("call", "some_other_func"), ("call", "some_func"), ("return", "some_func", 1),
+                     ("return", "some_other_func", (1, 2))]
+    assert ("instruction", "CALL_FUNCTION") in hook.events
+
+
+def test_exception_hook():
+    engine = NAFTEngine()
+    hook = RecordingHook()
+    engine.add_hook(hook)
+    with pytest.raises(TypeError):
+        engine.run_function(bad_func())
+
+    assert ("exception", "bad_func", TypeError) in hook.events
+
+
+def test_remove_hook():
+    engine = NAFTEngine()
+    hook = RecordingHook()
+    engine.add_hook(hook)
+    engine.remove_hook(hook)
+    engine.run_function(some_func(1))
+    assert hook.events == []
+
+
+def test_logging_hook(caplog):
+    engine = NAFTEngine()
+    engine.add_hook(LoggingHook())
+    with caplog.at_level(logging.DEBUG, logger="NAFT.engine"):
+        engine.run_function(some_func(1))
+
+    assert "Running operation 124:LOAD_FAST at line 15 in function some_func" in caplog.text
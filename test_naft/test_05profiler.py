@@ -0,0 +1,87 @@
+"""
+Profiler tests.
+"""
+import io
+import pstats
+
+from naft.engine import NAFTEngine
+from naft.profiler import Profiler
+from naft.wrapper import with_engine
+
+
+@with_engine
+def some_func(a):
+    return a
+
+
+@with_engine
+def some_other_func(a, b):
+    return some_func(a), b
+
+
+@with_engine
+def recurses(n):
+    if n:
+        return recurses(n - 1)
+    return some_func(n)
+
+
+def _get_function(profiler, name):
+    for key, stats in profiler.functions.items():
+        if key[2] == name:
+            return stats
+
+
+def test_profile_counts():
+    engine = NAFTEngine()
+    profiler = Profiler()
+    assert engine.run_function(some_other_func(1, 2), profiler=profiler) == (1, 2)
+    # The profiler is only installed for the call.
+    assert engine.hooks == []
+
+    assert _get_function(profiler, "some_other_func")[:2] == [1, 1]
+    assert _get_function(profiler, "some_func")[:2] == [1, 1]
+    # Two from some_other_func, and one from some_func.
+    assert profiler.opcodes[124][0] == 3
+    assert all(total >= 0 for count, total in profiler.opcodes.values())
+
+    outer = _get_function(profiler, "some_other_func")
+    inner = _get_function(profiler, "some_func")
+    assert outer[3] >= inner[3]
+    assert outer[2] <= outer[3]
+
+
+def test_report():
+    engine = NAFTEngine()
+    profiler = Profiler()
+    engine.run_function(some_other_func(1, 2), profiler=profiler)
+    stream = io.StringIO()
+    profiler.report(stream)
+    output = stream.getvalue()
+    assert "LOAD_FAST" in output
+    assert "(some_other_func)" in output
+
+
+def test_pstats_dump(tmpdir):
+    engine = NAFTEngine()
+    profiler = Profiler()
+    engine.run_function(some_other_func(1, 2), profiler=profiler)
+    filename = str(tmpdir.join("naft.prof"))
+    profiler.dump_stats(filename)
+
+    stats = pstats.Stats(filename, stream=io.StringIO())
+    assert stats.total_calls == 2
+    stats.print_stats()
+    stats.print_callers()
+
+
+def test_recursive_calls():
+    engine = NAFTEngine()
+    profiler = Profiler()
+    assert engine.run_function(recurses(5), profiler=profiler) == 0
+    # Only the outermost call is primitive, and its inclusive time covers the rest.
+    stats = _get_function(profiler, "recurses")
+    assert stats[:2] == [1, 6]
+    assert stats[3] >= stats[2]
+    assert _get_function(profiler, "some_func")[:2] == [1, 1]
+    assert profiler._active == {}
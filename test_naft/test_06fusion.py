@@ -0,0 +1,82 @@
+"""
+Superinstruction fusion tests.
+"""
+from naft import code
+from naft.engine import NAFTEngine
+from naft.wrapper import with_engine
+
+
+@with_engine
+def some_func(a):
+    return a
+
+
+@with_engine
+def adds(a, b):
+    c = a + b
+    return c
+
+
+@with_engine
+def constant():
+    return 1
+
+
+@with_engine
+def loops(n):
+    total = 0
+    i = 0
+    while i < n:
+        total += i
+        i += 1
+    return total
+
+
+@with_engine
+def calls(a):
+    return some_func(some_func(a))
+
+
+def test_fusions_fire():
+    engine = NAFTEngine(fuse=True)
+    names = [name for offset, name in engine.get_fusions(adds)]
+    # The STORE_FAST and LOAD_FAST of c are on different lines, so they are left alone.
+    assert names == ["LOAD_FAST__LOAD_FAST", "LOAD_FAST__RETURN_VALUE"]
+    assert [name for offset, name in engine.get_fusions(constant)] == ["LOAD_CONST__RETURN_VALUE"]
+
+
+def test_fusion_disabled():
+    engine = NAFTEngine()
+    assert engine.get_fusions(adds) == []
+    assert engine.code_cache is code.default_cache
+    assert NAFTEngine(fuse=False).code_cache is code.default_cache
+    assert NAFTEngine(fuse=True).code_cache is not code.default_cache
+
+
+def test_fused_results():
+    plain = NAFTEngine()
+    fused = NAFTEngine(fuse=True)
+    assert fused.run_function(adds(1, 2)) == plain.run_function(adds(1, 2)) == 3
+    assert fused.run_function(constant()) == 1
+    assert fused.run_function(calls(5)) == 5
+    for n in (0, 1, 10):
+        assert fused.run_function(loops(n)) == plain.run_function(loops(n)) == loops._callable(n)
+
+
+def test_jump_targets_not_fused():
+    engine = NAFTEngine(fuse=True)
+    decoded = engine.code_cache.get(loops._callable.__code__)
+    # The loop condition is a jump target, so the LOAD_FAST that starts it must still be there.
+    for instruction in decoded.instructions:
+        if instruction.target is not None:
+            assert decoded.instructions[instruction.target].offset in \
+                   [i.offset for i in code.decode(loops._callable.__code__).instructions]
+
+
+def test_overridden_handlers_not_fused():
+    def handle_load_fast(state, instruction):
+        state.push(42)
+
+    engine = NAFTEngine(fuse=True, handlers={"LOAD_FAST": handle_load_fast})
+    assert engine.get_fusions(some_func) == []
+    assert engine.run_function(adds(1, 2)) == 42
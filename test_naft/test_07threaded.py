@@ -0,0 +1,97 @@
+"""
+Closure-threaded backend tests.
+"""
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.wrapper import with_engine
+
+
+def helper(a):
+    return a * 2
+
+
+@with_engine
+def loops(n):
+    total = 0
+    for i in range(n):
+        if i > 5:
+            break
+        total += helper(i)
+
+    while total < 100:
+        total = total * 2 + 1
+
+    return (total and n) or -1
+
+
+@with_engine
+def fails(a):
+    b = a + 1
+    return missing(b)  # noqa
+
+
+@with_engine
+def fails_nested(a):
+    return fails(a)
+
+
+@with_engine(backend="threaded")
+def threaded_func(a, b):
+    return a + b
+
+
+def test_threaded_results():
+    stack = NAFTEngine()
+    threaded = NAFTEngine(backend="threaded")
+    for n in (0, 1, 4, 10):
+        assert threaded.run_function(loops(n)) == stack.run_function(loops(n)) == loops._callable(n)
+
+
+def test_threaded_fused():
+    engine = NAFTEngine(backend="threaded", fuse=True)
+    for n in (0, 1, 4, 10):
+        assert engine.run_function(loops(n)) == loops._callable(n)
+
+
+def test_compiled_once():
+    engine = NAFTEngine(backend="threaded")
+    engine.run_function(loops(1))
+    threaded = engine.code_cache.get(loops._callable.__code__).threaded
+    assert threaded is not None
+    engine.run_function(loops(1))
+    assert engine.code_cache.get(loops._callable.__code__).threaded is threaded
+
+
+def test_per_function_backend():
+    engine = NAFTEngine()
+    assert engine.run_function(threaded_func(1, 2)) == 3
+    assert engine.code_cache.get(threaded_func._callable.__code__).threaded is not None
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        NAFTEngine(backend="nope")
+
+
+def test_per_function_options_checked():
+    with pytest.raises(ValueError):
+        with_engine(backend="nope")(helper)
+    with pytest.raises(TypeError):
+        with_engine(backnd="threaded")(helper)
+    with pytest.raises(TypeError):
+        with_engine(helper, tail_call=True)
+
+
+@pytest.mark.parametrize("func", [fails, fails_nested])
+def test_same_traceback(func, capsys):
+    with pytest.raises(NameError):
+        NAFTEngine().run_function(func(1))
+    stack_output = capsys.readouterr().err
+
+    with pytest.raises(NameError):
+        NAFTEngine(backend="threaded").run_function(func(1))
+    threaded_output = capsys.readouterr().err
+
+    assert "line 31, in fails" in stack_output
+    assert threaded_output == stack_output
@@ -0,0 +1,77 @@
+"""
+Function state pooling tests.
+"""
+import gc
+import weakref
+
+import pytest
+
+from naft.engine import NAFTEngine, MAX_FREE_STATES
+from naft.state import FunctionState, NAFT_NULL
+from naft.wrapper import with_engine
+
+
+class Thing:
+    pass
+
+
+@with_engine
+def some_func(a):
+    return a
+
+
+@with_engine
+def fails(a):
+    return missing  # noqa
+
+
+def recurse(n):
+    if n:
+        return recurse(n - 1)
+    return n
+
+
+@with_engine
+def run_recurse(n):
+    return recurse(n)
+
+
+def test_state_has_slots():
+    state = FunctionState(some_func._callable, (), (), ("a",), {})
+    assert not hasattr(state, "__dict__")
+    assert state.varnames_stored == [NAFT_NULL]
+
+
+def test_state_reused():
+    engine = NAFTEngine()
+    engine.run_function(some_func(1))
+    free_states = engine.code_cache.get(some_func._callable.__code__).free_states
+    assert len(free_states) == 1
+    state = free_states[0]
+
+    assert engine.run_function(some_func(2)) == 2
+    assert free_states == [state]
+
+
+def test_released_state_drops_references():
+    engine = NAFTEngine()
+    thing = Thing()
+    ref = weakref.ref(thing)
+    engine.run_function(some_func(thing))
+    del thing
+    gc.collect()
+    assert ref() is None
+
+
+def test_free_list_is_bounded():
+    engine = NAFTEngine()
+    assert engine.run_function(run_recurse(MAX_FREE_STATES * 2)) == 0
+    assert len(engine.code_cache.get(recurse.__code__).free_states) == MAX_FREE_STATES
+
+
+def test_failed_state_not_reused():
+    engine = NAFTEngine()
+    free_states = engine.code_cache.get(fails._callable.__code__).free_states
+    with pytest.raises(NameError):
+        engine.run_function(fails(1))
+    assert free_states == []
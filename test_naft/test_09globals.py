@@ -0,0 +1,70 @@
+"""
+Global and builtin lookup tests.
+"""
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.state import FunctionState, get_builtins
+from naft.wrapper import with_engine
+
+counter = 0
+
+
+@with_engine
+def increment():
+    global counter
+    counter = counter + 1
+    return counter
+
+
+@with_engine
+def get_len(a):
+    return len(a)
+
+
+@with_engine
+def remove_counter():
+    global counter
+    del counter
+
+
+def test_store_global_is_visible():
+    global counter
+    counter = 0
+    engine = NAFTEngine()
+    assert engine.run_function(increment()) == 1
+    assert engine.run_function(increment()) == 2
+    assert counter == 2
+
+
+def test_builtins():
+    engine = NAFTEngine()
+    assert engine.run_function(get_len([1, 2, 3])) == 3
+
+
+def test_shadowed_builtin():
+    engine = NAFTEngine()
+    get_len._callable.__globals__["len"] = lambda a: "shadowed"
+    try:
+        assert engine.run_function(get_len([1, 2, 3])) == "shadowed"
+    finally:
+        del get_len._callable.__globals__["len"]
+    assert engine.run_function(get_len([1, 2, 3])) == 3
+
+
+def test_delete_global(capsys):
+    global counter
+    counter = 0
+    engine = NAFTEngine()
+    engine.run_function(remove_counter())
+    assert "counter" not in globals()
+    with pytest.raises(NameError):
+        NAFTEngine().run_function(remove_counter())
+    counter = 0
+
+
+def test_globals_not_copied():
+    state = FunctionState(increment._callable, (), (), (), globals())
+    assert state.globals is globals()
+    assert state.builtins is get_builtins(globals())
+    assert state.builtins["len"] is len
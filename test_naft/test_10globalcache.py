@@ -0,0 +1,145 @@
+"""
+LOAD_GLOBAL inline cache tests.
+"""
+import builtins
+
+from naft import watch
+from naft.code import CodeCache
+from naft.engine import NAFTEngine
+from naft.wrapper import with_engine
+
+value = 1
+
+
+@with_engine
+def get_value():
+    return value
+
+
+@with_engine
+def set_value(new):
+    global value
+    value = new
+
+
+@with_engine
+def sum_lens(items):
+    total = 0
+    for item in items:
+        total = total + len(item)
+    return total
+
+
+@with_engine
+def get_abs(a):
+    return abs(a)
+
+
+def _set_value(new):
+    # Native writes to the globals have to invalidate the caches themselves.
+    global value
+    value = new
+    watch.changed(globals())
+
+
+def _get_stats(engine, function, name):
+    return [stat for stat in engine.get_global_cache_stats(function) if stat[2] == name]
+
+
+def test_cache_hits():
+    engine = NAFTEngine(cache_globals=True)
+    assert engine.run_function(sum_lens(["a", "bb", "ccc"])) == 6
+    assert engine.run_function(sum_lens(["a"])) == 1
+    ((name, offset, global_name, hits, misses),) = _get_stats(engine, sum_lens, "len")
+    assert name == "sum_lens"
+    assert misses == 1
+    assert hits == 3
+
+
+def test_not_cached_by_default():
+    engine = NAFTEngine()
+    engine.run_function(get_value())
+    assert engine.get_global_cache_stats(get_value) == []
+
+
+def test_store_global_invalidates():
+    _set_value(1)
+    engine = NAFTEngine(cache_globals=True)
+    assert engine.run_function(get_value()) == 1
+    assert engine.run_function(get_value()) == 1
+    engine.run_function(set_value(2))
+    assert engine.run_function(get_value()) == 2
+    ((_, _, _, hits, misses),) = _get_stats(engine, get_value, "value")
+    assert (hits, misses) == (1, 2)
+    _set_value(1)
+
+
+def test_native_write_needs_changed():
+    _set_value(1)
+    engine = NAFTEngine(cache_globals=True)
+    assert engine.run_function(get_value()) == 1
+    _set_value(3)
+    assert engine.run_function(get_value()) == 3
+    _set_value(1)
+
+
+def test_native_write_without_changed_not_seen():
+    global value
+    _set_value(1)
+    engine = NAFTEngine(code_cache=CodeCache(cache_globals=True))
+    assert engine.run_function(get_value()) == 1
+    # This is the documented limitation: the cache doesn't look at the globals again until they are marked as changed.
+    value = 4
+    try:
+        assert engine.run_function(get_value()) == 1
+        watch.changed(globals())
+        assert engine.run_function(get_value()) == 4
+    finally:
+        _set_value(1)
+
+
+def test_other_globals_miss():
+    engine = NAFTEngine(code_cache=CodeCache(cache_globals=True))
+    assert engine.run_function(get_value()) == value
+    # The same code run with different globals (as with exec) doesn't use the cached value.
+    other = type(get_value._callable)(get_value._callable.__code__, {"value": "other"})
+    assert engine.run_function(with_engine(other)()) == "other"
+
+
+def test_builtins_invalidate():
+    engine = NAFTEngine(cache_globals=True)
+    assert engine.run_function(get_abs(-2)) == 2
+    original = builtins.abs
+    builtins.abs = lambda a: 10
+    watch.changed(builtins.__dict__)
+    try:
+        assert engine.run_function(get_abs(-2)) == 10
+    finally:
+        builtins.abs = original
+        watch.changed(builtins.__dict__)
+    assert engine.run_function(get_abs(-2)) == 2
+
+
+def test_shadowing_builtin_invalidates():
+    engine = NAFTEngine(cache_globals=True)
+    assert engine.run_function(sum_lens(["ab"])) == 2
+    engine.run_function(set_len(lambda item: 5))
+    try:
+        assert engine.run_function(sum_lens(["ab"])) == 5
+    finally:
+        del globals()["len"]
+        watch.changed(globals())
+    assert engine.run_function(sum_lens(["ab"])) == 2
+
+
+@with_engine
+def set_len(new):
+    global len
+    len = new
+
+
+def test_register_backend_stats():
+    engine = NAFTEngine(code_cache=CodeCache(cache_globals=True), backend="register")
+    assert engine.run_function(sum_lens(["a", "bb", "ccc"])) == 6
+    # The register backend runs its own copy of the instructions, and its caches are listed too.
+    assert [stat[3:] for stat in _get_stats(engine, sum_lens, "len")] == [(0, 0), (2, 1)]
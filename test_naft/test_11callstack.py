@@ -0,0 +1,89 @@
+"""
+Call stack and traceback tests.
+"""
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.hooks import EngineHook
+from naft.wrapper import with_engine
+
+class DepthRecorder:
+    """
+    Records the depth of the call stack when called.
+
+    This is a callable object rather than a function, so that the engine calls it natively.
+    """
+
+    def __init__(self):
+        self.depths = []
+
+    def __call__(self, engine):
+        self.depths.append(len(engine._call_stack))
+        return 0
+
+
+record_depth = DepthRecorder()
+
+
+@with_engine
+def inner(engine):
+    a = 1
+    b = 2
+    return record_depth(engine) + a + b
+
+
+@with_engine
+def outer(engine):
+    return inner(engine)
+
+
+@with_engine
+def fails(a):
+    b = a + 1
+    return missing(b)  # noqa
+
+
+@with_engine
+def fails_nested(a):
+    return fails(a)
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+def test_one_entry_per_call(backend):
+    del record_depth.depths[:]
+    engine = NAFTEngine(backend=backend)
+    assert engine.run_function(outer(engine)) == 3
+    assert record_depth.depths == [2]
+    assert len(engine._call_stack) == 0
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+def test_traceback_built_on_error(backend, capsys):
+    engine = NAFTEngine(backend=backend)
+    with pytest.raises(NameError) as info:
+        engine.run_function(fails_nested(1))
+    assert len(engine._call_stack) == 0
+
+    tb = info.value.__cause__._tb
+    assert tb.tb_frame.f_code is fails_nested._callable.__code__
+    assert tb.tb_lineno == 48
+    assert tb.tb_next.tb_frame.f_code is fails._callable.__code__
+    assert tb.tb_next.tb_lineno == 43
+    assert tb.tb_next.tb_frame.f_locals == {"a": 1, "b": 2}
+    assert tb.tb_next.tb_next is None
+
+    assert "line 43, in fails" in capsys.readouterr().err
+
+
+def test_line_no_from_pc():
+    lines = []
+
+    class LineHook(EngineHook):
+        def on_instruction(self, state, instruction):
+            lines.append(state.line_no)
+
+    engine = NAFTEngine()
+    engine.add_hook(LineHook())
+    engine.run_function(inner(engine))
+    assert lines[0] == 30
+    assert lines[-1] == 32
@@ -0,0 +1,47 @@
+"""
+Engine signalling tests.
+"""
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.exceptions import signals
+from naft.wrapper import with_engine
+
+
+@with_engine
+def add(a, b):
+    return a + b
+
+
+def raise_return_value(state, instruction):
+    raise signals.ReturnValue(state.pop())
+
+
+def return_doubled(state, instruction):
+    state.return_value = state.pop() * 2
+    return signals.WHY_RETURN
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+def test_return_value_set_on_state(backend):
+    engine = NAFTEngine(backend=backend)
+    assert engine.run_function(add(1, 2)) == 3
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+def test_raising_handler_still_works(backend):
+    engine = NAFTEngine(backend=backend, handlers={"RETURN_VALUE": raise_return_value})
+    assert engine.run_function(add(1, 2)) == 3
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+def test_handler_signals_return(backend):
+    engine = NAFTEngine(backend=backend, handlers={"RETURN_VALUE": return_doubled})
+    assert engine.run_function(add(1, 2)) == 6
+
+
+def test_return_value_released():
+    engine = NAFTEngine()
+    engine.run_function(add(1, 2))
+    state = engine.code_cache.get(add._callable.__code__).free_states[-1]
+    assert state.return_value is None
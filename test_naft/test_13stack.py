@@ -0,0 +1,90 @@
+"""
+Function stack tests.
+"""
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.exceptions.internal import BadPopException, BadPushException
+from naft.state import FunctionState, NAFT_NULL
+from naft.wrapper import with_engine
+
+
+def deep(a, b, c, d):
+    return [a, (b, c, d), [a, b]]
+
+
+@with_engine
+def build(a, b, c):
+    return deep(a, b, c, (a, b, c))
+
+
+def _make_state(size: int = 4) -> FunctionState:
+    state = FunctionState(deep, (), (), ("a", "b", "c", "d"), {})
+    state.stack = [NAFT_NULL] * size
+    return state
+
+
+def test_stack_is_preallocated():
+    state = FunctionState(deep, (), (), ("a", "b", "c", "d"), {})
+    assert len(state.stack) == deep.__code__.co_stacksize
+    assert state.sp == 0
+
+
+def test_push_pop():
+    state = _make_state()
+    state.push(1)
+    state.push(2)
+    assert state.top() == 2
+    assert state.pop() == 2
+    assert state.pop() == 1
+    with pytest.raises(BadPopException):
+        state.pop()
+
+
+def test_overflow():
+    state = _make_state(2)
+    state.push(1)
+    state.push(2)
+    with pytest.raises(BadPushException):
+        state.push(3)
+    assert state.get_items() == [1, 2]
+
+
+def test_pop_n_and_peek_n():
+    state = _make_state()
+    for item in (1, 2, 3, 4):
+        state.push(item)
+    assert state.peek_n(2) == [3, 4]
+    assert state.sp == 4
+    assert state.pop_n(3) == [2, 3, 4]
+    assert state.get_items() == [1]
+    assert state.pop_n(0) == []
+    with pytest.raises(BadPopException):
+        state.pop_n(2)
+    with pytest.raises(BadPopException):
+        state.peek_n(2)
+
+
+def test_rotate():
+    state = _make_state()
+    for item in (1, 2, 3, 4):
+        state.push(item)
+    state.rotate(2)
+    assert state.get_items() == [1, 2, 4, 3]
+    state.rotate(3)
+    assert state.get_items() == [1, 3, 2, 4]
+    with pytest.raises(BadPopException):
+        state.rotate(5)
+
+
+def test_release_clears_stack():
+    state = _make_state()
+    state.push(1)
+    state.pop()
+    state.release()
+    assert state.stack == [NAFT_NULL] * 4
+
+
+def test_calls_and_builds():
+    engine = NAFTEngine()
+    assert engine.run_function(build(1, 2, 3)) == build._callable(1, 2, 3)
@@ -0,0 +1,127 @@
+"""
+Non-recursive call tests.
+"""
+import sys
+
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.hooks import EngineHook
+from naft.wrapper import with_engine
+
+
+def count_down(n):
+    if n:
+        return count_down(n - 1) + 1
+    return 0
+
+
+@with_engine
+def run_count_down(n):
+    return count_down(n)
+
+
+class PythonDepth:
+    """
+    Records the depth of the Python stack when called.
+
+    This is a callable object rather than a function, so that the engine calls it natively.
+    """
+
+    def __init__(self):
+        self.depths = []
+
+    def __call__(self):
+        depth = 0
+        frame = sys._getframe()
+        while frame is not None:
+            depth += 1
+            frame = frame.f_back
+        self.depths.append(depth)
+        return 0
+
+
+python_depth = PythonDepth()
+
+
+def nested(n):
+    if n:
+        return nested(n - 1)
+    return python_depth()
+
+
+@with_engine
+def run_nested(n):
+    return nested(n)
+
+
+def fails(n):
+    if n:
+        return fails(n - 1)
+    return missing  # noqa
+
+
+@with_engine
+def run_fails(n):
+    return fails(n)
+
+
+class CountingHook(EngineHook):
+    def __init__(self):
+        self.calls = 0
+        self.returns = 0
+        self.exceptions = 0
+
+    def on_call(self, state):
+        self.calls += 1
+
+    def on_return(self, state, value):
+        self.returns += 1
+
+    def on_exception(self, state, exception):
+        self.exceptions += 1
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+def test_deeper_than_python(backend):
+    n = sys.getrecursionlimit() * 2
+    engine = NAFTEngine(backend=backend)
+    assert engine.run_function(run_count_down(n)) == n
+    assert len(engine._call_stack) == 0
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+def test_python_stack_does_not_grow(backend):
+    del python_depth.depths[:]
+    engine = NAFTEngine(backend=backend)
+    engine.run_function(run_nested(1))
+    engine.run_function(run_nested(50))
+    shallow, deep = python_depth.depths
+    assert shallow == deep
+
+
+def test_recursion_limit(capsys):
+    engine = NAFTEngine(recursion_limit=50)
+    assert engine.run_function(run_count_down(40)) == 40
+    with pytest.raises(RecursionError):
+        engine.run_function(run_count_down(60))
+    assert len(engine._call_stack) == 0
+
+
+def test_hooks_see_every_frame():
+    hook = CountingHook()
+    engine = NAFTEngine()
+    engine.add_hook(hook)
+    engine.run_function(run_count_down(10))
+    assert hook.calls == hook.returns == 12
+
+
+def test_hooks_see_exception_in_every_frame(capsys):
+    hook = CountingHook()
+    engine = NAFTEngine()
+    engine.add_hook(hook)
+    with pytest.raises(NameError):
+        engine.run_function(run_fails(3))
+    assert hook.calls == hook.exceptions == 5
+    assert hook.returns == 0
+    assert "line 61, in fails" in capsys.readouterr().err
@@ -0,0 +1,88 @@
+"""
+Callable classification tests.
+"""
+import functools
+
+from naft import callables, wrapper
+from naft.callables import (CALLABLE_BUILTIN, CALLABLE_FUNCTION, CALLABLE_NFUNCTION, CALLABLE_NO_NAFT,
+                            CALLABLE_OTHER, classify)
+from naft.engine import NAFTEngine
+from naft.wrapper import with_engine
+
+
+class Thing:
+    pass
+
+
+def plain(a):
+    return a + 1
+
+
+def native_only(thing):
+    # STORE_ATTR isn't implemented by NAFT, so this only works if it's called natively.
+    thing.value = 1
+    return thing.value
+
+
+native_only._no_naft_execute = True
+
+
+@with_engine
+def wrapped(a):
+    return a * 2
+
+
+partial_plain = functools.partial(plain, 1)
+
+
+@with_engine
+def calls_everything(a):
+    return len([a]), plain(a), wrapped(a), native_only(Thing()), partial_plain()
+
+
+def test_classify():
+    assert classify(len) == CALLABLE_BUILTIN
+    assert classify([].append) == CALLABLE_BUILTIN
+    assert classify(plain) == CALLABLE_FUNCTION
+    assert classify(wrapped) == CALLABLE_NFUNCTION
+    assert classify(native_only) == CALLABLE_NO_NAFT
+    assert classify(Thing) == CALLABLE_OTHER
+    assert classify(functools.partial(plain, 1)) == CALLABLE_OTHER
+
+
+def test_classification_cached():
+    callables.clear()
+    classify(plain)
+    assert callables._kinds[id(plain)][1] == CALLABLE_FUNCTION
+
+
+def test_cache_evicted():
+    def temporary():
+        pass
+
+    classify(temporary)
+    key = id(temporary)
+    assert key in callables._kinds
+    del temporary
+    assert key not in callables._kinds
+
+
+def test_calls():
+    engine = NAFTEngine()
+    assert engine.run_function(calls_everything(1)) == (1, 2, 2, 1, 2)
+
+
+def test_no_runnable_objects_for_calls(monkeypatch):
+    created = []
+    original_init = wrapper._NRunnableObject.__init__
+
+    def counting_init(self, *args, **kwargs):
+        created.append(self)
+        original_init(self, *args, **kwargs)
+
+    monkeypatch.setattr(wrapper._NRunnableObject, "__init__", counting_init)
+    engine = NAFTEngine()
+    runnable = calls_everything(1)
+    del created[:]
+    engine.run_function(runnable)
+    assert created == []
@@ -0,0 +1,115 @@
+"""
+Argument binding tests.
+"""
+import pytest
+
+from naft.binding import BindingPlan
+from naft.engine import NAFTEngine
+from naft.state import NAFT_NULL
+from naft.wrapper import with_engine
+
+
+def target(a, b=2, *args, c, d=4, **kwargs):
+    return a, b, args, c, d, kwargs
+
+
+def positional(a, b, c=3):
+    return a, b, c
+
+
+def bad_keyword(**kwargs):
+    return positional(1, 2, d=3, **kwargs)
+
+
+@with_engine
+def call_forms(items, mapping):
+    return (
+        target(1, c=3),
+        target(1, 2, 3, 4, c=5, e=6),
+        target(*items, c=1),
+        target(0, *items, **mapping),
+        target(a=1, e=2, **mapping),
+        positional(1, 2),
+        positional(*items),
+        positional(1, *[2], **{"c": 5}),
+    )
+
+
+@with_engine
+def run_bad_keyword():
+    return bad_keyword()
+
+
+@with_engine
+def calls_builtin_with_keywords(items):
+    return sorted(items, key=None, reverse=True)
+
+
+def _bind(func, *args, **kwargs):
+    code = func.__code__
+    varnames_stored = [NAFT_NULL] * len(code.co_varnames)
+    BindingPlan(code).bind(func, args, kwargs, varnames_stored)
+    return varnames_stored
+
+
+def test_plan():
+    plan = BindingPlan(target.__code__)
+    assert plan.argcount == 2
+    assert plan.kwonlyargcount == 2
+    assert plan.varargs == 4
+    assert plan.varkw == 5
+    assert not plan.simple
+    assert BindingPlan(positional.__code__).simple
+
+
+def test_bind():
+    assert _bind(positional, 1, 2) == [1, 2, 3]
+    assert _bind(positional, 1, c=5, b=2) == [1, 2, 5]
+    assert _bind(target, 1, 2, 3, c=4, x=5) == [1, 2, 4, 4, (3,), {"x": 5}]
+
+
+@pytest.mark.parametrize("args, kwargs", [
+    ((), {}),
+    ((1, 2, 3, 4), {}),
+    ((1,), {}),
+    ((1, 2), {"a": 1}),
+    ((1, 2), {"e": 1}),
+])
+def test_errors_match_python(args, kwargs):
+    with pytest.raises(TypeError) as expected:
+        positional(*args, **kwargs)
+    with pytest.raises(TypeError) as actual:
+        _bind(positional, *args, **kwargs)
+    assert str(actual.value) == str(expected.value)
+
+
+def test_missing_keyword_only():
+    with pytest.raises(TypeError) as expected:
+        target(1)
+    with pytest.raises(TypeError) as actual:
+        _bind(target, 1)
+    assert str(actual.value) == str(expected.value)
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+def test_call_forms(backend):
+    engine = NAFTEngine(backend=backend)
+    items = [7, 8]
+    mapping = {"c": 9, "z": 10}
+    assert engine.run_function(call_forms(items, mapping)) == call_forms._callable(items, mapping)
+
+
+def test_keywords_to_builtin():
+    engine = NAFTEngine()
+    assert engine.run_function(calls_builtin_with_keywords([1, 3, 2])) == [3, 2, 1]
+
+
+def test_unexpected_keyword():
+    with pytest.raises(TypeError) as info:
+        NAFTEngine().run_function(run_bad_keyword())
+    assert str(info.value) == "positional() got an unexpected keyword argument 'd'"
+
+
+def test_runnable_keywords():
+    engine = NAFTEngine()
+    assert engine.run_function(with_engine(positional)(1, c=4, b=2)) == (1, 2, 4)
@@ -0,0 +1,104 @@
+"""
+Adaptive quickening tests.
+"""
+import pytest
+
+from naft.code import CodeCache
+from naft.engine import NAFTEngine
+from naft.quicken import QUICKEN_THRESHOLD, handle_adaptive
+from naft.wrapper import with_engine
+
+
+@with_engine
+def add(a, b):
+    return a + b
+
+
+@with_engine
+def total(items):
+    result = 0
+    i = 0
+    while i < len(items):
+        result = result + items[i]
+        i = i + 1
+    return result
+
+
+def _specializations(engine, function, opname):
+    return [stat for stat in engine.get_specialization_stats(function) if stat[2] == opname]
+
+
+def test_specializes_after_threshold():
+    engine = NAFTEngine(code_cache=CodeCache(quicken=True))
+    for x in range(QUICKEN_THRESHOLD - 1):
+        assert engine.run_function(add(x, 1)) == x + 1
+    ((_, _, _, name, count, deopts),) = _specializations(engine, add, "BINARY_ADD")
+    assert name is None
+
+    assert engine.run_function(add(1, 2)) == 3
+    ((_, _, _, name, count, deopts),) = _specializations(engine, add, "BINARY_ADD")
+    assert (name, count, deopts) == ("BINARY_ADD_INT", 1, 0)
+
+
+def test_deoptimizes_on_mismatch():
+    engine = NAFTEngine(code_cache=CodeCache(quicken=True))
+    for x in range(QUICKEN_THRESHOLD):
+        engine.run_function(add(x, 1))
+    assert engine.run_function(add("a", "b")) == "ab"
+    assert engine.run_function(add(1.5, 1)) == 2.5
+
+    ((_, _, _, name, count, deopts),) = _specializations(engine, add, "BINARY_ADD")
+    assert name is None
+    assert deopts == 1
+
+    decoded = engine.code_cache.get(add._callable.__code__)
+    assert any(instruction.handler is handle_adaptive for instruction in decoded.instructions)
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+def test_loop_specializations(backend):
+    engine = NAFTEngine(code_cache=CodeCache(quicken=True), backend=backend)
+    items = list(range(50))
+    assert engine.run_function(total(items)) == sum(items)
+    names = {stat[3] for stat in engine.get_specialization_stats(total)}
+    assert {"COMPARE_OP_INT", "BINARY_ADD_INT", "BINARY_SUBSCR_LIST_INT"} <= names
+
+    floats = [x / 2 for x in range(50)]
+    assert engine.run_function(total(floats)) == sum(floats)
+
+
+def test_shared_cache():
+    assert NAFTEngine(quicken=True).code_cache.options["quicken"]
+
+
+def test_not_quickened_by_default():
+    engine = NAFTEngine()
+    engine.run_function(add(1, 2))
+    assert engine.get_specialization_stats(add) == []
+
+
+def test_unspecializable_backs_off():
+    engine = NAFTEngine(code_cache=CodeCache(quicken=True))
+    for x in range(QUICKEN_THRESHOLD * 4):
+        assert engine.run_function(add([x], [1])) == [x, 1]
+    instruction = [instruction for instruction in engine.code_cache.get(add._callable.__code__).instructions
+                   if instruction.opname == "BINARY_ADD"][0]
+    assert instruction.handler is handle_adaptive
+    assert instruction.cache.threshold > QUICKEN_THRESHOLD
+
+
+def test_threaded_after_specialized():
+    # The decoded code is shared, so the threaded backend can compile an instruction that is already specialised.
+    code_cache = CodeCache(quicken=True)
+    stack = NAFTEngine(code_cache=code_cache)
+    for x in range(QUICKEN_THRESHOLD):
+        stack.run_function(add(x, 1))
+    ((_, _, _, name, _, _),) = _specializations(stack, add, "BINARY_ADD")
+    assert name == "BINARY_ADD_INT"
+
+    threaded = NAFTEngine(code_cache=code_cache, backend="threaded")
+    for x in range(QUICKEN_THRESHOLD + 1):
+        assert threaded.run_function(add(x + 0.5, 1.0)) == x + 1.5
+    # It deoptimised once, and was then specialised again for the new types.
+    ((_, _, _, name, count, deopts),) = _specializations(threaded, add, "BINARY_ADD")
+    assert (name, count, deopts) == ("BINARY_ADD_FLOAT", 2, 1)
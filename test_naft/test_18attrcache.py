@@ -0,0 +1,287 @@
+"""
+Attribute access and attribute cache tests.
+"""
+import math
+
+import pytest
+
+from naft import watch
+from naft.code import CodeCache
+from naft.engine import NAFTEngine
+from naft.hooks import EngineHook
+from naft.instruction import NInstruction
+from naft.ops import attr
+from naft.state import FunctionState, NAFT_NULL
+from naft.wrapper import with_engine
+
+
+class Point:
+    scale = 2
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def total(self):
+        return (self.x + self.y) * self.scale
+
+    @property
+    def doubled(self):
+        return self.x * 2
+
+
+class Slotted:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Fallback:
+    def __getattr__(self, name):
+        return name
+
+
+@with_engine
+def get_x(point):
+    return point.x
+
+
+@with_engine
+def get_x_many(points):
+    total = 0
+    for point in points:
+        total += point.x
+    return total
+
+
+@with_engine
+def call_total(point):
+    return point.total()
+
+
+@with_engine
+def get_scale(point):
+    return point.scale
+
+
+@with_engine
+def get_doubled(point):
+    return point.doubled
+
+
+@with_engine
+def get_value(slotted):
+    return slotted.value
+
+
+@with_engine
+def get_missing(obj):
+    return obj.missing
+
+
+@with_engine
+def get_pi(module):
+    return module.pi
+
+
+@with_engine
+def set_scale(cls, scale):
+    cls.scale = scale
+
+
+@with_engine
+def set_x(point, x):
+    point.x = x
+    return point.x
+
+
+@with_engine
+def delete_x(point):
+    del point.x
+
+
+class CallCounter(EngineHook):
+    def __init__(self):
+        self.names = []
+
+    def on_call(self, state):
+        self.names.append(state._name)
+
+
+def _make_engine() -> NAFTEngine:
+    # A private cache, so that the stats only include the calls made in this test.
+    return NAFTEngine(code_cache=CodeCache(cache_attributes=True))
+
+
+def _get_kinds(engine, function) -> list:
+    return [stat[3] for stat in engine.get_attribute_cache_stats(function)]
+
+
+def test_generic_attributes():
+    engine = NAFTEngine()
+    point = Point(1, 2)
+    assert engine.run_function(get_x(point)) == 1
+    assert engine.run_function(call_total(point)) == 6
+    assert engine.run_function(set_x(point, 5)) == 5
+    assert point.x == 5
+    engine.run_function(delete_x(point))
+    assert not hasattr(point, "x")
+    assert engine.get_attribute_cache_stats(get_x) == []
+
+
+def test_methods_are_interpreted():
+    engine = NAFTEngine()
+    counter = CallCounter()
+    engine.add_hook(counter)
+    assert engine.run_function(call_total(Point(1, 2))) == 6
+    assert counter.names == ["call_total", "total"]
+
+
+def test_instance_kind():
+    engine = _make_engine()
+    assert engine.run_function(get_x_many([Point(1, 0), Point(2, 0), Point(3, 0)])) == 6
+    ((name, offset, attr_name, kind, hits, misses),) = engine.get_attribute_cache_stats(get_x_many)
+    assert (name, attr_name, kind) == ("get_x_many", "x", "instance")
+    assert misses == 1
+    assert hits == 2
+
+
+def test_kinds():
+    engine = _make_engine()
+    point = Point(3, 4)
+    assert engine.run_function(call_total(point)) == 14
+    assert engine.run_function(get_scale(point)) == 2
+    assert engine.run_function(get_doubled(point)) == 6
+    assert engine.run_function(get_value(Slotted(5))) == 5
+    assert engine.run_function(get_pi(math)) == math.pi
+    assert _get_kinds(engine, call_total) == ["method"]
+    assert _get_kinds(engine, get_scale) == ["class"]
+    assert _get_kinds(engine, get_doubled) == ["descriptor"]
+    assert _get_kinds(engine, get_value) == ["slot"]
+    assert _get_kinds(engine, get_pi) == ["generic"]
+
+
+def test_instance_dict_shadows_class():
+    engine = _make_engine()
+    point = Point(1, 2)
+    assert engine.run_function(get_scale(point)) == 2
+    point.scale = 10
+    assert engine.run_function(get_scale(point)) == 10
+    assert engine.run_function(call_total(point)) == 30
+    point.total = lambda: "shadowed"
+    assert engine.run_function(call_total(point)) == "shadowed"
+
+
+def test_type_change_refills():
+    engine = _make_engine()
+    assert engine.run_function(get_value(Slotted(1))) == 1
+    assert engine.run_function(get_value(Slotted(2))) == 2
+
+    class Other:
+        value = "other"
+
+    assert engine.run_function(get_value(Other())) == "other"
+    (stat,) = engine.get_attribute_cache_stats(get_value)
+    assert stat[3:] == ("class", 1, 2)
+
+
+def test_missing_attribute():
+    engine = _make_engine()
+    assert engine.run_function(get_missing(Fallback())) == "missing"
+    with pytest.raises(AttributeError):
+        engine.run_function(get_missing(Point(1, 2)))
+    with pytest.raises(AttributeError):
+        engine.run_function(get_value(Slotted.__new__(Slotted)))
+
+
+def test_class_store_invalidates():
+    engine = _make_engine()
+    point = Point(1, 2)
+    assert engine.run_function(get_scale(point)) == 2
+    try:
+        # Changed by NAFT, so the cache sees it.
+        engine.run_function(set_scale(Point, 3))
+        assert engine.run_function(get_scale(point)) == 3
+    finally:
+        Point.scale = 2
+        watch.changed_class(Point)
+
+
+def test_native_class_change():
+    engine = _make_engine()
+    point = Point(1, 2)
+    assert engine.run_function(get_doubled(point)) == 2
+    original = Point.doubled
+    try:
+        # Native changes must invalidate the caches themselves.
+        Point.doubled = property(lambda self: "replaced")
+        watch.changed_class(Point)
+        assert engine.run_function(get_doubled(point)) == "replaced"
+    finally:
+        Point.doubled = original
+        watch.changed_class(Point)
+
+
+def test_native_class_change_without_changed_not_seen():
+    class Child(Point):
+        pass
+
+    engine = _make_engine()
+    child = Child(1, 2)
+    assert engine.run_function(get_scale(child)) == 2
+    # This is the documented limitation: the cache doesn't look at the classes again until they are marked as changed.
+    Child.scale = 7
+    assert engine.run_function(get_scale(child)) == 2
+    watch.changed_class(Child)
+    assert engine.run_function(get_scale(child)) == 7
+
+
+def test_subclass_invalidated_by_base():
+    class Child(Point):
+        pass
+
+    engine = _make_engine()
+    child = Child(1, 2)
+    assert engine.run_function(get_scale(child)) == 2
+    try:
+        engine.run_function(set_scale(Point, 5))
+        assert engine.run_function(get_scale(child)) == 5
+    finally:
+        Point.scale = 2
+        watch.changed_class(Point)
+
+
+def _make_state(*items) -> FunctionState:
+    state = FunctionState(get_x._callable, (), ("total",), ("point",), {})
+    state.stack = [NAFT_NULL] * 4
+    for item in items:
+        state.push(item)
+    return state
+
+
+def test_load_method_skips_binding():
+    # LOAD_METHOD only exists on Python 3.7 and above, so the handlers are called directly.
+    instruction = NInstruction(160, 0, attr.handle_load_method_cached, 1, 0)
+    instruction.cache = attr.AttrCache("total")
+    point = Point(1, 2)
+    state = _make_state(point)
+    attr.handle_load_method_cached(state, instruction)
+    assert state.get_items() == [Point.total, point]
+
+    point.total = len
+    state = _make_state(point)
+    attr.handle_load_method_cached(state, instruction)
+    assert state.get_items() == [NAFT_NULL, len]
+
+
+def test_call_method():
+    instruction = NInstruction(161, 1, attr.handle_op_161, 1, 0)
+    state = _make_state(NAFT_NULL, len, "abc")
+    attr.handle_op_161(state, instruction)
+    assert state.get_items() == [3]
+
+    state = _make_state(str.upper, "abc")
+    instruction.arg = 0
+    attr.handle_op_161(state, instruction)
+    assert state.get_items() == ["ABC"]
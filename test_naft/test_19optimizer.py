@@ -0,0 +1,184 @@
+"""
+Bytecode optimizer tests.
+"""
+import dis
+
+import pytest
+
+from naft.code import CodeCache, decode
+from naft.engine import NAFTEngine
+from naft.instruction import NInstruction
+from naft.ops import DISPATCH_TABLE
+from naft.optimizer import optimize
+from naft.wrapper import with_engine
+
+
+def branches(a):
+    if a:
+        return 1
+    else:
+        return 2
+
+
+def folds(a):
+    return 1 < 2 and not True
+
+
+def compares(a):
+    return 1 < 2
+
+
+def loops(a):
+    while True:
+        if a > 3:
+            break
+        a = a + 1
+    return a
+
+
+def short_circuits(a):
+    return a and (a or 2)
+
+
+def divides(a):
+    return a + 1 / 0
+
+
+def fails_after_fold(a):
+    b = (a, 1 < 2)
+    if a:
+        return missing  # noqa
+    return b
+
+
+@with_engine
+def run_all(a):
+    return branches(a), folds(a), loops(a), short_circuits(a)
+
+
+@with_engine
+def run_divides(a):
+    return divides(a)
+
+
+@with_engine
+def run_fails(a):
+    return fails_after_fold(a)
+
+
+def _make_engine() -> NAFTEngine:
+    return NAFTEngine(code_cache=CodeCache(optimize=True))
+
+
+def _make(opname: str, offset: int, arg=None, target=None) -> NInstruction:
+    opcode = dis.opmap[opname]
+    return NInstruction(opcode, arg, DISPATCH_TABLE[opcode], 1, offset, target)
+
+
+def _opnames(instructions: list) -> list:
+    return [instruction.opname for instruction in instructions]
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded"])
+@pytest.mark.parametrize("a", [0, 1, 5])
+def test_same_results(backend, a):
+    expected = run_all._callable(a)
+    engine = NAFTEngine(code_cache=CodeCache(optimize=True), backend=backend)
+    assert engine.run_function(run_all(a)) == expected
+
+
+def test_not_optimized_by_default():
+    engine = NAFTEngine()
+    engine.run_function(run_all(1))
+    assert engine.get_optimizations(branches) == []
+
+
+def test_dead_tail_removed():
+    engine = _make_engine()
+    assert engine.get_optimizations(branches) == [(12, "dead"), (14, "dead")]
+    decoded = engine.code_cache.get(branches.__code__)
+    assert _opnames(decoded.instructions)[-2:] == ["LOAD_CONST", "RETURN_VALUE"]
+    assert len(decoded.instructions) == 6
+
+
+def test_fold_and_branch():
+    decoded = decode(folds.__code__, optimize=True)
+    assert _opnames(decoded.instructions) == ["LOAD_CONST", "RETURN_VALUE"]
+    assert decoded.consts[decoded.instructions[0].arg] is False
+    # The constants of the code object itself are untouched.
+    assert decoded.consts[:len(folds.__code__.co_consts)] == folds.__code__.co_consts
+    assert {name for offset, name in decoded.optimizations} == {"fold", "branch"}
+
+
+def test_errors_not_folded():
+    decoded = decode(divides.__code__, optimize=True)
+    assert "BINARY_TRUE_DIVIDE" in _opnames(decoded.instructions)
+    with pytest.raises(ZeroDivisionError):
+        _make_engine().run_function(run_divides(1))
+
+
+def test_line_numbers_preserved(capsys):
+    engine = _make_engine()
+    assert engine.run_function(run_fails(0)) == (0, True)
+    with pytest.raises(NameError) as info:
+        engine.run_function(run_fails(1))
+
+    tb = info.value.__cause__._tb.tb_next
+    assert tb.tb_frame.f_code is fails_after_fold.__code__
+    assert tb.tb_lineno == fails_after_fold.__code__.co_firstlineno + 3
+    assert "fold" in {name for offset, name in engine.get_optimizations(fails_after_fold)}
+
+
+def test_thread_jumps():
+    instructions = [
+        _make("LOAD_FAST", 0, 0),
+        _make("POP_JUMP_IF_FALSE", 2, 6, 6),
+        _make("LOAD_CONST", 4, 0),
+        _make("JUMP_FORWARD", 6, 0, 8),
+        _make("JUMP_ABSOLUTE", 8, 12, 12),
+        _make("LOAD_CONST", 10, 0),
+        _make("RETURN_VALUE", 12),
+    ]
+    instructions, consts, fired = optimize(instructions, (None,))
+    # The conditional jump goes straight to the end, and the chain of jumps is gone.
+    assert _opnames(instructions) == ["LOAD_FAST", "POP_JUMP_IF_FALSE", "LOAD_CONST", "RETURN_VALUE"]
+    assert instructions[1].target == 12
+    assert (2, "thread") in fired
+
+
+def test_load_pop_removed():
+    instructions = [
+        _make("LOAD_CONST", 0, 0),
+        _make("POP_TOP", 2),
+        _make("LOAD_FAST", 4, 0),
+        _make("POP_JUMP_IF_FALSE", 6, 0, 0),
+        _make("LOAD_CONST", 8, 0),
+        _make("RETURN_VALUE", 10),
+    ]
+    instructions, consts, fired = optimize(instructions, (None,))
+    assert _opnames(instructions) == ["LOAD_FAST", "POP_JUMP_IF_FALSE", "LOAD_CONST", "RETURN_VALUE"]
+    # The jump to the removed pair moves to the next instruction.
+    assert instructions[1].target == 4
+    assert fired == [(0, "load_pop")]
+
+
+def test_large_constants_not_folded():
+    instructions = [
+        _make("LOAD_CONST", 0, 0),
+        _make("LOAD_CONST", 2, 1),
+        _make("BINARY_POWER", 4),
+        _make("RETURN_VALUE", 6),
+    ]
+    instructions, consts, fired = optimize(instructions, (2, 1000))
+    assert fired == []
+    assert consts == (2, 1000)
+
+
+def test_overridden_handlers_left_alone():
+    def handle_compare_op(state, instruction):
+        state.pop()
+        state.pop()
+        state.push("overridden")
+
+    engine = NAFTEngine(optimize=True, handlers={"COMPARE_OP": handle_compare_op})
+    assert engine.run_function(with_engine(compares)(1)) == "overridden"
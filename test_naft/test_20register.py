@@ -0,0 +1,154 @@
+"""
+Register backend tests.
+"""
+import dis
+
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.exceptions.internal import BadOpcode
+from naft.instruction import NInstruction
+from naft.ops import DISPATCH_TABLE
+from naft.register import CONST, LOCAL, STACK, compile_register, translate
+from naft.wrapper import with_engine
+
+
+def arith(n):
+    total = 0
+    i = 0
+    while i < n:
+        c = i * 2 + 1
+        if c % 3 == 0 and c > 4:
+            total += c
+        elif not c:
+            break
+        i += 1
+    return total
+
+
+def loops(items):
+    out = []
+    for x in items:
+        if x > 2:
+            continue
+        out = out + [x]
+    for y in items:
+        if y == 3:
+            break
+    return out, y, x
+
+
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+
+def short_circuits(a, b):
+    return (a and b) or (not a and -b)
+
+
+def call_in_expression(a):
+    return a + fib(a % 8) * 2
+
+
+def add(a, b):
+    c = a + b
+    return c
+
+
+def fails(a):
+    b = a + 1
+    return missing(b)  # noqa
+
+
+def catches(a):
+    try:
+        return a
+    except ValueError:
+        return None
+
+
+@with_engine
+def run_all(n):
+    return arith(n), loops([1, 2, 3, 4]), fib(10), short_circuits(0, 3), short_circuits(2, 3), call_in_expression(n)
+
+
+@with_engine
+def run_fails(a):
+    return fails(a)
+
+
+@with_engine
+def run_catches(a):
+    return catches(a)
+
+
+@pytest.mark.parametrize("n", [0, 1, 30])
+def test_same_results(n):
+    expected = run_all._callable(n)
+    assert NAFTEngine(backend="register").run_function(run_all(n)) == expected
+
+
+def test_per_function_backend():
+    engine = NAFTEngine()
+    assert engine.run_function(with_engine(backend="register")(add)(1, 2)) == 3
+    decoded = engine.code_cache.get(add.__code__)
+    assert decoded.register
+    assert len(engine._call_stack) == 0
+
+
+def test_three_address():
+    register = compile_register(add.__code__)
+    # c = a + b is one operation, straight into the local.
+    assert [operation.op for operation in register.ir] == ["BINARY", "RETURN"]
+    (binary, ret) = register.ir
+    assert binary.sources == [(LOCAL, 0), (LOCAL, 1)]
+    assert binary.dest == (LOCAL, 2)
+    assert ret.sources == [(LOCAL, 2)]
+
+
+def test_traceback_matches(capsys):
+    tracebacks = []
+    for backend in ("stack", "register"):
+        with pytest.raises(NameError) as info:
+            NAFTEngine(backend=backend).run_function(run_fails(1))
+        tracebacks.append(info.value.__cause__._tb)
+
+    stack, register = tracebacks
+    assert register.tb_next.tb_frame.f_code is fails.__code__
+    assert register.tb_next.tb_lineno == stack.tb_next.tb_lineno == fails.__code__.co_firstlineno + 2
+    assert register.tb_next.tb_frame.f_locals == stack.tb_next.tb_frame.f_locals == {"a": 1, "b": 2}
+    assert register.tb_lineno == stack.tb_lineno
+
+
+def test_untranslatable_falls_back():
+    assert compile_register(catches.__code__) is None
+    engine = NAFTEngine(backend="register")
+    with pytest.raises(BadOpcode):
+        engine.run_function(run_catches(1))
+    assert engine.code_cache.get(catches.__code__).register is False
+
+
+def _make(opname: str, arg=None, target=None) -> NInstruction:
+    opcode = dis.opmap[opname]
+    return NInstruction(opcode, arg, DISPATCH_TABLE[opcode], 1, 0, target)
+
+
+def test_store_flushes_pending_loads():
+    # a + (a = 1): the old value of ``a`` has to be read before it is overwritten.
+    instructions = [
+        _make("LOAD_FAST", 0),
+        _make("LOAD_CONST", 0),
+        _make("STORE_FAST", 0),
+        _make("LOAD_FAST", 0),
+        _make("BINARY_ADD"),
+        _make("RETURN_VALUE"),
+    ]
+    ir, entries = translate(instructions, (1,))
+    assert [(operation.op, operation.sources, operation.dest) for operation in ir] == [
+        ("MOVE", [(LOCAL, 0)], (STACK, 0)),
+        ("MOVE", [(CONST, 1)], (LOCAL, 0)),
+        ("BINARY", [(STACK, 0), (LOCAL, 0)], (STACK, 0)),
+        ("RETURN", [(STACK, 0)], None),
+    ]
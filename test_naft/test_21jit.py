@@ -0,0 +1,236 @@
+"""
+Tracing JIT tests.
+"""
+import operator
+
+import pytest
+
+from naft.code import CodeCache
+from naft.engine import NAFTEngine
+from naft.hooks import EngineHook
+from naft.jit import LoopAnchor
+from naft.wrapper import with_engine
+
+
+def counts(n):
+    total = 0
+    i = 0
+    while i < n:
+        total += i * 2
+        i += 1
+    return total
+
+
+def parities(n):
+    evens = 0
+    odds = 0
+    for i in range(n):
+        if i % 2 == 0:
+            evens += 1
+        else:
+            odds += 1
+    return evens, odds
+
+
+def collects(items):
+    out = []
+    pairs = ()
+    for item in items:
+        if item and (item > 2 or not item % 2):
+            out += [item]
+        pairs = (item, len(out))
+    return out, pairs
+
+
+def applies(f, items):
+    total = 0
+    for item in items:
+        total = total + f(item)
+    return total
+
+
+def identity(a):
+    return a
+
+
+def calls(n):
+    total = 0
+    for i in range(n):
+        total += identity(i)
+    return total
+
+
+def positives(items):
+    count = 0
+    previous = 0
+    for item in items:
+        if previous > 0:
+            count += 1
+        previous = item
+    return count
+
+
+def divides(n):
+    total = 0
+    for i in range(n):
+        total += 100 // (50 - i)
+    return total
+
+
+@with_engine
+def run_all(n):
+    return counts(n), parities(n), collects(list(range(n))), applies(abs, range(-n, n))
+
+
+def _make_engine(**kwargs) -> NAFTEngine:
+    # A private cache, so that the stats only include the calls made in this test.
+    return NAFTEngine(code_cache=CodeCache(jit=True), jit_threshold=4, **kwargs)
+
+
+@pytest.mark.parametrize("n", [0, 3, 100])
+def test_same_results(n):
+    expected = run_all._callable(n)
+    assert _make_engine().run_function(run_all(n)) == expected
+
+
+def test_not_traced_by_default():
+    engine = NAFTEngine()
+    assert engine.run_function(with_engine(counts)(100)) == counts(100)
+    decoded = engine.code_cache.get(counts.__code__)
+    assert not any(isinstance(instruction.cache, LoopAnchor) for instruction in decoded.instructions)
+    assert engine.get_trace_stats(counts) == []
+
+
+def test_hot_loop_runs_in_trace():
+    engine = _make_engine()
+    assert engine.run_function(with_engine(counts)(100)) == counts(100)
+    ((name, offset, length, entries, exits),) = engine.get_trace_stats(counts)
+    assert name == "counts"
+    # Recorded on the fifth time round, and then never left until the loop ended.
+    assert entries == 1
+    assert sum(exits.values()) == 1
+    assert engine.trace_cache.stats()["compiled"] == 1
+
+
+def test_guard_exits():
+    engine = _make_engine()
+    assert engine.run_function(with_engine(parities)(100)) == (50, 50)
+    ((name, offset, length, entries, exits),) = engine.get_trace_stats(parities)
+    # Only one side of the branch is in the trace, so it leaves at the branch on every other iteration.
+    assert entries > 40
+    assert sum(exits.values()) == entries
+    assert len(exits) == 2
+
+
+def test_type_guard_retraces():
+    engine = _make_engine()
+    assert engine.run_function(with_engine(counts)(50)) == counts(50)
+    for _ in range(10):
+        assert engine.run_function(with_engine(counts)(50.5)) == counts(50.5)
+    assert engine.trace_cache.stats()["retraces"] == 1
+
+
+def test_occasional_guard_failures():
+    engine = _make_engine()
+    # The type guard on ``previous`` fails once per call, but the trace runs the rest of the loop each time.
+    items = [1] * 10 + [0.5] + [1] * 10
+    for _ in range(20):
+        assert engine.run_function(with_engine(positives)(items)) == positives(items)
+    assert engine.trace_cache.stats()["retraces"] == 0
+    ((name, offset, length, entries, exits),) = engine.get_trace_stats(positives)
+    assert entries == 40
+
+
+def test_callee_guard():
+    engine = _make_engine()
+    assert engine.run_function(with_engine(applies)(abs, range(-20, 20))) == applies(abs, range(-20, 20))
+    assert engine.run_function(with_engine(applies)(operator.neg, range(20))) == applies(operator.neg, range(20))
+    # The trace for abs leaves as soon as it sees another function, until the loop is recorded again.
+    assert engine.trace_cache.stats()["retraces"] == 1
+    ((name, offset, length, entries, exits),) = engine.get_trace_stats(applies)
+    assert entries == 1
+
+
+def test_interpreted_calls_not_traced():
+    engine = _make_engine()
+    assert engine.run_function(with_engine(calls)(100)) == calls(100)
+    assert engine.get_trace_stats(calls) == []
+    assert engine.trace_cache.stats()["aborts"] > 0
+
+
+def test_exception_in_trace():
+    states = []
+
+    def handle_get_iter(state, instruction):
+        states.append(state)
+        state.push(iter(state.pop()))
+
+    engine = _make_engine(handlers={"GET_ITER": handle_get_iter})
+    with pytest.raises(ZeroDivisionError):
+        engine.run_function(with_engine(divides)(100))
+    # The exception came out of the trace, with the locals and the program counter written back.
+    ((name, offset, length, entries, exits),) = engine.get_trace_stats(divides)
+    assert entries == 1 and exits == {}
+    (state,) = states
+    assert state.line_no == divides.__code__.co_firstlineno + 3
+    assert state.varnames_stored[2] == 50
+    assert state.varnames_stored[1] == sum(100 // (50 - i) for i in range(50))
+
+
+def test_trace_state_written_back():
+    engine = _make_engine()
+    state_seen = []
+
+    def handle_return(state, instruction):
+        state_seen.append(dict(zip(state.varnames, state.varnames_stored)))
+        state.return_value = state.pop()
+        return 1
+
+    engine.register_handler("RETURN_VALUE", handle_return)
+    assert engine.run_function(with_engine(counts)(10)) == counts(10)
+    assert state_seen[-1] == {"n": 10, "total": 90, "i": 10}
+
+
+def test_cache_eviction():
+    engine = _make_engine(trace_cache_size=1)
+    assert engine.run_function(with_engine(counts)(20)) == counts(20)
+    assert engine.run_function(with_engine(parities)(20)) == (10, 10)
+    stats = engine.trace_cache.stats()
+    assert stats["compiled"] == 2
+    assert stats["evictions"] == 1
+    assert stats["size"] == 1
+    assert engine.get_trace_stats(counts) == []
+
+
+def test_adopted_traces_evicted():
+    code_cache = CodeCache(jit=True)
+    first = NAFTEngine(code_cache=code_cache, jit_threshold=4)
+    assert first.run_function(with_engine(counts)(20)) == counts(20)
+    assert first.run_function(with_engine(parities)(20)) == (10, 10)
+
+    # The traces were compiled by the first engine, but the second still keeps to its own size.
+    second = NAFTEngine(code_cache=code_cache, jit_threshold=4, trace_cache_size=1)
+    assert second.run_function(with_engine(counts)(20)) == counts(20)
+    assert second.run_function(with_engine(parities)(20)) == (10, 10)
+    stats = second.trace_cache.stats()
+    assert stats["compiled"] == 0
+    assert stats["evictions"] == 1
+    assert stats["size"] == 1
+
+
+class NullHook(EngineHook):
+    pass
+
+
+def test_hooks_disable_traces():
+    engine = _make_engine()
+    engine.add_hook(NullHook())
+    assert engine.run_function(with_engine(counts)(100)) == counts(100)
+    assert engine.trace_cache.stats()["compiled"] == 0
+
+
+@pytest.mark.parametrize("backend", ["threaded", "register"])
+def test_other_backends(backend):
+    engine = _make_engine(backend=backend)
+    assert engine.run_function(run_all(20)) == run_all._callable(20)
+    assert engine.trace_cache.stats()["compiled"] == 0
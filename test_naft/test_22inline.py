@@ -0,0 +1,239 @@
+"""
+Call-site inlining tests.
+"""
+import pytest
+
+from naft import inline
+from naft.code import CodeCache
+from naft.engine import NAFTEngine
+from naft.hooks import EngineHook
+from naft.wrapper import with_engine
+
+
+def some_func(a):
+    return a
+
+
+def some_other_func(a, b):
+    return some_func(a), b
+
+
+def adds(a, b):
+    c = a + b
+    return c
+
+
+def clamps(a):
+    if a > 10:
+        return 10
+    return a
+
+
+def fails_after(a):
+    b = a * 2
+    if a < 20:
+        return b
+    return missing(b)  # noqa
+
+
+def counts(n):
+    return n if n < 1 else counts(n - 1)
+
+
+def packs(*args):
+    return args
+
+
+def loops(a):
+    for item in a:
+        return item
+
+
+def calls_all(n):
+    total = 0
+    pairs = []
+    for i in range(n):
+        total = total + adds(i, clamps(i)) + counts(1)
+        pairs.append(some_other_func(i, total))
+    return total, pairs, packs(n), loops([n])
+
+
+def calls_failing(n):
+    total = 0
+    for i in range(n):
+        total = total + fails_after(i)
+    return total
+
+
+wrapped = with_engine(adds)
+wrapped_with_options = with_engine(backend="threaded")(adds)
+
+
+def calls_wrapped(n):
+    total = 0
+    for i in range(n):
+        total = wrapped(total, i) + wrapped_with_options(i, 1)
+    return total
+
+
+def _make_engine(**kwargs) -> NAFTEngine:
+    # A private cache, so that the stats only include the calls made in this test.
+    return NAFTEngine(code_cache=CodeCache(inline=True), **kwargs)
+
+
+def _get_inlined(engine, function) -> list:
+    return [stat[2] for stat in engine.get_inline_stats(function)]
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded", "register"])
+@pytest.mark.parametrize("n", [0, 5, 50])
+def test_same_results(backend, n):
+    engine = _make_engine(backend=backend)
+    expected = calls_all(n)
+    # Run it twice, so that the second run uses the inlined code.
+    assert engine.run_function(with_engine(calls_all)(n)) == expected
+    assert engine.run_function(with_engine(calls_all)(n)) == expected
+    assert len(engine._call_stack) == 0
+
+
+def test_not_inlined_by_default():
+    engine = NAFTEngine()
+    engine.run_function(with_engine(calls_all)(50))
+    assert engine.get_inline_stats(calls_all) == []
+
+
+def test_small_functions_inlined():
+    engine = _make_engine()
+    engine.run_function(with_engine(calls_all)(50))
+    # some_func is called from some_other_func, which is inlined, so it's only inlined into some_other_func.
+    assert sorted(_get_inlined(engine, calls_all)) == ["adds", "clamps", "some_other_func"]
+    assert _get_inlined(engine, some_other_func) == ["some_func"]
+
+    engine.run_function(with_engine(calls_all)(50))
+    for name, offset, inlined_name, hits, misses in engine.get_inline_stats(calls_all):
+        assert hits >= 50
+        assert misses == 0
+
+
+def test_calls_not_seen_by_hooks():
+    class CallCounter(EngineHook):
+        def __init__(self):
+            self.calls = 0
+
+        def on_call(self, state):
+            self.calls += 1
+
+    engine = _make_engine()
+    engine.run_function(with_engine(calls_all)(50))
+    counter = CallCounter()
+    engine.add_hook(counter)
+    engine.run_function(with_engine(calls_all)(10))
+    # calls_all itself, the recursive calls to counts, and some_func, as calls inside inlined functions aren't inlined
+    # again. packs and loops are only called once each.
+    assert counter.calls == 1 + 10 * 3 + 2
+
+
+def test_guard_miss_calls_function():
+    engine = _make_engine()
+    global clamps
+    original = clamps
+    engine.run_function(with_engine(calls_all)(50))
+    try:
+        clamps = some_func
+        assert engine.run_function(with_engine(calls_all)(50)) == calls_all(50)
+    finally:
+        clamps = original
+    stats = {stat[2]: stat[3:] for stat in engine.get_inline_stats(calls_all)}
+    assert stats["clamps"] == (0, 50)
+
+
+def test_wrapped_functions():
+    engine = _make_engine()
+    expected = 0
+    for i in range(50):
+        expected = expected + i + i + 1
+    assert engine.run_function(with_engine(calls_wrapped)(50)) == expected
+    # Functions wrapped with options are run with those options, so they aren't inlined.
+    assert _get_inlined(engine, calls_wrapped) == ["adds"]
+
+
+def test_traceback_through_inlined_call(capsys):
+    tracebacks = []
+    for engine in (NAFTEngine(), _make_engine()):
+        # Run it once without failing, so that fails_after is inlined.
+        engine.run_function(with_engine(calls_failing)(20))
+        with pytest.raises(NameError) as info:
+            engine.run_function(with_engine(calls_failing)(30))
+        tracebacks.append(info.value.__cause__._tb)
+    assert _get_inlined(engine, calls_failing) == ["fails_after"]
+
+    plain, inlined = tracebacks
+    while plain is not None:
+        assert inlined.tb_frame.f_code is plain.tb_frame.f_code
+        assert inlined.tb_lineno == plain.tb_lineno
+        assert inlined.tb_frame.f_locals == plain.tb_frame.f_locals
+        plain, inlined = plain.tb_next, inlined.tb_next
+    assert inlined is None
+
+
+def test_can_inline():
+    engine = _make_engine()
+    engine.run_function(with_engine(calls_all)(50))
+    # Recursive, with packed arguments, and with a loop.
+    assert not {"counts", "packs", "loops"} & set(_get_inlined(engine, calls_all))
+    assert inline.MAX_INLINE_SIZE < 100
+
+
+def test_running_function_keeps_its_code():
+    engine = _make_engine()
+    decoded = engine.code_cache.get(calls_all.__code__)
+    engine.run_function(with_engine(calls_all)(50))
+    # The first run was started with the code before anything was inlined.
+    assert decoded.inlined == []
+    assert engine.code_cache.get(calls_all.__code__) is not decoded
+
+
+def add1(a):
+    return a + 1
+
+
+def add100(a):
+    return a + 100
+
+
+def calls_add1(n):
+    total = 0
+    for i in range(n):
+        total = total + add1(i)
+    return total
+
+
+def test_code_reassigned():
+    engine = _make_engine()
+    original = add1.__code__
+    assert engine.run_function(with_engine(calls_add1)(50)) == 1275
+    assert _get_inlined(engine, calls_add1) == ["add1"]
+    try:
+        add1.__code__ = add100.__code__
+        assert engine.run_function(with_engine(calls_add1)(50)) == 6225
+    finally:
+        add1.__code__ = original
+    ((name, offset, inlined_name, hits, misses),) = engine.get_inline_stats(calls_add1)
+    assert misses == 50
+
+
+def calls_even(n):
+    total = 0
+    for i in range(n):
+        total = total + is_even(i)
+    return total
+
+
+def is_even(n):
+    return True if not n else calls_even(0) == 0
+
+
+def test_mutual_recursion_not_inlined():
+    engine = _make_engine()
+    engine.run_function(with_engine(calls_even)(50))
+    assert _get_inlined(engine, calls_even) == []
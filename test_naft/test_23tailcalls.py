@@ -0,0 +1,174 @@
+"""
+Tail-call elimination tests.
+"""
+import pytest
+
+from naft.code import CodeCache
+from naft.engine import NAFTEngine
+from naft.hooks import EngineHook
+from naft.wrapper import with_engine
+
+
+class Depths:
+    """
+    Records the depth of the engine's call stack when called.
+
+    This is a callable object rather than a function, so that the engine calls it natively.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.depths = []
+
+    def __call__(self):
+        self.depths.append(len(self.engine._call_stack))
+        return 0
+
+
+depths = Depths()
+
+
+def count(n, acc=0):
+    if not n:
+        return acc
+    return count(n - 1, acc + 1)
+
+
+def count_kw(n, acc=0):
+    if not n:
+        return acc
+    return count_kw(n - 1, acc=acc + 1)
+
+
+def count_ex(n, *args):
+    if not n:
+        return len(args)
+    return count_ex(n - 1, *args)
+
+
+def is_even(n):
+    if not n:
+        return True
+    return is_odd(n - 1)
+
+
+def is_odd(n):
+    if not n:
+        return False
+    return is_even(n - 1)
+
+
+def measures(n):
+    if not n:
+        return depths()
+    return measures(n - 1)
+
+
+def fails(n):
+    if not n:
+        return missing  # noqa
+    return fails(n - 1)
+
+
+def not_tail(n):
+    if not n:
+        return 0
+    return not_tail(n - 1) + 1
+
+
+@with_engine(tail_calls=True)
+def wrapped_count(n, acc=0):
+    if not n:
+        return acc
+    return wrapped_count(n - 1, acc + 1)
+
+
+def _make_engine(**kwargs) -> NAFTEngine:
+    return NAFTEngine(code_cache=CodeCache(tail_calls=True), recursion_limit=100, **kwargs)
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded", "register"])
+def test_deep_tail_recursion(backend):
+    engine = _make_engine(backend=backend)
+    assert engine.run_function(with_engine(count)(1000)) == 1000
+    assert engine.run_function(with_engine(count_kw)(1000)) == 1000
+    assert engine.run_function(with_engine(count_ex)(1000, 1, 2)) == 2
+    assert len(engine._call_stack) == 0
+
+
+def test_off_by_default(capsys):
+    engine = NAFTEngine(recursion_limit=100)
+    with pytest.raises(RecursionError):
+        engine.run_function(with_engine(count)(1000))
+    assert engine.code_cache.get(count.__code__).tail_calls == []
+
+
+def test_mutual_recursion():
+    engine = _make_engine()
+    assert engine.run_function(with_engine(is_even)(1001)) is False
+    assert engine.run_function(with_engine(is_odd)(1001)) is True
+
+
+def test_constant_space():
+    engine = _make_engine()
+    depths.engine = engine
+    depths.depths = []
+    engine.run_function(with_engine(measures)(1000))
+    assert depths.depths == [1]
+    # The states are re-used, rather than a new state being allocated for every call.
+    assert len(engine.code_cache.get(measures.__code__).free_states) == 2
+
+
+def test_only_tail_calls(capsys):
+    engine = _make_engine()
+    decoded = engine.code_cache.get(not_tail.__code__)
+    assert decoded.tail_calls == []
+    with pytest.raises(RecursionError):
+        engine.run_function(with_engine(not_tail)(1000))
+
+
+def test_per_function(capsys):
+    engine = NAFTEngine(recursion_limit=100)
+    assert engine.run_function(wrapped_count(1000)) == 1000
+    assert engine.code_cache.get(wrapped_count._callable.__code__).tail_calls == []
+
+    # Only the wrapped function keeps its frame; the functions it calls use the engine's setting.
+    engine = _make_engine()
+    with pytest.raises(NameError) as info:
+        engine.run_function(with_engine(tail_calls=False)(fails)(1000))
+    tb = info.value.__cause__._tb
+    assert tb.tb_frame.f_locals == {"n": 1000}
+    assert tb.tb_elided == 0
+    assert tb.tb_next.tb_frame.f_locals == {"n": 0}
+    assert tb.tb_next.tb_elided == 999
+
+
+def test_hooks_keep_frames(capsys):
+    class Calls(EngineHook):
+        def __init__(self):
+            self.calls = 0
+            self.returns = 0
+
+        def on_call(self, state):
+            self.calls += 1
+
+        def on_return(self, state, value):
+            self.returns += 1
+
+    engine = _make_engine()
+    hook = Calls()
+    engine.add_hook(hook)
+    assert engine.run_function(with_engine(count)(50)) == 50
+    assert hook.calls == hook.returns == 51
+
+
+def test_traceback_notes_elided_frames(capsys):
+    engine = _make_engine()
+    with pytest.raises(NameError) as info:
+        engine.run_function(with_engine(fails)(1000))
+    tb = info.value.__cause__._tb
+    # Only the last call is left.
+    assert tb.tb_next is None
+    assert tb.tb_frame.f_locals == {"n": 0}
+    assert tb.tb_elided == 1000
+    assert "1000 frames elided by tail calls" in capsys.readouterr().err
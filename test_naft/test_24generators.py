@@ -0,0 +1,297 @@
+"""
+Interpreted generator and coroutine tests.
+"""
+from __future__ import generator_stop
+
+import asyncio
+import collections.abc
+
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.generator import NCoroutine, NGenerator
+from naft.hooks import EngineHook
+from naft.wrapper import with_engine
+
+# Everything the generators below have run, so that the tests can check when they ran.
+ran = []
+
+
+def counts(n):
+    for i in range(n):
+        ran.append(i)
+        sent = yield i
+        if sent is not None:
+            yield sent * 10
+    return "done"
+
+
+def delegates(n):
+    result = yield from counts(n)
+    yield result
+    yield from [7, 8]
+
+
+def consumes(n):
+    total = 0
+    for value in delegates(n):
+        if isinstance(value, int):
+            total = total + value
+    return total, list(counts(3))
+
+
+def native_catches():
+    try:
+        yield 1
+    except ValueError:
+        return "caught"
+
+
+def native_finally():
+    try:
+        yield 1
+        yield 2
+    finally:
+        ran.append("closed")
+
+
+# Interpreted code can't catch exceptions, so this is called natively.
+native_catches._no_naft_execute = True
+
+
+def delegates_to(iterator):
+    result = yield from iterator
+    yield result
+
+
+def fails(n):
+    for i in range(n):
+        yield i
+    yield missing  # noqa
+
+
+def consumes_failing(n):
+    return list(fails(n))
+
+
+def swallows(gen):
+    try:
+        next(gen)
+    except NameError:
+        return "caught"
+
+
+# Called natively, so that it can catch the exception raised inside the interpreted generator.
+swallows._no_naft_execute = True
+
+
+def five():
+    return 5
+
+
+def swallows_then_calls():
+    return swallows(fails(0)), five()
+
+
+def drives(n):
+    gen = counts(n)
+    first = next(gen)
+    second = gen.send(5)
+    gen.close()
+    return first, second, list(gen)
+
+
+def throws_into():
+    gen = delegates_to(native_catches())
+    next(gen)
+    return gen.throw(ValueError)
+
+
+def stops():
+    yield next(iter([]))
+
+
+class Receiver:
+    def method(self, n):
+        yield from range(n)
+
+
+async def adds(a):
+    return a + 1
+
+
+async def awaits(a):
+    b = await adds(a)
+    await asyncio.sleep(0)
+    return b + await adds(b)
+
+
+def _engine(backend="stack"):
+    return NAFTEngine(backend=backend)
+
+
+@pytest.fixture(autouse=True)
+def clear_ran():
+    del ran[:]
+
+
+def test_lazy():
+    gen = _engine().run_function(with_engine(counts)(3))
+    assert isinstance(gen, NGenerator)
+    assert isinstance(gen, collections.abc.Generator)
+    assert ran == []
+    assert next(gen) == 0
+    assert ran == [0]
+    assert next(gen) == 1
+    assert ran == [0, 1]
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded", "register"])
+def test_same_results(backend):
+    engine = _engine(backend)
+    assert list(engine.run_function(with_engine(counts)(5))) == list(counts(5))
+    assert list(engine.run_function(with_engine(delegates)(3))) == list(delegates(3))
+    assert engine.run_function(with_engine(consumes)(10)) == consumes(10)
+    assert list(engine.run_function(with_engine(Receiver().method)(3))) == [0, 1, 2]
+    assert len(engine._call_stack) == 0
+
+
+def test_send():
+    gen = _engine().run_function(with_engine(counts)(3))
+    with pytest.raises(TypeError):
+        gen.send(1)
+    assert gen.send(None) == 0
+    assert gen.send(5) == 50
+    assert next(gen) == 1
+    assert list(gen) == [2]
+    with pytest.raises(StopIteration):
+        next(gen)
+
+
+def test_return_value():
+    gen = _engine().run_function(with_engine(counts)(1))
+    next(gen)
+    with pytest.raises(StopIteration) as info:
+        next(gen)
+    assert info.value.value == "done"
+
+
+def test_yield_from_delegates():
+    engine = _engine()
+    gen = engine.run_function(with_engine(delegates)(3))
+    assert next(gen) == 0
+    assert isinstance(gen.gi_yieldfrom, NGenerator)
+    # Values sent in are passed straight on.
+    assert gen.send(4) == 40
+    assert list(gen) == [1, 2, "done", 7, 8]
+    assert gen.gi_yieldfrom is None
+
+
+def test_throw():
+    gen = _engine().run_function(with_engine(counts)(3))
+    next(gen)
+    with pytest.raises(ValueError):
+        gen.throw(ValueError("thrown"))
+    with pytest.raises(StopIteration):
+        next(gen)
+
+    # A delegated iterator gets the exception first.
+    gen = _engine().run_function(with_engine(delegates_to)(native_catches()))
+    assert next(gen) == 1
+    assert gen.throw(ValueError) == "caught"
+
+
+def test_close():
+    gen = _engine().run_function(with_engine(delegates_to)(native_finally()))
+    assert next(gen) == 1
+    gen.close()
+    assert ran == ["closed"]
+    with pytest.raises(StopIteration):
+        next(gen)
+    # Closing it again does nothing.
+    gen.close()
+
+
+def test_constant_memory():
+    gen = _engine().run_function(with_engine(counts)(10000))
+    state = gen._state
+    size = len(state.stack)
+    depths = set()
+    for i, value in enumerate(gen):
+        assert value == i
+        depths.add(state.sp)
+    # Only the iterator of the loop is ever left on the stack between items.
+    assert depths == {1}
+    assert len(state.stack) == size
+
+
+def test_exception_traceback(capsys):
+    with pytest.raises(NameError) as info:
+        _engine().run_function(with_engine(consumes_failing)(3))
+    tb = info.value.__cause__._tb
+    assert tb.tb_frame.f_code is consumes_failing.__code__
+    assert tb.tb_next.tb_frame.f_code is fails.__code__
+    assert tb.tb_next.tb_frame.f_locals == {"n": 3, "i": 2}
+
+    # Iterated outside of the engine, the generator is the only frame.
+    gen = _engine().run_function(with_engine(fails)(1))
+    assert next(gen) == 0
+    with pytest.raises(NameError) as info:
+        next(gen)
+    assert info.value.__cause__._tb.tb_frame.f_code is fails.__code__
+
+
+def test_stop_iteration_inside():
+    engine = _engine()
+    with pytest.raises(RuntimeError):
+        next(engine.run_function(with_engine(stops)()))
+    assert len(engine._call_stack) == 0
+
+
+def test_hooks_see_resumes():
+    class Counter(EngineHook):
+        def __init__(self):
+            self.calls = []
+            self.returns = []
+
+        def on_call(self, state):
+            self.calls.append(state._name)
+
+        def on_return(self, state, value):
+            self.returns.append(value)
+
+    engine = _engine()
+    counter = Counter()
+    engine.add_hook(counter)
+    assert list(engine.run_function(with_engine(counts)(2))) == [0, 1]
+    assert counter.calls == ["counts"] * 3
+    assert counter.returns == [0, 1, "done"]
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded", "register"])
+def test_coroutines(backend):
+    engine = _engine(backend)
+    coro = engine.run_function(with_engine(awaits)(1))
+    assert isinstance(coro, NCoroutine)
+    assert isinstance(coro, collections.abc.Coroutine)
+    with pytest.raises(TypeError):
+        iter(coro)
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(coro) == 5
+    finally:
+        loop.close()
+
+
+def test_native_code_swallows_exception(capsys):
+    engine = _engine()
+    assert engine.run_function(with_engine(swallows_then_calls)()) == ("caught", 5)
+    assert len(engine._call_stack) == 0
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded", "register"])
+def test_methods_from_interpreted_code(backend):
+    engine = _engine(backend)
+    assert engine.run_function(with_engine(drives)(3)) == (0, 50, [])
+    assert engine.run_function(with_engine(throws_into)()) == "caught"
+    assert len(engine._call_stack) == 0
@@ -0,0 +1,138 @@
+"""
+asyncio integration tests.
+"""
+import asyncio
+import types
+
+import pytest
+
+from naft.engine import NAFTEngine
+from naft.generator import NCoroutine
+from naft.wrapper import with_engine
+
+# The order the coroutines below ran in.
+events = []
+
+
+async def handler(name, steps):
+    total = 0
+    for step in range(steps):
+        events.append((name, step))
+        await asyncio.sleep(0)
+        total = total + step
+    return name, total
+
+
+async def waits(future):
+    value = await future
+    return value * 2
+
+
+async def calls_handler(name):
+    result = await handler(name, 2)
+    return result
+
+
+@types.coroutine
+def generator_based(future):
+    value = yield from future
+    return value + 1
+
+
+async def fails():
+    await asyncio.sleep(0)
+    return missing  # noqa
+
+
+def not_a_coroutine():
+    return 1
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(autouse=True)
+def clear_events():
+    del events[:]
+
+
+def test_run_coroutine(loop):
+    engine = NAFTEngine()
+    coroutine = engine.run_coroutine(with_engine(handler)("a", 3))
+    assert isinstance(coroutine, NCoroutine)
+    assert events == []
+    assert loop.run_until_complete(coroutine) == ("a", 3)
+
+
+def test_not_a_coroutine():
+    with pytest.raises(TypeError):
+        NAFTEngine().run_coroutine(with_engine(not_a_coroutine)())
+
+
+@pytest.mark.parametrize("backend", ["stack", "threaded", "register"])
+def test_concurrent(loop, backend):
+    engine = NAFTEngine(backend=backend)
+    coroutines = [engine.run_coroutine(with_engine(handler)(i, 3)) for i in range(1000)]
+    results = loop.run_until_complete(asyncio.gather(*coroutines, loop=loop))
+    assert results == [(i, 3) for i in range(1000)]
+    # Every coroutine ran its first step before any ran its second, so none of them blocked the loop.
+    assert [step for name, step in events] == [0] * 1000 + [1] * 1000 + [2] * 1000
+    assert len(engine._call_stack) == 0
+
+
+def test_loop_runs_between_steps(loop):
+    engine = NAFTEngine()
+    depths = []
+
+    async def native():
+        for _ in range(3):
+            # Nothing interpreted is running while the loop runs this.
+            depths.append(len(engine._call_stack))
+            await asyncio.sleep(0)
+
+    interpreted = engine.run_coroutine(with_engine(handler)("a", 3))
+    loop.run_until_complete(asyncio.gather(interpreted, native(), loop=loop))
+    assert depths == [0, 0, 0]
+    assert [name for name, step in events] == ["a"] * 3
+
+
+def test_awaits_futures(loop):
+    engine = NAFTEngine()
+    future = loop.create_future()
+    loop.call_soon(future.set_result, 21)
+    assert loop.run_until_complete(engine.run_coroutine(with_engine(waits)(future))) == 42
+
+    future = loop.create_future()
+    loop.call_soon(future.set_result, 1)
+    assert loop.run_until_complete(engine.run_coroutine(with_engine(generator_based)(future))) == 2
+
+
+def test_nested(loop):
+    engine = NAFTEngine()
+    assert loop.run_until_complete(engine.run_coroutine(with_engine(calls_handler)("a"))) == ("a", 1)
+
+
+def test_exceptions(loop, capsys):
+    engine = NAFTEngine()
+    future = loop.create_future()
+    loop.call_soon(future.set_exception, ValueError("failed"))
+    with pytest.raises(ValueError):
+        loop.run_until_complete(engine.run_coroutine(with_engine(waits)(future)))
+
+    with pytest.raises(NameError):
+        loop.run_until_complete(engine.run_coroutine(with_engine(fails)()))
+    assert len(engine._call_stack) == 0
+
+
+def test_cancel(loop):
+    engine = NAFTEngine()
+    future = loop.create_future()
+    task = loop.create_task(engine.run_coroutine(with_engine(waits)(future)))
+    loop.call_soon(task.cancel)
+    with pytest.raises(asyncio.CancelledError):
+        loop.run_until_complete(task)
+    assert future.cancelled()